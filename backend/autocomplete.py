@@ -0,0 +1,428 @@
+# Prefix-trie autocomplete for product names, brands and categories
+import time
+import heapq
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from price_stamps import PRICE_STAMP_POLL, price_stamps
+from search_engine import SEARCH_INDEX_REFRESH
+
+logger = logging.getLogger(__name__)
+
+# Entry kinds returned with each suggestion
+PRODUCT = "product"
+BRAND = "brand"
+CATEGORY = "category"
+
+# Base weight per kind so a bare brand/category ranks near its popular products
+KIND_WEIGHTS = {PRODUCT: 1.0, BRAND: 2.0, CATEGORY: 2.0}
+SUFFIX_WEIGHT = 0.8  # matching a later word of a name ranks below matching its start
+
+# Product fields autocomplete needs from the stamp poll
+PRODUCT_FIELDS = ("name", "brand", "is_active")
+
+
+class _Node:
+    """Radix-tree node: edges are labelled with strings, not single characters"""
+
+    __slots__ = ("label", "children", "entries", "best")
+
+    def __init__(self, label: str = ""):
+        self.label = label  # edge label leading into this node
+        self.children: Dict[str, "_Node"] = {}  # first char of child label -> child
+        self.entries: Dict[str, float] = {}  # entry key -> weight, for phrases ending here
+        self.best = 0.0  # highest weight anywhere in this subtree
+
+
+class SuggestionTrie:
+    """Compressed trie with subtree max-weights for best-first top-k search.
+
+    Each node records the best weight in its subtree, so a query walks to the
+    prefix node and then expands children in weight order, stopping once k
+    results are found - the cost depends on k, not on how many phrases share
+    the prefix.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self._entries: Dict[str, dict] = {}  # entry key -> {"text", "kind", "id", "phrase", "weight"}
+
+    # ---------- maintenance ----------
+
+    def add(self, key: str, text: str, kind: str, entry_id: str, weight: float, phrase: Optional[str] = None):
+        """Insert or replace an entry reachable by ``phrase`` (default: ``text``)"""
+        self.remove(key)
+        phrase = " ".join((phrase or text).lower().split())
+        if not phrase:
+            return
+        self._entries[key] = {"text": text, "kind": kind, "id": entry_id, "phrase": phrase, "weight": weight}
+        node, path = self._insert_path(phrase)
+        node.entries[key] = weight
+        self._refresh(path)
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        path = self._find_path(entry["phrase"])
+        if path is None:
+            return
+        path[-1].entries.pop(key, None)
+        self._refresh(path)
+
+    def set_weight(self, key: str, weight: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        path = self._find_path(entry["phrase"])
+        if path is None:
+            return
+        entry["weight"] = weight
+        path[-1].entries[key] = weight
+        self._refresh(path)
+
+    def _insert_path(self, phrase: str) -> Tuple[_Node, List[_Node]]:
+        node = self.root
+        path = [node]
+        rest = phrase
+        while rest:
+            child = node.children.get(rest[0])
+            if child is None:
+                child = _Node(rest)
+                node.children[rest[0]] = child
+                path.append(child)
+                return child, path
+
+            label = child.label
+            common = 0
+            while common < len(label) and common < len(rest) and label[common] == rest[common]:
+                common += 1
+
+            if common < len(label):
+                # Split the edge at the divergence point
+                split = _Node(label[:common])
+                child.label = label[common:]
+                split.children[child.label[0]] = child
+                split.best = child.best
+                node.children[rest[0]] = split
+                child = split
+
+            node = child
+            path.append(node)
+            rest = rest[common:]
+        return node, path
+
+    def _find_path(self, phrase: str) -> Optional[List[_Node]]:
+        node = self.root
+        path = [node]
+        rest = phrase
+        while rest:
+            child = node.children.get(rest[0])
+            if child is None or not rest.startswith(child.label):
+                return None
+            node = child
+            path.append(node)
+            rest = rest[len(child.label):]
+        return path
+
+    @staticmethod
+    def _refresh(path: List[_Node]):
+        """Recompute subtree maxima bottom-up along an edited path"""
+        for node in reversed(path):
+            best = max(node.entries.values(), default=0.0)
+            for child in node.children.values():
+                if child.best > best:
+                    best = child.best
+            node.best = best
+
+    # ---------- querying ----------
+
+    def _locate(self, prefix: str) -> Optional[_Node]:
+        node = self.root
+        rest = prefix
+        while rest:
+            child = node.children.get(rest[0])
+            if child is None:
+                return None
+            label = child.label
+            if len(rest) <= len(label):
+                return child if label.startswith(rest) else None
+            if not rest.startswith(label):
+                return None
+            node = child
+            rest = rest[len(label):]
+        return node
+
+    def top_k(self, prefix: str, k: int = 10, kinds: Optional[List[str]] = None) -> List[dict]:
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        start = self._locate(prefix)
+        if start is None:
+            return []
+
+        results = []
+        seen = set()
+        counter = 0
+        # Max-heap of (-weight, tiebreak, is_entry, payload)
+        heap = [(-start.best, counter, False, start)]
+        while heap and len(results) < k:
+            neg_weight, _, is_entry, payload = heapq.heappop(heap)
+            if is_entry:
+                entry = self._entries[payload]
+                if kinds and entry["kind"] not in kinds:
+                    continue
+                dedupe = (entry["kind"], entry["id"])
+                if dedupe in seen:
+                    continue
+                seen.add(dedupe)
+                results.append({
+                    "text": entry["text"],
+                    "type": entry["kind"],
+                    "id": entry["id"],
+                    "score": round(-neg_weight, 3)
+                })
+                continue
+            for key, weight in payload.entries.items():
+                counter += 1
+                heapq.heappush(heap, (-weight, counter, True, key))
+            for child in payload.children.values():
+                counter += 1
+                heapq.heappush(heap, (-child.best, counter, False, child))
+        return results
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def keys(self, kind: str) -> List[str]:
+        return [key for key, entry in self._entries.items() if entry["kind"] == kind]
+
+
+def _suffix_phrases(text: str) -> List[str]:
+    """The phrase plus each later word onward, so "Tata Salt" matches "salt" too"""
+    words = text.lower().split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class Autocomplete:
+    """Catalog type-ahead: product, brand and category names weighted by popularity.
+
+    After the initial build every change is applied in place: product edits
+    from any worker arrive through the ``price_stamps`` poll, popularity is
+    bumped per order and periodically re-read from the product sales
+    rollups, and brand weights keep a running sum of their products'
+    popularity.
+    """
+
+    def __init__(self):
+        self.trie = SuggestionTrie()
+        self.popularity: Dict[str, float] = {}  # product_id -> units ordered
+        self._product_keys: Dict[str, List[str]] = {}
+        self._product_brand: Dict[str, str] = {}  # product_id -> brand key
+        self._product_state: Dict[str, tuple] = {}  # product_id -> (name, brand) as indexed
+        self._brands: Dict[str, dict] = {}  # brand key -> {"name", "products", "popularity"}
+        self.ready = False
+        self.built_at: Optional[float] = None
+        self.queries = 0
+        self.updates = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+        price_stamps.subscribe(PRODUCT_FIELDS, self._apply_stamps)
+
+    def _product_weight(self, product_id: str) -> float:
+        return KIND_WEIGHTS[PRODUCT] * (1.0 + self.popularity.get(product_id, 0.0))
+
+    def upsert_product(self, product: dict):
+        product_id = product.get("id")
+        if not product_id:
+            return
+        active = product.get("is_active", True) and product.get("name")
+        state = (product.get("name"), product.get("brand")) if active else None
+        if state == self._product_state.get(product_id):
+            return
+        self.remove_product(product_id)
+        if state is None:
+            return
+        self._product_state[product_id] = state
+        self.updates += 1
+
+        weight = self._product_weight(product_id)
+        keys = []
+        for i, phrase in enumerate(_suffix_phrases(product["name"])):
+            key = f"{PRODUCT}:{product_id}:{i}"
+            self.trie.add(key, product["name"], PRODUCT, product_id, weight if i == 0 else weight * SUFFIX_WEIGHT, phrase)
+            keys.append(key)
+        self._product_keys[product_id] = keys
+
+        brand = product.get("brand")
+        if isinstance(brand, str) and brand.strip():
+            brand_key = brand.strip().lower()
+            self._product_brand[product_id] = brand_key
+            entry = self._brands.setdefault(brand_key, {"name": brand.strip(), "products": set(), "popularity": 0.0})
+            entry["products"].add(product_id)
+            entry["popularity"] += self.popularity.get(product_id, 0.0)
+            self._refresh_brand(brand_key)
+
+    def remove_product(self, product_id: str):
+        self._product_state.pop(product_id, None)
+        for key in self._product_keys.pop(product_id, []):
+            self.trie.remove(key)
+        brand_key = self._product_brand.pop(product_id, None)
+        if brand_key:
+            entry = self._brands[brand_key]
+            entry["products"].discard(product_id)
+            entry["popularity"] -= self.popularity.get(product_id, 0.0)
+            self._refresh_brand(brand_key)
+
+    def _refresh_brand(self, brand_key: str):
+        """Brand weight follows the combined popularity of its products"""
+        brand = self._brands[brand_key]
+        key = f"{BRAND}:{brand_key}"
+        if not brand["products"]:
+            self.trie.remove(key)
+            del self._brands[brand_key]
+            return
+        weight = KIND_WEIGHTS[BRAND] * (1.0 + max(brand["popularity"], 0.0))
+        if key in self.trie:
+            self.trie.set_weight(key, weight)
+        else:
+            self.trie.add(key, brand["name"], BRAND, brand_key, weight)
+
+    def upsert_category(self, category: dict):
+        category_id = category.get("id")
+        key = f"{CATEGORY}:{category_id}"
+        if not category.get("is_active", True) or not category.get("name"):
+            self.trie.remove(key)
+            return
+        self.trie.add(key, category["name"], CATEGORY, category_id, KIND_WEIGHTS[CATEGORY])
+
+    def _set_popularity(self, product_id: str, units: float):
+        """Re-weight a product and its brand for a new popularity"""
+        delta = units - self.popularity.get(product_id, 0.0)
+        if not delta:
+            return
+        if units:
+            self.popularity[product_id] = units
+        else:
+            self.popularity.pop(product_id, None)
+        weight = self._product_weight(product_id)
+        for i, key in enumerate(self._product_keys.get(product_id, [])):
+            self.trie.set_weight(key, weight if i == 0 else weight * SUFFIX_WEIGHT)
+        brand_key = self._product_brand.get(product_id)
+        if brand_key:
+            self._brands[brand_key]["popularity"] += delta
+            self._refresh_brand(brand_key)
+
+    def record_order(self, items: List[dict]):
+        """Bump popularity for ordered products and re-weight their entries"""
+        for item in items:
+            product_id = item.get("product_id")
+            quantity = item.get("quantity", 0) or 0
+            if not product_id or quantity <= 0:
+                continue
+            self._set_popularity(product_id, self.popularity.get(product_id, 0.0) + quantity)
+
+    def suggest(self, prefix: str, k: int = 10, kinds: Optional[List[str]] = None) -> List[dict]:
+        self.queries += 1
+        return self.trie.top_k(prefix, k, kinds)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "entries": len(self.trie),
+            "queries": self.queries,
+            "updates": self.updates,
+            "built_at": self.built_at
+        }
+
+    # ---------- database integration ----------
+
+    def _apply_stamps(self, products: List[dict], full: bool):
+        """Products changed on any worker; a full reload also reveals deletions"""
+        if not self.ready:
+            return
+        for product in products:
+            self.upsert_product(product)
+        if full:
+            present = {product["id"] for product in products}
+            for product_id in [pid for pid in self._product_state if pid not in present]:
+                self.remove_product(product_id)
+
+    async def _load_popularity(self, db) -> Dict[str, float]:
+        """Units sold per product, summed over the daily product sales rollups"""
+        rows = db.sales_rollups.aggregate([
+            {"$match": {"grain": "day", "dim": "product"}},
+            {"$group": {"_id": "$key", "units": {"$sum": "$quantity"}}}
+        ])
+        return {row["_id"]: float(row["units"] or 0) async for row in rows if row["_id"]}
+
+    async def _load_categories(self, db) -> List[dict]:
+        return await db.categories.find(
+            {"is_active": True},
+            {"_id": 0, "id": 1, "name": 1, "is_active": 1}
+        ).to_list(None)
+
+    async def rebuild(self, db):
+        started = time.perf_counter()
+        popularity = await self._load_popularity(db)
+        products = await db.products.find(
+            {"is_active": True},
+            {"_id": 0, "id": 1, "name": 1, "brand": 1, "is_active": 1}
+        ).to_list(None)
+        categories = await self._load_categories(db)
+
+        self.trie = SuggestionTrie()
+        self.popularity = popularity
+        self._product_keys = {}
+        self._product_brand = {}
+        self._product_state = {}
+        self._brands = {}
+        for product in products:
+            self.upsert_product(product)
+        for category in categories:
+            self.upsert_category(category)
+        self.ready = True
+        self.built_at = time.time()
+        logger.info(f"Autocomplete trie built: {len(self.trie)} entries in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    async def refresh(self, db):
+        """Re-read popularity and categories, touching only entries that changed"""
+        popularity = await self._load_popularity(db)
+        for product_id in set(popularity) | set(self.popularity):
+            self._set_popularity(product_id, popularity.get(product_id, 0.0))
+        categories = await self._load_categories(db)
+        present = {category["id"] for category in categories}
+        for category in categories:
+            self.upsert_category(category)
+        for key in [k for k in self.trie.keys(CATEGORY) if k.split(":", 1)[1] not in present]:
+            self.trie.remove(key)
+
+    async def _refresh_loop(self, db):
+        since_refresh = 0.0
+        while True:
+            await asyncio.sleep(PRICE_STAMP_POLL)
+            since_refresh += PRICE_STAMP_POLL
+            try:
+                # Product edits from other workers arrive through the stamp poll
+                await price_stamps.refresh()
+                if since_refresh >= SEARCH_INDEX_REFRESH:
+                    since_refresh = 0.0
+                    await self.refresh(db)
+            except Exception as e:
+                logger.warning(f"Autocomplete refresh failed: {e}")
+
+    async def start(self, db):
+        await self.rebuild(db)
+        self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+# Global autocomplete instance
+autocomplete = Autocomplete()
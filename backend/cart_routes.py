@@ -1,12 +1,26 @@
 # Cart Management System
 from fastapi import APIRouter, HTTPException, Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 import uuid
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from product_loader import ProductLoader
+from price_stamps import price_stamps
+from stock_holds import stock_holds
+from pricing import delivery_fee
+from promotions import promotion_engine
 
 router = APIRouter(prefix="/api/cart", tags=["cart"])
 
+security = HTTPBearer()
+
+# Fields needed to price and display cart lines; only the thumbnail image
+CART_PRODUCT_PROJECTION = {"_id": 0, "images": {"$slice": 1}}
+
 class CartItemAdd(BaseModel):
     product_id: str
     variant_id: str
@@ -15,132 +29,309 @@ class CartItemAdd(BaseModel):
 class CartUpdate(BaseModel):
     items: List[CartItemAdd]
 
+CART_OPS = ("add", "set", "remove")
+MAX_CART_OPS = 200
+
+class CartOp(BaseModel):
+    op: str  # add | set | remove
+    product_id: str
+    variant_id: str
+    quantity: int = 1
+
+class CartOps(BaseModel):
+    ops: List[CartOp]
+
+# Store references (will be set from main server)
+db = None
+_current_user_dependency = None
+
+def set_db(database, current_user_dependency=None):
+    global db, _current_user_dependency
+    db = database
+    _current_user_dependency = current_user_dependency
+
+async def get_cart_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Resolve the caller with the main server's auth dependency"""
+    user = await _current_user_dependency(credentials)
+    return user.dict()
+
+def cart_product_loader() -> ProductLoader:
+    return ProductLoader(db, CART_PRODUCT_PROJECTION)
+
+def _line_filter(op: CartOp) -> dict:
+    return {"product_id": op.product_id, "variant_id": op.variant_id}
+
+def _cart_writes(user_id: str, ops: List[CartOp]) -> List[UpdateOne]:
+    """Translate cart operations into positional array updates.
+
+    Adds and quantity sets touch only the matching line via an array
+    filter; an add pushes a line only when the cart does not hold it yet,
+    so concurrent edits to different lines never overwrite each other.
+    A set never creates a line.
+    """
+    now = datetime.utcnow()
+    writes = [UpdateOne(
+        {"user_id": user_id},
+        {"$setOnInsert": {"user_id": user_id, "items": [], "updated_at": now}},
+        upsert=True
+    )]
+    for op in ops:
+        line = _line_filter(op)
+        array_filters = [{"line.product_id": op.product_id, "line.variant_id": op.variant_id}]
+        if op.op == "remove" or (op.op == "set" and op.quantity == 0):
+            writes.append(UpdateOne(
+                {"user_id": user_id},
+                {"$pull": {"items": line}, "$set": {"updated_at": now}}
+            ))
+            continue
+
+        if op.op == "add":
+            update = {"$inc": {"items.$[line].quantity": op.quantity}, "$set": {"updated_at": now}}
+        else:
+            update = {"$set": {"items.$[line].quantity": op.quantity, "updated_at": now}}
+        writes.append(UpdateOne(
+            {"user_id": user_id, "items": {"$elemMatch": line}},
+            update,
+            array_filters=array_filters
+        ))
+        if op.op != "add":
+            continue
+        writes.append(UpdateOne(
+            {"user_id": user_id, "items": {"$not": {"$elemMatch": line}}},
+            {"$push": {"items": {**line, "quantity": op.quantity, "added_at": now}},
+             "$set": {"updated_at": now}}
+        ))
+    return writes
+
+def _product_totals(quantities: dict) -> dict:
+    """Cart quantity per product from {(product_id, variant_id): quantity}"""
+    totals = {}
+    for (product_id, _), quantity in quantities.items():
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return totals
+
+async def _check_ops(user_id: str, ops: List[CartOp], loader: ProductLoader):
+    """Validate operations and check stock for all touched products in one query.
+
+    Each touched line's resulting quantity (current line plus the batch's
+    adds, or its set) must fit in its variant's stock, and the cart's total
+    for the product must fit in the product stock not held by other carts.
+    Setting the quantity of a line the cart does not hold is a 404.
+    """
+    if len(ops) > MAX_CART_OPS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CART_OPS} operations per request")
+    for op in ops:
+        if op.op not in CART_OPS:
+            raise HTTPException(status_code=400, detail=f"Unknown cart operation '{op.op}'")
+        if op.op == "add" and op.quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+        if op.op == "set" and op.quantity < 0:
+            raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+
+    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0, "items": 1}) or {}
+    quantities = {(i["product_id"], i["variant_id"]): i["quantity"] for i in cart.get("items", [])}
+    for op in ops:
+        key = (op.product_id, op.variant_id)
+        if op.op == "add":
+            quantities[key] = quantities.get(key, 0) + op.quantity
+        elif op.op == "remove" or op.quantity == 0:
+            quantities.pop(key, None)
+        elif key not in quantities:
+            raise HTTPException(status_code=404, detail="Item not in cart")
+        else:
+            quantities[key] = op.quantity
+
+    checked = {(op.product_id, op.variant_id) for op in ops} & set(quantities)
+    products = await loader.load_many(pid for pid, _ in checked)
+    for product_id, variant_id in checked:
+        product = products.get(product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product not found: {product_id}")
+        variant = loader.variant(product, variant_id)
+        if not variant:
+            raise HTTPException(status_code=404, detail=f"Variant not found: {variant_id}")
+        if quantities[(product_id, variant_id)] > variant["stock_quantity"]:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {product['name']}")
+
+    # Holds and checkout reservations are per product, across its variants
+    totals = _product_totals(quantities)
+    for product_id in {pid for pid, _ in checked}:
+        product = products[product_id]
+        if totals[product_id] > stock_holds.available(user_id, product_id, product.get("stock_quantity", 0)):
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {product['name']}")
+
+async def apply_cart_ops(user_id: str, ops: List[CartOp], loader: Optional[ProductLoader] = None) -> dict:
+    """Check and apply cart operations in a single ordered bulk write.
+
+    Returns the re-priced cart summary, which is stored back on the cart.
+    """
+    loader = loader or cart_product_loader()
+    await _check_ops(user_id, ops, loader)
+    try:
+        await db.carts.bulk_write(_cart_writes(user_id, ops), ordered=True)
+    except BulkWriteError as e:
+        # Two first writes raced on the unique user_id upsert; the cart exists now
+        if not any(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+            raise
+        await db.carts.bulk_write(_cart_writes(user_id, ops), ordered=True)
+    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+
+    # Holds follow the cart's resulting total for every touched product
+    totals = _product_totals({(i["product_id"], i["variant_id"]): i["quantity"] for i in cart.get("items", [])})
+    touched = {op.product_id for op in ops}
+    await stock_holds.set_holds(user_id, [(pid, totals.get(pid, 0)) for pid in touched])
+    return await load_cart_summary(cart, loader)
+
+def _price_line(item: dict, product: dict, variant: dict) -> dict:
+    price_stamps.observe(product)
+    return {
+        **item,
+        "product_name": product["name"],
+        "brand": product.get("brand"),
+        "brand_id": product.get("brand_id") or product.get("brand"),
+        "category_id": product.get("category_id"),
+        "image": product.get("images", [])[0] if product.get("images") else None,
+        "variant_name": variant["name"],
+        "pack_size": variant["pack_size"],
+        "mrp": variant["mrp"],
+        "price": variant["retailer_price"],
+        "total": variant["retailer_price"] * item["quantity"],
+        "stock_available": variant["stock_quantity"],
+        "pricing_version": product.get("pricing_version", 0)
+    }
+
+def _summary(lines: List[dict]) -> dict:
+    subtotal = sum(line["total"] for line in lines)
+    discount = promotion_engine.apply(lines)
+    savings = sum((line["mrp"] - line["price"]) * line["quantity"] for line in lines) + discount
+    return {
+        "items": lines,
+        "subtotal": subtotal,
+        "discount": discount,
+        "savings": savings,
+        "delivery_fee": delivery_fee(subtotal - discount) if lines else 0.0,
+        "item_count": len(lines)
+    }
+
+async def price_cart(cart: dict, loader: Optional[ProductLoader] = None):
+    """Price a cart, reusing stored lines whose product stamp is unchanged.
+
+    Only products that changed since the cart was last priced (or lines
+    that were never priced) are read from the catalog. Returns
+    (summary, changed) where ``changed`` means the stored summary is stale.
+    """
+    await price_stamps.refresh()
+    priced = {(line["product_id"], line["variant_id"]): line for line in cart.get("priced_items", [])}
+    stale = price_stamps.changed({line["product_id"]: line.get("pricing_version") for line in priced.values()})
+
+    items = cart.get("items", [])
+    reload_ids = [
+        item["product_id"] for item in items
+        if item["product_id"] in stale or (item["product_id"], item["variant_id"]) not in priced
+    ]
+    products = {}
+    if reload_ids:
+        loader = loader or cart_product_loader()
+        products = await loader.load_many(reload_ids)
+
+    lines = []
+    for item in items:
+        key = (item["product_id"], item["variant_id"])
+        if item["product_id"] in products:
+            product = products[item["product_id"]]
+            variant = loader.variant(product, item["variant_id"])
+            if variant:
+                lines.append(_price_line(item, product, variant))
+        else:
+            line = priced[key]
+            lines.append({**line, "quantity": item["quantity"], "total": line["price"] * item["quantity"]})
+
+    await promotion_engine.refresh()
+    summary = _summary(lines)
+    stored = {
+        "items": cart.get("priced_items", []),
+        "subtotal": cart.get("subtotal"),
+        "discount": cart.get("discount"),
+        "savings": cart.get("savings"),
+        "delivery_fee": cart.get("delivery_fee"),
+        "item_count": len(cart.get("priced_items", []))
+    }
+    return summary, summary != stored
+
+async def load_cart_summary(cart: dict, loader: Optional[ProductLoader] = None) -> dict:
+    """Cart summary, storing fresh totals when re-pricing changed them"""
+    summary, changed = await price_cart(cart, loader)
+    if changed:
+        # Skip the write if the cart was edited meanwhile; that edit re-prices it
+        await db.carts.update_one(
+            {"user_id": cart["user_id"], "updated_at": cart.get("updated_at")},
+            {"$set": {
+                "priced_items": summary["items"],
+                "subtotal": summary["subtotal"],
+                "discount": summary["discount"],
+                "savings": summary["savings"],
+                "delivery_fee": summary["delivery_fee"]
+            }}
+        )
+    return summary
+
 @router.get("")
-async def get_cart(current_user: dict, db: AsyncIOMotorDatabase):
+async def get_cart(current_user: dict = Depends(get_cart_user)):
     """Get current user's cart"""
     cart = await db.carts.find_one({"user_id": current_user["id"]})
-    
+
     if not cart:
         # Create empty cart
         cart = {
             "user_id": current_user["id"],
             "items": [],
+            "priced_items": [],
             "subtotal": 0.0,
+            "discount": 0.0,
+            "savings": 0.0,
+            "delivery_fee": 0.0,
             "updated_at": datetime.utcnow()
         }
-        await db.carts.insert_one(cart)
-    
-    # Enrich cart with product details
-    enriched_items = []
-    subtotal = 0.0
-    
-    for item in cart.get("items", []):
-        product = await db.products.find_one({"id": item["product_id"]})
-        if product:
-            variant = next(
-                (v for v in product.get("variants", []) if v["variant_id"] == item["variant_id"]),
-                None
-            )
-            if variant:
-                item_total = variant["retailer_price"] * item["quantity"]
-                enriched_items.append({
-                    **item,
-                    "product_name": product["name"],
-                    "brand": product.get("brand"),
-                    "image": product.get("images", [])[0] if product.get("images") else None,
-                    "variant_name": variant["name"],
-                    "pack_size": variant["pack_size"],
-                    "mrp": variant["mrp"],
-                    "price": variant["retailer_price"],
-                    "total": item_total,
-                    "stock_available": variant["stock_quantity"]
-                })
-                subtotal += item_total
-    
-    return {
-        "success": True,
-        "cart": {
-            "items": enriched_items,
-            "subtotal": subtotal,
-            "item_count": len(enriched_items)
-        }
-    }
+        try:
+            await db.carts.insert_one(cart)
+        except DuplicateKeyError:
+            # A concurrent request created it first
+            cart = await db.carts.find_one({"user_id": current_user["id"]})
+
+    # Stored totals are reused unless a product in the cart changed
+    return {"success": True, "cart": await load_cart_summary(cart)}
+
+@router.post("/ops")
+async def cart_ops(request: CartOps, current_user: dict = Depends(get_cart_user)):
+    """Apply a batch of add / set / remove operations and return the new cart"""
+    summary = await apply_cart_ops(current_user["id"], request.ops)
+    return {"success": True, "cart": summary}
 
 @router.post("/add")
-async def add_to_cart(item: CartItemAdd, current_user: dict, db: AsyncIOMotorDatabase):
+async def add_to_cart(item: CartItemAdd, current_user: dict = Depends(get_cart_user)):
     """Add item to cart"""
-    # Verify product and variant exist
-    product = await db.products.find_one({"id": item.product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    variant = next(
-        (v for v in product.get("variants", []) if v["variant_id"] == item.variant_id),
-        None
-    )
-    if not variant:
-        raise HTTPException(status_code=404, detail="Variant not found")
-    
-    # Check stock
-    if variant["stock_quantity"] < item.quantity:
-        raise HTTPException(status_code=400, detail="Insufficient stock")
-    
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
-    if not cart:
-        cart = {
-            "user_id": current_user["id"],
-            "items": [],
-            "updated_at": datetime.utcnow()
-        }
-        await db.carts.insert_one(cart)
-    
-    # Check if item already in cart
-    existing_item = next(
-        (i for i in cart["items"] if i["product_id"] == item.product_id and i["variant_id"] == item.variant_id),
-        None
-    )
-    
-    if existing_item:
-        # Update quantity
-        existing_item["quantity"] += item.quantity
-        await db.carts.update_one(
-            {"user_id": current_user["id"]},
-            {"$set": {"items": cart["items"], "updated_at": datetime.utcnow()}}
-        )
-    else:
-        # Add new item
-        new_item = {
-            "product_id": item.product_id,
-            "variant_id": item.variant_id,
-            "quantity": item.quantity,
-            "added_at": datetime.utcnow()
-        }
-        await db.carts.update_one(
-            {"user_id": current_user["id"]},
-            {"$push": {"items": new_item}, "$set": {"updated_at": datetime.utcnow()}}
-        )
-    
+    await apply_cart_ops(current_user["id"], [CartOp(op="add", **item.dict())])
     return {"success": True, "message": "Item added to cart"}
 
 @router.delete("/remove/{product_id}/{variant_id}")
-async def remove_from_cart(product_id: str, variant_id: str, current_user: dict, db: AsyncIOMotorDatabase):
+async def remove_from_cart(product_id: str, variant_id: str, current_user: dict = Depends(get_cart_user)):
     """Remove item from cart"""
-    await db.carts.update_one(
-        {"user_id": current_user["id"]},
-        {
-            "$pull": {"items": {"product_id": product_id, "variant_id": variant_id}},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
-    )
+    await apply_cart_ops(current_user["id"], [
+        CartOp(op="remove", product_id=product_id, variant_id=variant_id)
+    ])
     return {"success": True, "message": "Item removed from cart"}
 
 @router.delete("/clear")
-async def clear_cart(current_user: dict, db: AsyncIOMotorDatabase):
+async def clear_cart(current_user: dict = Depends(get_cart_user)):
     """Clear entire cart"""
+    await stock_holds.release_owner(current_user["id"])
     await db.carts.update_one(
         {"user_id": current_user["id"]},
-        {"$set": {"items": [], "updated_at": datetime.utcnow()}}
+        {"$set": {
+            "items": [], "priced_items": [],
+            "subtotal": 0.0, "discount": 0.0, "savings": 0.0, "delivery_fee": 0.0,
+            "updated_at": datetime.utcnow()
+        }}
     )
     return {"success": True, "message": "Cart cleared"}
 
@@ -149,33 +340,13 @@ async def update_cart_quantity(
     product_id: str,
     variant_id: str,
     quantity: int,
-    current_user: dict,
-    db: AsyncIOMotorDatabase
+    current_user: dict = Depends(get_cart_user)
 ):
     """Update item quantity in cart"""
     if quantity < 1:
         raise HTTPException(status_code=400, detail="Quantity must be at least 1")
-    
-    # Check stock
-    product = await db.products.find_one({"id": product_id})
-    if product:
-        variant = next(
-            (v for v in product.get("variants", []) if v["variant_id"] == variant_id),
-            None
-        )
-        if variant and variant["stock_quantity"] < quantity:
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-    
-    # Update quantity
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
-    if cart:
-        for item in cart["items"]:
-            if item["product_id"] == product_id and item["variant_id"] == variant_id:
-                item["quantity"] = quantity
-        
-        await db.carts.update_one(
-            {"user_id": current_user["id"]},
-            {"$set": {"items": cart["items"], "updated_at": datetime.utcnow()}}
-        )
-    
+
+    await apply_cart_ops(current_user["id"], [
+        CartOp(op="set", product_id=product_id, variant_id=variant_id, quantity=quantity)
+    ])
     return {"success": True, "message": "Quantity updated"}
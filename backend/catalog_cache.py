@@ -0,0 +1,134 @@
+# Versioned catalog snapshot cache with ETag / 304 support
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# How often a worker re-reads the shared catalog version (seconds)
+CATALOG_VERSION_POLL = float(os.getenv('CATALOG_VERSION_POLL', '2'))
+# Snapshots also expire by age, since stock levels change without a version bump
+CATALOG_SNAPSHOT_MAX_AGE = float(os.getenv('CATALOG_SNAPSHOT_MAX_AGE', '30'))
+CATALOG_SNAPSHOT_MAX_ENTRIES = int(os.getenv('CATALOG_SNAPSHOT_MAX_ENTRIES', '512'))
+
+META_ID = "catalog"
+
+
+class Snapshot:
+    __slots__ = ("version", "created", "etag", "body", "headers")
+
+    def __init__(self, version: int, body: bytes, headers: Dict[str, str]):
+        self.version = version
+        self.created = time.monotonic()
+        self.etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        self.body = body
+        self.headers = headers
+
+
+class CatalogCache:
+    """Pre-serialized catalog responses keyed by query shape and catalog version.
+
+    The version lives in ``catalog_meta`` and is bumped on every catalog
+    write, so all workers drop their snapshots within CATALOG_VERSION_POLL
+    seconds of a change.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.version = 0
+        self._version_checked = 0.0
+        self._snapshots: "OrderedDict[str, Snapshot]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def current_version(self) -> int:
+        now = time.monotonic()
+        if self.db is not None and now - self._version_checked >= CATALOG_VERSION_POLL:
+            self._version_checked = now
+            try:
+                meta = await self.db.catalog_meta.find_one({"_id": META_ID}, {"version": 1})
+                self._set_version(meta["version"] if meta else 0)
+            except Exception as e:
+                logger.warning(f"Catalog version check failed: {e}")
+        return self.version
+
+    async def bump(self) -> int:
+        """Record a catalog change; invalidates snapshots in every worker"""
+        if self.db is not None:
+            meta = await self.db.catalog_meta.find_one_and_update(
+                {"_id": META_ID},
+                {"$inc": {"version": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._version_checked = time.monotonic()
+            self._set_version(meta["version"])
+        else:
+            self._set_version(self.version + 1)
+        return self.version
+
+    def _set_version(self, version: int):
+        if version != self.version:
+            self.version = version
+            self._snapshots.clear()
+
+    @staticmethod
+    def key(request: Request, audience: str = "") -> str:
+        """Query shape: path plus sorted query parameters, per audience that sees different fields"""
+        params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"{audience}|{request.url.path}?{params}" if audience else f"{request.url.path}?{params}"
+
+    def get(self, key: str, version: int) -> Optional[Snapshot]:
+        snapshot = self._snapshots.get(key)
+        if (snapshot is None or snapshot.version != version
+                or time.monotonic() - snapshot.created > CATALOG_SNAPSHOT_MAX_AGE):
+            self.misses += 1
+            return None
+        self._snapshots.move_to_end(key)
+        self.hits += 1
+        return snapshot
+
+    def put(self, key: str, version: int, payload, headers: Optional[Dict[str, str]] = None) -> Snapshot:
+        body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+        snapshot = Snapshot(version, body, headers or {})
+        self._snapshots[key] = snapshot
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > CATALOG_SNAPSHOT_MAX_ENTRIES:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def respond(self, request: Request, snapshot: Snapshot) -> Response:
+        """304 if the client already holds this snapshot, otherwise the cached bytes"""
+        headers = {**snapshot.headers, "ETag": snapshot.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if "*" in tags or snapshot.etag in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+        return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "snapshots": len(self._snapshots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified
+        }
+
+
+# Global catalog cache instance
+catalog_cache = CatalogCache()
@@ -0,0 +1,387 @@
+# Running-balance credit accounts with atomic authorization and ledger checkpoints
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# A balance checkpoint is written every this many ledger entries per retailer
+CREDIT_CHECKPOINT_EVERY = int(os.getenv('CREDIT_CHECKPOINT_EVERY', '100'))
+
+# Ledger entries fetched per round trip when streaming a statement
+STATEMENT_BATCH_SIZE = 500
+
+PURCHASE = "credit_purchase"
+PAYMENT = "payment"
+ADJUSTMENT = "adjustment"
+REVERSAL = "reversal"
+
+
+def month_key(at: datetime) -> str:
+    return at.strftime("%Y-%m")
+
+
+def month_start(at: datetime) -> datetime:
+    return datetime(at.year, at.month, 1)
+
+
+def next_month(at: datetime) -> datetime:
+    return datetime(at.year + at.month // 12, at.month % 12 + 1, 1)
+
+
+class InsufficientCredit(Exception):
+    def __init__(self, available: float, requested: float):
+        super().__init__("Insufficient credit")
+        self.available = available
+        self.requested = requested
+
+
+class CreditAccounts:
+    """One ``credit_accounts`` document per retailer holding the running balance.
+
+    ``available`` is authorized and debited with a single conditional
+    ``find_one_and_update``, so two concurrent credit orders can never
+    overdraw the limit. Each movement bumps the account's ``seq`` and
+    appends a ledger row carrying that seq and the resulting balance;
+    every CREDIT_CHECKPOINT_EVERY entries a checkpoint of the balance is
+    stored so statements can start from it instead of the first entry.
+    Each entry is also folded into a ``credit_rollups`` row for its month.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.authorizations = 0
+        self.declines = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def ensure(self, retailer_id: str) -> Optional[dict]:
+        """Account for a retailer, opened from the retailer record and legacy ledger if missing"""
+        account = await self.db.credit_accounts.find_one({"_id": retailer_id})
+        if account:
+            return account
+        retailer = await self.db.retailers.find_one({"user_id": retailer_id}, {"_id": 0, "credit_limit": 1})
+        if not retailer:
+            return None
+
+        # Carry over the balance and entry count from the ledger written before accounts existed
+        latest = await self.db.credit_ledgers.find_one({"retailer_id": retailer_id}, sort=[("created_at", -1)])
+        entries = await self.db.credit_ledgers.count_documents({"retailer_id": retailer_id}) if latest else 0
+        limit = retailer.get("credit_limit", 0.0)
+        available = latest["balance"] if latest else limit
+        try:
+            return await self.db.credit_accounts.find_one_and_update(
+                {"_id": retailer_id},
+                {"$setOnInsert": {
+                    "retailer_id": retailer_id,
+                    "credit_limit": limit,
+                    "available": available,
+                    "used": limit - available,
+                    "seq": entries,
+                    "created_at": datetime.utcnow()
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another request opened the account first
+            return await self.db.credit_accounts.find_one({"_id": retailer_id})
+
+    async def _move(
+        self,
+        retailer_id: str,
+        amount: float,
+        transaction_type: str,
+        description: str,
+        order_id: Optional[str] = None,
+        guard: bool = False
+    ) -> dict:
+        """Apply ``amount`` to available credit (negative debits) and append the ledger row"""
+        query = {"_id": retailer_id}
+        if guard:
+            query["available"] = {"$gte": -amount}
+        account = await self.db.credit_accounts.find_one_and_update(
+            query,
+            {
+                "$inc": {"available": amount, "used": -amount, "seq": 1},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if account is None:
+            return None
+
+        try:
+            entry = await self._append(account, amount, transaction_type, description, order_id)
+        except Exception:
+            # Keep balance and ledger in step: undo the movement if its row was not written
+            await self._undo(account, {"available": -amount, "used": amount})
+            raise
+        await self._follow_up(account, entry)
+        return entry
+
+    async def _undo(self, account: dict, inc: dict, restore: Optional[dict] = None, match: Optional[dict] = None):
+        """Reverse a movement whose ledger row could not be written.
+
+        ``seq`` is stepped back only while it is still this movement's, so a
+        seq taken by a later movement is never handed out twice.
+        """
+        query = {"_id": account["_id"], **(match or {})}
+        update = {"$inc": inc, **({"$set": restore} if restore else {})}
+        result = await self.db.credit_accounts.update_one(
+            {**query, "seq": account["seq"]}, {**update, "$inc": {**inc, "seq": -1}}
+        )
+        if not result.modified_count:
+            result = await self.db.credit_accounts.update_one(query, update)
+        if not result.modified_count:
+            logger.error(f"Could not undo credit movement {account['seq']} for {account['_id']}")
+
+    async def _append(
+        self, account: dict, delta: float, transaction_type: str, description: str, order_id: Optional[str]
+    ) -> dict:
+        """Ledger row for one movement"""
+        entry = {
+            "id": str(uuid.uuid4()),
+            "retailer_id": account["_id"],
+            "transaction_type": transaction_type,
+            "amount": round(abs(delta), 2),
+            "delta": delta,
+            "balance": account["available"],
+            "seq": account["seq"],
+            "order_id": order_id,
+            "description": description,
+            "created_at": datetime.utcnow()
+        }
+        await self.db.credit_ledgers.insert_one(entry)
+        entry.pop("_id", None)
+        return entry
+
+    async def _follow_up(self, account: dict, entry: dict):
+        """Monthly rollup and (every N entries) checkpoint for a written entry.
+
+        Both are derived from the ledger, so a failure is logged rather than
+        undoing the movement; ``rebuild_rollups`` recomputes the rollups.
+        """
+        try:
+            await self._roll_up(entry)
+            if account["seq"] % CREDIT_CHECKPOINT_EVERY == 0:
+                await self.checkpoint(account, entry["created_at"])
+        except Exception as e:
+            logger.warning(f"Credit rollup/checkpoint for {account['_id']} seq {account['seq']} failed: {e}")
+
+    async def _roll_up(self, entry: dict):
+        """Fold one ledger entry into its month's rollup.
+
+        Movements can land out of seq order, so opening and closing balances
+        come from the lowest and highest seq seen rather than arrival order.
+        """
+        seq, after = entry["seq"], entry["balance"]
+        before = after - entry["delta"]
+        month = month_key(entry["created_at"])
+        first = {"$ifNull": ["$first_seq", seq + 1]}
+        last = {"$ifNull": ["$last_seq", seq - 1]}
+        await self.db.credit_rollups.update_one(
+            {"_id": f"{entry['retailer_id']}|{month}"},
+            [{"$set": {
+                "retailer_id": entry["retailer_id"],
+                "month": month,
+                "opening_balance": {"$cond": [{"$lt": [seq, first]}, before, "$opening_balance"]},
+                "closing_balance": {"$cond": [{"$gt": [seq, last]}, after, "$closing_balance"]},
+                "first_seq": {"$min": [seq, first]},
+                "last_seq": {"$max": [seq, last]},
+                "debits": {"$add": [{"$ifNull": ["$debits", 0]}, max(-entry["delta"], 0)]},
+                "credits": {"$add": [{"$ifNull": ["$credits", 0]}, max(entry["delta"], 0)]},
+                "entries": {"$add": [{"$ifNull": ["$entries", 0]}, 1]}
+            }}],
+            upsert=True
+        )
+
+    async def authorize(self, retailer_id: str, amount: float, order_id: str, description: str) -> dict:
+        """Debit ``amount`` if available credit covers it, else raise InsufficientCredit"""
+        account = await self.ensure(retailer_id)
+        if account is None:
+            raise InsufficientCredit(0.0, amount)
+        entry = await self._move(retailer_id, -amount, PURCHASE, description, order_id, guard=True)
+        if entry is None:
+            self.declines += 1
+            current = await self.db.credit_accounts.find_one({"_id": retailer_id}, {"available": 1})
+            raise InsufficientCredit(current["available"] if current else 0.0, amount)
+        self.authorizations += 1
+        return entry
+
+    async def credit(
+        self, retailer_id: str, amount: float, description: str,
+        order_id: Optional[str] = None, transaction_type: str = PAYMENT
+    ) -> Optional[dict]:
+        """Restore available credit (repayment, reversal of a failed order)"""
+        if await self.ensure(retailer_id) is None:
+            return None
+        return await self._move(retailer_id, amount, transaction_type, description, order_id)
+
+    async def set_limit(self, retailer_id: str, credit_limit: float):
+        """Change the limit, shifting available credit by the difference as an adjustment entry"""
+        if await self.ensure(retailer_id) is None:
+            return
+        before = await self.db.credit_accounts.find_one_and_update(
+            {"_id": retailer_id, "credit_limit": {"$ne": credit_limit}},
+            [{"$set": {
+                "available": {"$add": ["$available", {"$subtract": [credit_limit, "$credit_limit"]}]},
+                "credit_limit": credit_limit,
+                "seq": {"$add": ["$seq", 1]},
+                "updated_at": datetime.utcnow()
+            }}]
+        )
+        if before is None:
+            return
+        delta = credit_limit - before["credit_limit"]
+        account = {
+            **before,
+            "available": before["available"] + delta,
+            "credit_limit": credit_limit,
+            "seq": before["seq"] + 1
+        }
+        try:
+            entry = await self._append(account, delta, ADJUSTMENT, f"Credit limit set to {credit_limit:g}", None)
+        except Exception:
+            await self._undo(
+                account, {"available": -delta}, {"credit_limit": before["credit_limit"]}, {"credit_limit": credit_limit}
+            )
+            raise
+        await self._follow_up(account, entry)
+
+    async def checkpoint(self, account: dict, at: datetime):
+        await self.db.credit_checkpoints.update_one(
+            {"retailer_id": account["_id"], "seq": account["seq"]},
+            {"$setOnInsert": {
+                "balance": account["available"],
+                "used": account["used"],
+                "credit_limit": account["credit_limit"],
+                "created_at": at
+            }},
+            upsert=True
+        )
+
+    async def balance(self, retailer_id: str) -> Optional[dict]:
+        account = await self.ensure(retailer_id)
+        if account is None:
+            return None
+        return {
+            "credit_limit": account["credit_limit"],
+            "used_credit": account["credit_limit"] - account["available"],
+            "available_credit": account["available"]
+        }
+
+    async def opening_balance(self, retailer_id: str, at: datetime) -> Optional[float]:
+        """Available credit just before ``at``: one index seek on (retailer_id, created_at)"""
+        entry = await self.db.credit_ledgers.find_one(
+            {"retailer_id": retailer_id, "created_at": {"$lt": at}},
+            {"_id": 0, "balance": 1},
+            sort=[("created_at", -1)]
+        )
+        return entry["balance"] if entry else None
+
+    async def _scan_months(self, retailer_id: str, start: datetime, end: datetime) -> List[dict]:
+        """Monthly figures computed from raw entries, for the partial months of a range"""
+        pipeline = [
+            {"$match": {"retailer_id": retailer_id, "created_at": {"$gte": start, "$lt": end}}},
+            {"$sort": {"created_at": 1}},
+            {"$addFields": {"_delta": {"$ifNull": ["$delta", {"$cond": [
+                {"$eq": ["$transaction_type", PURCHASE]}, {"$multiply": ["$amount", -1]}, "$amount"
+            ]}]}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+                "first_balance": {"$first": "$balance"},
+                "first_delta": {"$first": "$_delta"},
+                "closing_balance": {"$last": "$balance"},
+                "debits": {"$sum": {"$cond": [{"$lt": ["$_delta", 0]}, {"$multiply": ["$_delta", -1]}, 0]}},
+                "credits": {"$sum": {"$cond": [{"$gt": ["$_delta", 0]}, "$_delta", 0]}},
+                "entries": {"$sum": 1},
+                "first_seq": {"$min": "$seq"},
+                "last_seq": {"$max": "$seq"}
+            }}
+        ]
+        months = []
+        async for row in self.db.credit_ledgers.aggregate(pipeline):
+            months.append({
+                "month": row["_id"],
+                "opening_balance": row["first_balance"] - row["first_delta"],
+                "closing_balance": row["closing_balance"],
+                "debits": row["debits"],
+                "credits": row["credits"],
+                "entries": row["entries"],
+                "first_seq": row["first_seq"],
+                "last_seq": row["last_seq"]
+            })
+        return months
+
+    async def statement(self, retailer_id: str, start: datetime, end: datetime) -> dict:
+        """Month-by-month summary of [start, end).
+
+        Whole months come from ``credit_rollups``; only the partial months at
+        either end of the range are scanned from the ledger.
+        """
+        first_full = month_start(start) if start == month_start(start) else next_month(start)
+        last_full = month_start(end)  # exclusive
+        months: List[dict] = []
+        if first_full < last_full:
+            async for row in self.db.credit_rollups.find(
+                {"retailer_id": retailer_id, "month": {"$gte": month_key(first_full), "$lt": month_key(last_full)}},
+                {"_id": 0, "first_seq": 0, "last_seq": 0, "retailer_id": 0}
+            ).sort("month", 1):
+                months.append(row)
+            if start < first_full:
+                months[:0] = await self._scan_months(retailer_id, start, first_full)
+            if last_full < end:
+                months.extend(await self._scan_months(retailer_id, last_full, end))
+        else:
+            months = await self._scan_months(retailer_id, start, end)
+        for row in months:
+            row.pop("first_seq", None)
+            row.pop("last_seq", None)
+
+        opening = await self.opening_balance(retailer_id, start)
+        if opening is None:
+            opening = months[0]["opening_balance"] if months else None
+        closing = months[-1]["closing_balance"] if months else opening
+        return {
+            "start": start,
+            "end": end,
+            "opening_balance": opening,
+            "closing_balance": closing,
+            "debits": round(sum(m["debits"] for m in months), 2),
+            "credits": round(sum(m["credits"] for m in months), 2),
+            "months": months
+        }
+
+    async def entries(self, retailer_id: str, start: datetime, end: datetime) -> AsyncIterator[dict]:
+        """Ledger entries of [start, end) in order, streamed off the cursor"""
+        cursor = self.db.credit_ledgers.find(
+            {"retailer_id": retailer_id, "created_at": {"$gte": start, "$lt": end}},
+            {"_id": 0, "retailer_id": 0}
+        ).sort("created_at", 1).batch_size(STATEMENT_BATCH_SIZE)
+        async for entry in cursor:
+            yield entry
+
+    async def rebuild_rollups(self, retailer_id: str) -> int:
+        """Recompute a retailer's monthly rollups from the ledger (e.g. for pre-rollup history)"""
+        months = await self._scan_months(retailer_id, datetime.min, datetime.max)
+        for row in months:
+            await self.db.credit_rollups.replace_one(
+                {"_id": f"{retailer_id}|{row['month']}"},
+                {"retailer_id": retailer_id, **row},
+                upsert=True
+            )
+        return len(months)
+
+    def stats(self) -> dict:
+        return {"authorizations": self.authorizations, "declines": self.declines}
+
+
+# Global credit account instance
+credit_accounts = CreditAccounts()
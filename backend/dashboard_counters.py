@@ -0,0 +1,163 @@
+# Admin dashboard counters maintained incrementally, with periodic reconciliation
+import os
+import asyncio
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# How often counters are recomputed from the collections to correct drift (seconds)
+DASHBOARD_RECONCILE_INTERVAL = float(os.getenv('DASHBOARD_RECONCILE_INTERVAL', '300'))
+# Products at or below this stock count as low stock
+LOW_STOCK_THRESHOLD = int(os.getenv('LOW_STOCK_THRESHOLD', '10'))
+
+COUNTERS_ID = "dashboard"
+KYC_PENDING_STATUSES = ("pending", "manual_review")
+
+# Projection of the product fields is_low_stock() reads
+LOW_STOCK_FIELDS = {"_id": 0, "stock_quantity": 1, "is_active": 1}
+
+COUNTER_FIELDS = (
+    "total_orders", "total_users", "total_products", "pending_retailers",
+    "total_revenue", "low_stock_products", "active_retailers", "pending_kyc"
+)
+
+
+def is_low_stock(product: Optional[dict]) -> bool:
+    """Whether a product (with ``is_active`` and ``stock_quantity``) counts as low stock"""
+    if not product or product.get("is_active") is not True:
+        return False
+    stock = product.get("stock_quantity", 0)
+    # Matches count(): a non-numeric stock never satisfies $lte
+    return isinstance(stock, (int, float)) and stock <= LOW_STOCK_THRESHOLD
+
+
+class DashboardCounters:
+    """One ``dashboard_counters`` document read by the admin dashboard.
+
+    Write paths that create orders, users, products, retailers or KYC
+    documents ``$inc`` the matching counters, and stock writes adjust
+    ``low_stock_products`` when a product crosses LOW_STOCK_THRESHOLD.
+    Revenue, and pending_kyc going down, are only recomputed by the
+    reconciliation loop, since no write path completes payments or reviews
+    KYC yet; the loop also corrects any increments lost to failed writes.
+    """
+
+    def __init__(self):
+        self.db = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.increments = 0
+        self.reconciliations = 0
+        self.last_drift: Dict[str, float] = {}
+
+    def set_db(self, database):
+        self.db = database
+
+    async def inc(self, **deltas):
+        """Adjust counters; never fails the write path that called it"""
+        if self.db is None or not deltas:
+            return
+        try:
+            await self.db.dashboard_counters.update_one(
+                {"_id": COUNTERS_ID},
+                {"$inc": deltas, "$currentDate": {"updated_at": True}},
+                upsert=True
+            )
+            self.increments += 1
+        except Exception as e:
+            logger.warning(f"Dashboard counter update failed: {e}")
+
+    async def retailer_status_changed(self, old: Optional[str], new: str):
+        if old == new:
+            return
+        deltas = {}
+        for status, sign in ((old, -1), (new, 1)):
+            field = {"pending": "pending_retailers", "approved": "active_retailers"}.get(status)
+            if field:
+                deltas[field] = deltas.get(field, 0) + sign
+        await self.inc(**deltas)
+
+    async def stock_changed(self, before: Optional[dict], after: Optional[dict]):
+        """Adjust low_stock_products for a product written from ``before`` to ``after``"""
+        delta = int(is_low_stock(after)) - int(is_low_stock(before))
+        if delta:
+            await self.inc(low_stock_products=delta)
+
+    async def stock_moved(self, before: Optional[dict], change: int):
+        """Same, for a product whose stock_quantity moved by ``change`` from ``before``"""
+        if before:
+            after = {**before, "stock_quantity": before.get("stock_quantity", 0) + change}
+            await self.stock_changed(before, after)
+
+    async def count(self) -> dict:
+        """Every counter computed from the source collections"""
+        revenue = await self.db.orders.aggregate([
+            {"$match": {"payment_status": "completed"}},
+            {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
+        ]).to_list(1)
+        return {
+            "total_orders": await self.db.orders.count_documents({}),
+            "total_users": await self.db.users.count_documents({}),
+            "total_products": await self.db.products.count_documents({}),
+            "pending_retailers": await self.db.retailers.count_documents({"status": "pending"}),
+            "total_revenue": revenue[0]["total"] if revenue else 0,
+            "low_stock_products": await self.db.products.count_documents(
+                {"is_active": True, "stock_quantity": {"$lte": LOW_STOCK_THRESHOLD}}
+            ),
+            "active_retailers": await self.db.retailers.count_documents({"status": "approved"}),
+            "pending_kyc": await self.db.kyc_documents.count_documents({"status": {"$in": list(KYC_PENDING_STATUSES)}})
+        }
+
+    async def reconcile(self) -> dict:
+        """Overwrite the counters with fresh counts, recording how far they had drifted"""
+        current = await self.db.dashboard_counters.find_one({"_id": COUNTERS_ID}) or {}
+        counts = await self.count()
+        self.last_drift = {
+            field: counts[field] - current.get(field, 0)
+            for field in COUNTER_FIELDS if counts[field] != current.get(field, 0)
+        }
+        await self.db.dashboard_counters.update_one(
+            {"_id": COUNTERS_ID},
+            {"$set": counts, "$currentDate": {"updated_at": True, "reconciled_at": True}},
+            upsert=True
+        )
+        self.reconciliations += 1
+        if self.last_drift and current:
+            logger.info(f"Dashboard counters corrected: {self.last_drift}")
+        return counts
+
+    async def read(self) -> dict:
+        doc = await self.db.dashboard_counters.find_one({"_id": COUNTERS_ID}, {"_id": 0})
+        # Increments can create the document before any full count has been taken
+        if doc is None or "reconciled_at" not in doc:
+            return await self.reconcile()
+        return {field: doc.get(field, 0) for field in COUNTER_FIELDS}
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(DASHBOARD_RECONCILE_INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Dashboard counter reconciliation failed: {e}")
+
+    async def start(self):
+        if self.db is None:
+            return
+        self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+
+    def stop(self):
+        if self._reconcile_task:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+
+    def stats(self) -> dict:
+        return {
+            "increments": self.increments,
+            "reconciliations": self.reconciliations,
+            "last_drift": self.last_drift
+        }
+
+
+# Global dashboard counters instance
+dashboard_counters = DashboardCounters()
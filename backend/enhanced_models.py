@@ -94,7 +94,7 @@ class Product(BaseModel):
     description: str
     images: List[str] = []  # base64 or URLs
     hsn_code: Optional[str] = None
-    gst_rate: float = 0.0
+    gst_rate: Optional[float] = None
     variants: List[ProductVariant] = []
     tags: List[str] = []  # "hot_selling", "best_margin", etc.
     is_active: bool = True
@@ -137,7 +137,7 @@ class OrderItem(BaseModel):
     unit_price: float
     total_price: float
     hsn_code: Optional[str] = None
-    gst_rate: float = 0.0
+    gst_rate: Optional[float] = None
 
 class Order(BaseModel):
     order_id: str
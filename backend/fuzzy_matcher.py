@@ -0,0 +1,170 @@
+# Typo-tolerant and Hinglish phonetic matching for catalog search
+import re
+from typing import Dict, Optional, Set
+
+# Edit distance allowed for a term of a given length
+SHORT_TERM_LENGTH = 4  # terms up to this length tolerate one edit, longer ones two
+MIN_FUZZY_LENGTH = 3  # shorter terms are too ambiguous to correct
+FUZZY_MATCH_WEIGHT = 0.5  # a corrected term scores below an exact/prefix hit
+MIN_TRIGRAM_SIMILARITY = 0.2
+PHONETIC_BONUS = 0.25  # an edit-distance candidate that also sounds alike ranks higher
+
+# Spelling variants common in romanized Hindi, applied in order
+_PHONETIC_RULES = [
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"([kgcjtdpb])h"), r"\1"),  # aspirates: kh, gh, bh, dh, th...
+    (re.compile(r"sh"), "s"),
+    (re.compile(r"ck"), "k"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"x"), "ks"),
+    (re.compile(r"z"), "j"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"ee|ii"), "i"),
+    (re.compile(r"oo|uu|ou"), "u"),
+    (re.compile(r"y$"), "i"),
+    (re.compile(r"(.)\1+"), r"\1"),  # atta -> ata, chakki -> caki
+]
+_VOWELS = re.compile(r"[aeiou]")
+
+
+def phonetic_key(word: str) -> str:
+    """Sound-alike key: normalized spelling reduced to its consonant skeleton.
+
+    "atta"/"aata" -> "at", "basmati"/"basmti" -> "bsmt", "chawal"/"chaawal" -> "cvl"
+    """
+    word = word.lower()
+    for pattern, replacement in _PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    if not word:
+        return ""
+    return word[0] + _VOWELS.sub("", word[1:])
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of padded character trigrams"""
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, capped at max_distance + 1"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(prev[j] + 1, current[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], prev_prev[j - 2] + 1)
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, current
+    return prev[-1]
+
+
+def max_distance_for(term: str) -> int:
+    return 1 if len(term) <= SHORT_TERM_LENGTH else 2
+
+
+def _deletes(word: str, distance: int) -> Set[str]:
+    """All strings reachable from ``word`` by deleting up to ``distance`` characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+class FuzzyMatcher:
+    """SymSpell-style delete index plus phonetic keys over a vocabulary.
+
+    Every vocabulary word is stored under each string obtained by deleting
+    up to two of its characters; a query term's own deletes then meet those
+    entries, giving edit-distance candidates with dictionary lookups only.
+    """
+
+    def __init__(self):
+        self._words: Dict[str, str] = {}  # word -> phonetic key
+        self._deletes: Dict[str, Set[str]] = {}
+        self._phonetic: Dict[str, Set[str]] = {}
+        self.lookups = 0
+        self.corrections = 0
+
+    def clear(self):
+        self._words.clear()
+        self._deletes.clear()
+        self._phonetic.clear()
+
+    def add_word(self, word: str):
+        if word in self._words or len(word) < MIN_FUZZY_LENGTH or word.isdigit():
+            return
+        key = phonetic_key(word)
+        self._words[word] = key
+        for variant in _deletes(word, max_distance_for(word)):
+            self._deletes.setdefault(variant, set()).add(word)
+        if key:
+            self._phonetic.setdefault(key, set()).add(word)
+
+    def lookup(self, term: str, known: Optional[Set[str]] = None) -> Dict[str, float]:
+        """Vocabulary words close to ``term`` with a match weight in (0, 1].
+
+        ``known`` restricts results to words still present in the caller's
+        index (words are never removed here, only filtered out).
+        """
+        self.lookups += 1
+        if len(term) < MIN_FUZZY_LENGTH or term.isdigit():
+            return {}
+
+        max_distance = max_distance_for(term)
+        key = phonetic_key(term)
+        candidates: Dict[str, float] = {}
+
+        for variant in _deletes(term, max_distance):
+            for word in self._deletes.get(variant, ()):
+                if word in candidates:
+                    continue
+                distance = edit_distance(term, word, max_distance)
+                if distance <= max_distance:
+                    score = 1.0 - distance / (max_distance + 1)
+                    if self._words[word] == key:
+                        score = min(1.0, score + PHONETIC_BONUS)
+                    candidates[word] = score
+
+        for word in self._phonetic.get(key, ()):
+            if word not in candidates:
+                similarity = trigram_similarity(term, word)
+                if similarity >= MIN_TRIGRAM_SIMILARITY:
+                    candidates[word] = 0.5 + similarity / 2
+
+        if known is not None:
+            candidates = {w: s for w, s in candidates.items() if w in known}
+        if candidates:
+            self.corrections += 1
+        return {w: s * FUZZY_MATCH_WEIGHT for w, s in candidates.items()}
+
+    def best_match(self, term: str, known: Optional[Set[str]] = None) -> Optional[str]:
+        """Single most likely correction for ``term``, for "did you mean" hints"""
+        candidates = self.lookup(term, known)
+        if not candidates:
+            return None
+        return max(candidates, key=lambda w: (candidates[w], trigram_similarity(term, w)))
+
+    def stats(self) -> dict:
+        return {
+            "words": len(self._words),
+            "delete_entries": len(self._deletes),
+            "phonetic_keys": len(self._phonetic),
+            "lookups": self.lookups,
+            "corrections": self.corrections
+        }
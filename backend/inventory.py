@@ -0,0 +1,187 @@
+# Inventory reservation engine: all-or-nothing stock decrements for an order
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from dashboard_counters import dashboard_counters, LOW_STOCK_FIELDS
+from price_stamps import STAMP_UPDATE
+from sharded_inventory import sharded_inventory
+
+logger = logging.getLogger(__name__)
+
+class StockShortage(Exception):
+    """Raised when one or more lines cannot be reserved"""
+
+    def __init__(self, shortfalls: List[dict]):
+        super().__init__("Insufficient stock")
+        self.shortfalls = shortfalls
+
+
+def merge_lines(lines: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """Total quantity per product, so repeated lines are reserved once"""
+    totals: Dict[str, int] = {}
+    for product_id, quantity in lines:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return totals
+
+
+class Inventory:
+    """Guarded stock decrements applied to every line concurrently.
+
+    Each decrement only matches while ``stock_quantity >= qty``, so stock
+    can never go negative under concurrent checkouts. Hot SKUs with sharded
+    inventory are decremented on counter shards instead. If any line
+    misses, the lines this call applied (kept in memory as the writes
+    return) are restored.
+
+    Lines are sent as concurrent ``find_one_and_update`` calls rather than
+    one unordered ``bulk_write``: a bulk result only counts modified
+    documents, so after a partial miss it cannot say which lines to restore
+    without a per-reservation marker on the product, which would need a
+    second write to clear on every successful checkout. The returned
+    documents also show which products crossed the low-stock threshold.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.reserved = 0
+        self.shortages = 0
+        self.rollbacks = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def _decrement(self, product_id: str, quantity: int, held: int) -> bool:
+        before = await self.db.products.find_one_and_update(
+            {
+                "id": product_id,
+                "sharded_inventory": {"$ne": True},
+                "inventory_migrating": {"$ne": True},
+                "stock_quantity": {"$gte": quantity + held}
+            },
+            {
+                "$inc": {"stock_quantity": -quantity, **STAMP_UPDATE["$inc"]},
+                "$currentDate": STAMP_UPDATE["$currentDate"]
+            },
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return False
+        await dashboard_counters.stock_moved(before, -quantity)
+        return True
+
+    async def reserve(
+        self,
+        lines: Iterable[Tuple[str, int]],
+        held: Optional[Dict[str, int]] = None,
+        sharded: Optional[Dict[str, int]] = None
+    ) -> None:
+        """Decrement stock for (product_id, quantity) lines or raise StockShortage.
+
+        ``held`` is stock per product held by other shoppers; it must stay
+        on the shelf after this reservation. ``sharded`` maps products with
+        sharded inventory to their shard count; those lines are taken from
+        the counter shards instead of the product document.
+        """
+        quantities = merge_lines(lines)
+        held = held or {}
+        sharded = sharded or {}
+        plain = {pid: qty for pid, qty in quantities.items() if pid not in sharded}
+        hot = {pid: qty for pid, qty in quantities.items() if pid in sharded}
+
+        plain_ok, hot_taken = await asyncio.gather(
+            asyncio.gather(*(self._decrement(pid, qty, held.get(pid, 0)) for pid, qty in plain.items())),
+            asyncio.gather(*(
+                sharded_inventory.decrement(pid, qty, sharded[pid], held.get(pid, 0)) for pid, qty in hot.items()
+            ))
+        )
+        applied = {pid: qty for (pid, qty), ok in zip(plain.items(), plain_ok) if ok}
+        taken = dict(zip(hot, hot_taken))
+
+        if len(applied) == len(plain) and all(taken.values()):
+            self.reserved += 1
+            return
+
+        self.shortages += 1
+        if applied or any(taken.values()):
+            self.rollbacks += 1
+        if applied:
+            await self._restore(applied)
+        for parts in taken.values():
+            if parts:
+                await sharded_inventory.give_back(parts)
+        missed = [pid for pid in plain if pid not in applied] + [pid for pid, parts in taken.items() if not parts]
+        raise StockShortage(await self._shortfalls(missed, quantities, held, sharded))
+
+    async def _shortfalls(
+        self, missed: List[str], quantities: Dict[str, int], held: Dict[str, int], sharded: Dict[str, int]
+    ) -> List[dict]:
+        products = await self.db.products.find(
+            {"id": {"$in": missed}}, {"_id": 0, "id": 1, "name": 1, "stock_quantity": 1}
+        ).to_list(len(missed))
+        found = {p["id"]: p for p in products}
+
+        shortfalls = []
+        for product_id in missed:
+            product = found.get(product_id)
+            if product_id in sharded:
+                on_hand = await sharded_inventory.total(product_id)
+            else:
+                on_hand = product.get("stock_quantity", 0) if product else 0
+            available = max(on_hand - held.get(product_id, 0), 0)
+            shortfalls.append({
+                "product_id": product_id,
+                "product_name": product.get("name") if product else None,
+                "requested": quantities[product_id],
+                "available": available,
+                "shortfall": max(quantities[product_id] - available, 0)
+            })
+        return shortfalls
+
+    async def _restore_one(self, product_id: str, quantity: int) -> bool:
+        before = await self.db.products.find_one_and_update(
+            {"id": product_id},
+            {
+                "$inc": {"stock_quantity": quantity, **STAMP_UPDATE["$inc"]},
+                "$currentDate": STAMP_UPDATE["$currentDate"]
+            },
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return False
+        await dashboard_counters.stock_moved(before, quantity)
+        return True
+
+    async def _restore(self, quantities: Dict[str, int]) -> int:
+        restored = sum(await asyncio.gather(*(
+            self._restore_one(product_id, quantity) for product_id, quantity in quantities.items()
+        )))
+        if restored != len(quantities):
+            logger.error(f"Stock restore updated {restored} of {len(quantities)} products")
+        return restored
+
+    async def release(self, lines: Iterable[Tuple[str, int]], sharded: Optional[Dict[str, int]] = None) -> int:
+        """Return reserved stock, e.g. when the order could not be saved"""
+        quantities = merge_lines(lines)
+        sharded = sharded or {}
+        for product_id, shards in sharded.items():
+            if product_id in quantities:
+                await sharded_inventory.restock(product_id, shards, quantities.pop(product_id))
+        if not quantities:
+            return 0
+        return await self._restore(quantities)
+
+    def stats(self) -> dict:
+        return {
+            "reserved": self.reserved,
+            "shortages": self.shortages,
+            "rollbacks": self.rollbacks
+        }
+
+
+# Global inventory instance
+inventory = Inventory()
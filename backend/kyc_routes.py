@@ -6,6 +6,7 @@ from datetime import datetime
 import uuid
 import base64
 from ai_service import ai_service
+from dashboard_counters import dashboard_counters, KYC_PENDING_STATUSES
 
 kyc_router = APIRouter(prefix="/kyc", tags=["KYC"])
 
@@ -108,6 +109,8 @@ async def upload_kyc_document(request: KYCUploadRequest, user_id: str):
         
         if db:
             await db.kyc_documents.insert_one(document)
+            if status in KYC_PENDING_STATUSES:
+                await dashboard_counters.inc(pending_kyc=1)
         
         return {
             "success": True,
@@ -0,0 +1,111 @@
+# Keyset (cursor) pagination for listing endpoints
+import json
+import base64
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "$dt" in value:
+        return datetime.fromisoformat(value["$dt"])
+    return value
+
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    """Opaque cursor for the position just after ``doc``"""
+    payload = {"k": _encode_value(doc.get(sort_field)), "id": doc["id"]}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return _decode_value(payload["k"]), payload["id"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """Opaque cursor for a position in an in-memory ranked list"""
+    raw = json.dumps({"o": offset}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode()))["o"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+
+def keyset_filter(sort_field: str, cursor: str, direction: int = -1) -> dict:
+    """Filter selecting documents strictly after the cursor in (sort_field, id) order"""
+    value, last_id = decode_cursor(cursor)
+    after = "$lt" if direction < 0 else "$gt"
+    if sort_field == "id":
+        return {"id": {after: last_id}}
+
+    if value is None:
+        # Missing sort keys sort last descending (first ascending); page within them by id
+        if direction < 0:
+            return {sort_field: None, "id": {after: last_id}}
+        return {"$or": [{sort_field: None, "id": {after: last_id}}, {sort_field: {"$ne": None}}]}
+
+    clauses = [
+        {sort_field: {after: value}},
+        {sort_field: value, "id": {after: last_id}}
+    ]
+    if direction < 0:
+        clauses.append({sort_field: None})
+    return {"$or": clauses}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    sort_field: str = "created_at",
+    direction: int = -1,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+    skip: int = 0
+) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page ordered by (sort_field, id) and the cursor for the next.
+
+    Pages are found by seeking on an index rather than skipping, so deep
+    pages cost the same as the first. Returns (items, next_cursor), where
+    next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        query = {"$and": [query, keyset_filter(sort_field, cursor, direction)]} if query else keyset_filter(sort_field, cursor, direction)
+
+    sort = [("id", direction)] if sort_field == "id" else [(sort_field, direction), ("id", direction)]
+    find = collection.find(query, projection if projection is not None else {"_id": 0}).sort(sort)
+    if skip and not cursor:
+        # Legacy offset paging, kept for existing clients
+        find = find.skip(skip)
+    items = await find.limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1], sort_field)
+    return items, next_cursor
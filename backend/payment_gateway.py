@@ -0,0 +1,176 @@
+# Non-blocking Razorpay adapter with pooling, timeouts and a circuit breaker
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import razorpay
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID', 'rzp_test_dummy')
+RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET', 'test_secret_dummy')
+# Point at a local fake gateway in tests (see tests/fake_gateway.py)
+RAZORPAY_BASE_URL = os.getenv('RAZORPAY_BASE_URL')
+
+# (connect, read) timeouts for a single gateway call, in seconds
+PAYMENT_CONNECT_TIMEOUT = float(os.getenv('PAYMENT_CONNECT_TIMEOUT', '2'))
+PAYMENT_READ_TIMEOUT = float(os.getenv('PAYMENT_READ_TIMEOUT', '5'))
+# Threads (and pooled connections) available for gateway calls
+PAYMENT_GATEWAY_WORKERS = int(os.getenv('PAYMENT_GATEWAY_WORKERS', '8'))
+# Consecutive failures that open the circuit, and how long it stays open
+PAYMENT_BREAKER_THRESHOLD = int(os.getenv('PAYMENT_BREAKER_THRESHOLD', '5'))
+PAYMENT_BREAKER_RESET = float(os.getenv('PAYMENT_BREAKER_RESET', '30'))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class GatewayUnavailable(Exception):
+    """The gateway call failed, timed out or was short-circuited"""
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency until a cool-down has passed.
+
+    After ``threshold`` consecutive failures the circuit opens and calls
+    fail fast. Once ``reset_after`` seconds pass, one trial call is let
+    through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = PAYMENT_BREAKER_THRESHOLD, reset_after: float = PAYMENT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Call counts and latency percentiles over the most recent calls"""
+
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds * 1000)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 1)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "short_circuited": self.short_circuited,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99)
+        }
+
+
+class PaymentGateway:
+    """Razorpay calls run on a dedicated thread pool, off the event loop.
+
+    The SDK's HTTP session is mounted with a connection pool sized to the
+    thread pool, every call carries connect/read timeouts, and a circuit
+    breaker fails fast while Razorpay is down so checkout can fall back to
+    a deferred payment.
+    """
+
+    def __init__(self, client: Optional[razorpay.Client] = None):
+        options = {"base_url": RAZORPAY_BASE_URL} if RAZORPAY_BASE_URL else {}
+        self.client = client or razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET), **options)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PAYMENT_GATEWAY_WORKERS)
+        self.client.session.mount("https://", adapter)
+        self.client.session.mount("http://", adapter)
+        self.timeout = (PAYMENT_CONNECT_TIMEOUT, PAYMENT_READ_TIMEOUT)
+        self.executor = ThreadPoolExecutor(max_workers=PAYMENT_GATEWAY_WORKERS, thread_name_prefix="payment")
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyStats()
+
+    async def _call(self, fn: Callable, *args, **kwargs):
+        if not self.breaker.allow():
+            self.latency.short_circuited += 1
+            raise GatewayUnavailable("Payment gateway circuit open")
+
+        self.latency.calls += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # Hard deadline in case the SDK ignores the socket timeouts
+        deadline = sum(self.timeout) + 1
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, lambda: fn(*args, timeout=self.timeout, **kwargs)),
+                deadline
+            )
+        except asyncio.TimeoutError:
+            self.latency.timeouts += 1
+            self.breaker.record_failure()
+            raise GatewayUnavailable("Payment gateway timed out")
+        except Exception as e:
+            self.latency.errors += 1
+            self.breaker.record_failure()
+            logger.warning(f"Payment gateway error: {e}")
+            raise GatewayUnavailable(str(e))
+        finally:
+            self.latency.record(time.perf_counter() - started)
+
+        self.breaker.record_success()
+        return result
+
+    async def create_order(self, amount: float, receipt: str, currency: str = "INR") -> dict:
+        """Create a gateway order for ``amount`` rupees"""
+        return await self._call(self.client.order.create, {
+            "amount": int(round(amount * 100)),  # paise
+            "currency": currency,
+            "receipt": receipt
+        })
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            **self.latency.as_dict()
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# Global payment gateway instance
+payment_gateway = PaymentGateway()
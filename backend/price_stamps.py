@@ -0,0 +1,111 @@
+# Per-product price/stock version stamps used to detect stale cart pricing
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How often a worker pulls stamps changed by other workers (seconds)
+PRICE_STAMP_POLL = float(os.getenv('PRICE_STAMP_POLL', '2'))
+# Full reload interval; also picks up deleted products
+PRICE_STAMP_FULL_RELOAD = float(os.getenv('PRICE_STAMP_FULL_RELOAD', '300'))
+# Re-read this far behind the newest stamp seen to tolerate concurrent writes
+PRICE_STAMP_OVERLAP = timedelta(seconds=5)
+
+# Update fragment to merge into any write that changes a product's price or stock
+STAMP_UPDATE = {
+    "$inc": {"pricing_version": 1},
+    "$currentDate": {"pricing_updated_at": True}
+}
+
+
+class PriceStamps:
+    """In-memory map of product id -> pricing_version.
+
+    Every write that changes a product's prices or stock increments its
+    ``pricing_version``. Workers poll for stamps changed since the last
+    poll, so checking whether a priced cart is still current needs no
+    catalog reads.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.versions: Dict[str, int] = {}
+        self._since: Optional[datetime] = None
+        self._polled = 0.0
+        self._reloaded = 0.0
+        self._projection = {"_id": 0, "id": 1, "pricing_version": 1, "pricing_updated_at": 1}
+        self._subscribers: List[Callable[[List[dict], bool], None]] = []
+        self.polls = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    def subscribe(self, fields: Iterable[str], callback: Callable[[List[dict], bool], None]):
+        """Receive changed product documents on every poll.
+
+        ``fields`` are added to the poll projection; ``callback(docs, full)``
+        gets the changed documents, with ``full`` set on complete reloads.
+        """
+        for field in fields:
+            self._projection[field] = 1
+        self._subscribers.append(callback)
+
+    async def refresh(self):
+        """Pull changed stamps if the poll interval has passed"""
+        now = time.monotonic()
+        if self.db is None or now - self._polled < PRICE_STAMP_POLL:
+            return
+        self._polled = now
+        full = self._since is None or now - self._reloaded >= PRICE_STAMP_FULL_RELOAD
+        query = {} if full else {"pricing_updated_at": {"$gt": self._since - PRICE_STAMP_OVERLAP}}
+        try:
+            docs = await self.db.products.find(query, self._projection).to_list(None)
+        except Exception as e:
+            logger.warning(f"Price stamp refresh failed: {e}")
+            return
+
+        self.polls += 1
+        if full:
+            self.versions = {}
+            self._reloaded = now
+        for doc in docs:
+            self.versions[doc["id"]] = doc.get("pricing_version", 0)
+            stamped = doc.get("pricing_updated_at")
+            if stamped and (self._since is None or stamped > self._since):
+                self._since = stamped
+        if self._since is None:
+            self._since = datetime.utcnow()
+        for callback in self._subscribers:
+            callback(docs, full)
+
+    def get(self, product_id: str) -> Optional[int]:
+        return self.versions.get(product_id)
+
+    def observe(self, product: dict):
+        """Record the stamp of a product document read elsewhere"""
+        self.versions[product["id"]] = product.get("pricing_version", 0)
+
+    def changed(self, stamps: Dict[str, int]) -> set:
+        return {pid for pid, version in stamps.items() if self.versions.get(pid) != version}
+
+    async def touch(self, product_ids: Iterable[str]):
+        """Bump stamps for products whose price or stock changed out of band"""
+        ids = list(product_ids)
+        if self.db is None or not ids:
+            return
+        await self.db.products.update_many({"id": {"$in": ids}}, STAMP_UPDATE)
+        for pid in ids:
+            self.versions.pop(pid, None)
+
+    def forget(self, product_id: str):
+        self.versions.pop(product_id, None)
+
+    def stats(self) -> dict:
+        return {"products": len(self.versions), "polls": self.polls}
+
+
+# Global stamp tracker instance
+price_stamps = PriceStamps()
@@ -0,0 +1,297 @@
+# Server-side pricing: tier prices, HSN-wise GST and delivery fees
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from price_stamps import price_stamps
+from promotions import promotion_engine
+
+# Retailer tier discount off the list retailer price
+TIER_DISCOUNTS = {
+    "bronze": 0.0,
+    "silver": 0.01,
+    "gold": 0.02,
+    "platinum": 0.03,
+}
+DEFAULT_TIER = "bronze"
+
+# GST (%) by HSN code prefix, used when a product carries no rate of its own.
+# The longest matching prefix wins.
+HSN_GST_RATES = {
+    "0401": 0.0,    # fresh milk
+    "0402": 5.0,    # milk powder
+    "0405": 12.0,   # butter, ghee
+    "0406": 12.0,   # cheese, paneer
+    "0409": 0.0,    # natural honey (unbranded)
+    "07": 0.0,      # fresh vegetables
+    "08": 0.0,      # fresh fruit
+    "0902": 5.0,    # tea
+    "0901": 5.0,    # coffee beans
+    "0904": 5.0,    # pepper
+    "0910": 5.0,    # spices
+    "1001": 0.0,    # wheat
+    "1006": 5.0,    # rice (branded)
+    "1101": 5.0,    # atta, wheat flour (branded)
+    "1507": 5.0,    # soybean oil
+    "1508": 5.0,    # groundnut oil
+    "1512": 5.0,    # sunflower oil
+    "1514": 5.0,    # mustard oil
+    "1701": 5.0,    # sugar
+    "1704": 18.0,   # sugar confectionery
+    "1806": 18.0,   # chocolate
+    "1902": 12.0,   # pasta, noodles
+    "1904": 18.0,   # cornflakes, muesli
+    "1905": 18.0,   # biscuits
+    "2101": 18.0,   # instant coffee
+    "2106": 18.0,   # namkeen, food preparations
+    "2201": 18.0,   # packaged water
+    "2202": 28.0,   # aerated drinks
+    "2501": 0.0,    # salt
+    "3305": 18.0,   # hair care
+    "3306": 18.0,   # toothpaste
+    "3401": 18.0,   # soap
+    "3402": 18.0,   # detergents
+}
+DEFAULT_GST_RATE = float(os.getenv('DEFAULT_GST_RATE', '5'))
+
+FREE_DELIVERY_THRESHOLD = float(os.getenv('FREE_DELIVERY_THRESHOLD', '500'))
+DELIVERY_FEE = float(os.getenv('DELIVERY_FEE', '50'))
+
+# How long a retailer's tier is trusted before it is re-read (seconds)
+TIER_CACHE_TTL = float(os.getenv('TIER_CACHE_TTL', '300'))
+
+# Product fields the price tables are built from
+PRICE_FIELDS = (
+    "id", "name", "brand_id", "brand", "category_id", "mrp", "retailer_price", "customer_price",
+    "gst_percent", "gst_rate", "hsn_code", "variants", "is_active", "pricing_version",
+    "sharded_inventory", "inventory_shards"
+)
+
+
+class PricingError(Exception):
+    """A line cannot be priced (unknown, inactive product or bad quantity)"""
+
+
+def hsn_gst_rate(hsn_code: Optional[str]) -> float:
+    code = (hsn_code or "").replace(" ", "")
+    for length in range(len(code), 1, -1):
+        rate = HSN_GST_RATES.get(code[:length])
+        if rate is not None:
+            return rate
+    return DEFAULT_GST_RATE
+
+
+def delivery_fee(amount: float) -> float:
+    return 0.0 if amount > FREE_DELIVERY_THRESHOLD else DELIVERY_FEE
+
+
+def _tier_prices(base: float) -> Dict[str, float]:
+    return {tier: round(base * (1 - discount), 2) for tier, discount in TIER_DISCOUNTS.items()}
+
+
+class PriceEntry:
+    """Precomputed prices for one product at one pricing_version"""
+
+    __slots__ = (
+        "product_id", "name", "brand_id", "category_id", "version", "is_active", "mrp", "gst_rate", "hsn_code",
+        "customer_price", "retailer_price", "tier_prices", "variants", "sharded_shards"
+    )
+
+    def __init__(self, product: dict):
+        self.product_id = product["id"]
+        self.name = product.get("name", "")
+        self.brand_id = product.get("brand_id") or product.get("brand")
+        self.category_id = product.get("category_id")
+        self.version = product.get("pricing_version", 0)
+        self.is_active = product.get("is_active", True)
+        self.mrp = float(product.get("mrp") or 0)
+        self.hsn_code = product.get("hsn_code")
+        rate = product.get("gst_rate")
+        if rate is None:
+            rate = product.get("gst_percent")
+        # An explicit 0% is a rate; only a missing one falls back to the HSN table
+        self.gst_rate = float(rate) if rate is not None else hsn_gst_rate(self.hsn_code)
+        self.retailer_price = float(product.get("retailer_price") or 0)
+        self.customer_price = float(product.get("customer_price") or self.retailer_price)
+        self.tier_prices = _tier_prices(self.retailer_price)
+        # variant_id -> (mrp, list retailer price, tier prices)
+        self.variants: Dict[str, Tuple[float, float, Dict[str, float]]] = {
+            v["variant_id"]: (float(v.get("mrp", 0)), float(v["retailer_price"]), _tier_prices(float(v["retailer_price"])))
+            for v in product.get("variants") or [] if "variant_id" in v and "retailer_price" in v
+        }
+        self.sharded_shards = product.get("inventory_shards") if product.get("sharded_inventory") else None
+
+    def unit_price(self, retailer: bool, tier: str, variant_id: Optional[str] = None) -> Tuple[float, float, float]:
+        """(mrp, list price, price after tier discount) for one unit.
+
+        Products without variants are sold as themselves, so only no variant
+        id or the product's own id prices at the product's own prices.
+        """
+        if variant_id is not None and not self.variants and variant_id != self.product_id:
+            raise PricingError(f"Variant not found: {variant_id}")
+        if variant_id is not None and self.variants:
+            variant = self.variants.get(variant_id)
+            if variant is None:
+                raise PricingError(f"Variant not found: {variant_id}")
+            mrp, base, tiers = variant
+        else:
+            mrp, base, tiers = self.mrp, self.retailer_price, self.tier_prices
+        if not retailer:
+            price = base if variant_id is not None and self.variants else self.customer_price
+            return mrp, price, price
+        return mrp, base, tiers.get(tier, base)
+
+
+class PricingEngine:
+    """Prices orders from in-memory, version-stamped price tables.
+
+    Tables follow ``price_stamps`` polls, so a price change reaches every
+    worker within PRICE_STAMP_POLL seconds and a quote needs no catalog
+    reads; only products never seen before are fetched, in one query.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.table: Dict[str, PriceEntry] = {}
+        self._tiers: Dict[str, Tuple[str, float]] = {}
+        self.quotes = 0
+        self.misses = 0
+        price_stamps.subscribe(PRICE_FIELDS, self._apply)
+
+    def set_db(self, database):
+        self.db = database
+
+    def _apply(self, products: List[dict], full: bool):
+        table = {} if full else self.table
+        for product in products:
+            table[product["id"]] = PriceEntry(product)
+        self.table = table
+
+    def update(self, product: dict):
+        """Re-price a product written by this worker without waiting for a poll"""
+        self.table[product["id"]] = PriceEntry(product)
+
+    def forget(self, product_id: str):
+        self.table.pop(product_id, None)
+
+    async def entries(self, product_ids: Iterable[str]) -> Dict[str, PriceEntry]:
+        """Price entries for products, loading any not yet in the table"""
+        await price_stamps.refresh()
+        ids = set(product_ids)
+        missing = [pid for pid in ids if pid not in self.table]
+        if missing and self.db is not None:
+            self.misses += len(missing)
+            projection = {"_id": 0, **{field: 1 for field in PRICE_FIELDS}}
+            async for product in self.db.products.find({"id": {"$in": missing}}, projection):
+                self.table[product["id"]] = PriceEntry(product)
+        return {pid: self.table[pid] for pid in ids if pid in self.table}
+
+    async def tier_for(self, user_id: str, role: str) -> Optional[str]:
+        """Retailer tier (cached), or None for non-retailers"""
+        if role != "retailer":
+            return None
+        cached = self._tiers.get(user_id)
+        if cached and time.monotonic() - cached[1] < TIER_CACHE_TTL:
+            return cached[0]
+        retailer = await self.db.retailers.find_one({"user_id": user_id}, {"_id": 0, "tier": 1})
+        tier = (retailer or {}).get("tier") or DEFAULT_TIER
+        self._tiers[user_id] = (tier, time.monotonic())
+        return tier
+
+    def invalidate_tier(self, user_id: str):
+        self._tiers.pop(user_id, None)
+
+    def price_lines(
+        self,
+        entries: Dict[str, PriceEntry],
+        lines: Iterable[Tuple[str, int, Optional[str]]],
+        tier: Optional[str]
+    ) -> List[dict]:
+        """Priced lines for (product_id, quantity, variant_id) at list price with tier discount"""
+        priced = []
+        for product_id, quantity, variant_id in lines:
+            entry = entries.get(product_id)
+            if entry is None or not entry.is_active:
+                raise PricingError(f"Product not available: {product_id}")
+            if quantity < 1:
+                raise PricingError(f"Quantity must be at least 1 for {entry.name}")
+            mrp, base, unit = entry.unit_price(tier is not None, tier or DEFAULT_TIER, variant_id)
+            line = {
+                "product_id": product_id,
+                "product_name": entry.name,
+                "brand_id": entry.brand_id,
+                "category_id": entry.category_id,
+                "quantity": quantity,
+                "mrp": mrp,
+                "price": base,
+                "total": round(base * quantity, 2),
+                "discount": round((base - unit) * quantity, 2),
+                "hsn_code": entry.hsn_code,
+                "gst_rate": entry.gst_rate
+            }
+            if variant_id is not None:
+                line["variant_id"] = variant_id
+            priced.append(line)
+        return priced
+
+    def finalize(self, lines: List[dict]) -> dict:
+        """Totals for priced lines: GST per line on its discounted value, grouped by HSN"""
+        subtotal = discount = gst_amount = 0.0
+        breakup: Dict[Tuple[Optional[str], float], dict] = {}
+        for line in lines:
+            taxable = line["total"] - line["discount"]
+            line["taxable_value"] = round(taxable, 2)
+            line["gst_amount"] = round(taxable * line["gst_rate"] / 100, 2)
+            subtotal += line["total"]
+            discount += line["discount"]
+            gst_amount += line["gst_amount"]
+            group = breakup.setdefault(
+                (line["hsn_code"], line["gst_rate"]),
+                {"hsn_code": line["hsn_code"], "gst_rate": line["gst_rate"], "taxable_value": 0.0, "gst_amount": 0.0}
+            )
+            group["taxable_value"] = round(group["taxable_value"] + taxable, 2)
+            group["gst_amount"] = round(group["gst_amount"] + line["gst_amount"], 2)
+
+        net = subtotal - discount
+        delivery_charges = delivery_fee(net) if lines else 0.0
+        return {
+            "items": lines,
+            "subtotal": round(subtotal, 2),
+            "discount": round(discount, 2),
+            "gst_amount": round(gst_amount, 2),
+            "gst_breakup": list(breakup.values()),
+            "delivery_charges": delivery_charges,
+            "total_amount": round(net + gst_amount + delivery_charges, 2)
+        }
+
+    async def quote(
+        self,
+        lines: List[Tuple[str, int, Optional[str]]],
+        user_id: str,
+        role: str,
+        entries: Optional[Dict[str, PriceEntry]] = None
+    ) -> dict:
+        """Price an order for a user; raises PricingError for bad lines"""
+        if entries is None:
+            entries = await self.entries(pid for pid, _, _ in lines)
+        tier = await self.tier_for(user_id, role)
+        self.quotes += 1
+        priced = self.price_lines(entries, lines, tier)
+
+        # Schemes apply after the tier discount
+        await promotion_engine.refresh()
+        promotion_engine.apply(priced)
+        for line in priced:
+            if line.get("promo_discount"):
+                line["discount"] = round(line["discount"] + line["promo_discount"], 2)
+
+        quote = self.finalize(priced)
+        quote["tier"] = tier
+        return quote
+
+    def stats(self) -> dict:
+        return {"products": len(self.table), "quotes": self.quotes, "misses": self.misses}
+
+
+# Global pricing engine instance
+pricing_engine = PricingEngine()
@@ -0,0 +1,105 @@
+# Request-scoped batched product loader (DataLoader-style)
+import asyncio
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class ProductLoader:
+    """Coalesces product lookups made during one request into ``$in`` queries.
+
+    Every ``load`` issued in the same event-loop tick is collected and
+    resolved with a single query; results are memoized for the lifetime of
+    the loader, so create one per request rather than sharing it.
+    """
+
+    def __init__(self, db, projection: Optional[dict] = None):
+        self.db = db
+        self.projection = projection if projection is not None else {"_id": 0}
+        self._cache: Dict[str, Optional[dict]] = {}
+        self._variants: Dict[str, Dict[str, dict]] = {}
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._scheduled = False
+        # The loop only keeps weak references to tasks; hold the dispatch until it finishes
+        self._tasks: Set[asyncio.Task] = set()
+        self.queries = 0
+
+    async def load(self, product_id: str) -> Optional[dict]:
+        """Product document by id, or None if it does not exist"""
+        if product_id in self._cache:
+            return self._cache[product_id]
+
+        future = self._waiting.get(product_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._waiting[product_id] = loop.create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                # Dispatch after the current tick so sibling loads join the batch
+                loop.call_soon(self._start_dispatch)
+        return await future
+
+    async def load_many(self, product_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Products for all ids (one query for those not already loaded)"""
+        ids = list(dict.fromkeys(product_ids))
+        results = await asyncio.gather(*(self.load(pid) for pid in ids))
+        return dict(zip(ids, results))
+
+    def _start_dispatch(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self):
+        batch = self._waiting
+        self._waiting = {}
+        self._scheduled = False
+        try:
+            self.queries += 1
+            products = await self.db.products.find(
+                {"id": {"$in": list(batch)}},
+                self.projection
+            ).to_list(len(batch))
+            found = {p["id"]: p for p in products}
+            for product_id, future in batch.items():
+                product = found.get(product_id)
+                self._cache[product_id] = product
+                if not future.done():
+                    future.set_result(product)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def prime(self, product: dict):
+        """Seed the cache with a product fetched elsewhere"""
+        self._cache[product["id"]] = product
+        self._variants.pop(product["id"], None)
+
+    def variant(self, product: Optional[dict], variant_id: str) -> Optional[dict]:
+        """Variant of a loaded product, via a per-product variant_id index.
+
+        Products without a ``variants`` list are sold as themselves under
+        their own id, so the product's own pack, prices and stock stand in
+        for the variant; any other variant id is not found.
+        """
+        if not product:
+            return None
+        if not product.get("variants"):
+            if variant_id != product["id"]:
+                return None
+            return {
+                "variant_id": variant_id,
+                "name": product.get("name", ""),
+                "pack_size": product.get("unit_size"),
+                "mrp": product.get("mrp", 0),
+                "retailer_price": product.get("retailer_price", 0),
+                "stock_quantity": product.get("stock_quantity", 0)
+            }
+        index = self._variants.get(product["id"])
+        if index is None:
+            index = self._variants[product["id"]] = {
+                v["variant_id"]: v for v in product.get("variants", []) if "variant_id" in v
+            }
+        return index.get(variant_id)
+
+    def loaded(self) -> List[dict]:
+        return [p for p in self._cache.values() if p is not None]
@@ -0,0 +1,116 @@
+# Sparse fieldsets and named view profiles pushed down as Mongo projections
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Named views per collection. "card" is for grids and lists, "detail" for a
+# single record as shown to its owner, "admin" is the complete document.
+VIEW_PROFILES: Dict[str, Dict[str, dict]] = {
+    "products": {
+        "card": {
+            "_id": 0, "id": 1, "name": 1, "brand": 1, "brand_id": 1, "category_id": 1,
+            "mrp": 1, "retailer_price": 1, "customer_price": 1, "stock_quantity": 1,
+            "unit_size": 1, "min_order_qty": 1, "is_active": 1,
+            "images": {"$slice": 1}  # thumbnail only
+        },
+        "detail": {"_id": 0, "images": {"$slice": 10}},
+        "admin": {"_id": 0}
+    },
+    "orders": {
+        "card": {
+            "_id": 0, "id": 1, "order_number": 1, "user_id": 1, "total_amount": 1,
+            "order_status": 1, "payment_status": 1, "payment_mode": 1,
+            "delivery_slot": 1, "created_at": 1,
+            "item_count": {"$size": {"$ifNull": ["$items", []]}}
+        },
+        "detail": {"_id": 0, "assigned_warehouse": 0},
+        "admin": {"_id": 0}
+    }
+}
+
+# Views only these roles may request
+VIEW_ROLES: Dict[str, Tuple[str, ...]] = {
+    "admin": ("admin", "super_admin")
+}
+
+# Fields only admin roles get, through any view, ``fields=`` or the default
+ADMIN_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "products": ("margin_percent", "sharded_inventory", "inventory_shards", "inventory_migrating"),
+    "orders": ("assigned_warehouse",)
+}
+
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+MAX_FIELDS = 30
+
+
+def _is_inclusion(projection: dict) -> bool:
+    """True if only listed fields are returned (1s or computed expressions)"""
+    for name, value in projection.items():
+        if name == "_id":
+            continue
+        if value == 1 or (isinstance(value, dict) and "$slice" not in value):
+            return True
+    return False
+
+
+def _withheld(collection: str, role: Optional[str]) -> Tuple[str, ...]:
+    if role in VIEW_ROLES["admin"]:
+        return ()
+    return ADMIN_FIELDS.get(collection, ())
+
+
+def build_projection(
+    collection: str,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    required: Iterable[str] = ("id",),
+    role: Optional[str] = None
+) -> dict:
+    """Mongo projection for a ``fields=`` list or a named ``view``.
+
+    Explicit fields win over a view. ``required`` fields (ids, sort keys,
+    ownership checks) are always included in inclusion projections. With
+    neither argument the full document is returned, minus ``_id``.
+    ``role`` is the caller's role, checked against VIEW_ROLES; fields in
+    ADMIN_FIELDS are withheld from everyone else on every path.
+    """
+    withheld = _withheld(collection, role)
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        if len(names) > MAX_FIELDS or not all(_FIELD_RE.match(n) for n in names):
+            raise HTTPException(status_code=400, detail="Invalid fields parameter")
+        if any(n == "_id" or n.startswith("_id.") for n in names):
+            raise HTTPException(status_code=400, detail="Field '_id' cannot be requested")
+        for name in names:
+            if name.split(".")[0] in withheld:
+                raise HTTPException(status_code=403, detail=f"Field '{name}' is not available to this user")
+        paths = sorted(set(names) | set(required))
+        for shorter, longer in zip(paths, paths[1:]):
+            # Sorted order puts "a" right before "a.b"; Mongo rejects such path collisions
+            if longer.startswith(shorter + "."):
+                raise HTTPException(status_code=400, detail=f"Overlapping fields '{shorter}' and '{longer}'")
+        projection = {"_id": 0}
+        for name in paths:
+            projection[name] = 1
+        return projection
+
+    if view:
+        profiles = VIEW_PROFILES.get(collection, {})
+        if view not in profiles:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown view '{view}'. Available: {', '.join(profiles)}"
+            )
+        if view in VIEW_ROLES and role not in VIEW_ROLES[view]:
+            raise HTTPException(status_code=403, detail=f"View '{view}' is not available to this user")
+        projection = dict(profiles[view])
+        if _is_inclusion(projection):
+            for name in required:
+                projection[name] = 1
+        else:
+            for name in withheld:
+                projection[name] = 0
+        return projection
+
+    return {"_id": 0, **{name: 0 for name in withheld}}
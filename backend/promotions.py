@@ -0,0 +1,284 @@
+# Promotion and scheme rules compiled into per-SKU / brand / category lookup tables
+import os
+import time
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# How often a worker checks whether promotions changed (seconds)
+PROMOTIONS_VERSION_POLL = float(os.getenv('PROMOTIONS_VERSION_POLL', '5'))
+
+META_ID = "promotions"
+SCOPES = ("product", "brand", "category", "all")
+KINDS = ("buy_x_get_y", "slab", "percent_off", "flat_off")
+
+
+class Slab(BaseModel):
+    min: float  # minimum quantity or value (see Promotion.basis)
+    percent: float
+
+
+class Promotion(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    kind: str  # buy_x_get_y, slab, percent_off, flat_off
+    scope: str = "product"  # product, brand, category, all
+    targets: List[str] = []  # product, brand or category ids for the scope
+    # buy_x_get_y: pay for buy_qty, get free_qty extra of the same SKU
+    buy_qty: Optional[int] = None
+    free_qty: Optional[int] = None
+    # percent_off / flat_off (per unit)
+    percent: Optional[float] = None
+    amount: Optional[float] = None
+    # slab: highest slab reached by quantity or value wins
+    slabs: List[Slab] = []
+    basis: str = "quantity"  # quantity or value
+    # Measure quantity / value across all matching lines (brand-level offers)
+    pooled: bool = False
+    min_qty: int = 0
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+    priority: int = 0
+    is_active: bool = True
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PromotionError(Exception):
+    """A promotion document fails validation"""
+
+
+def validate_promotion(promo: dict) -> dict:
+    """Parsed and checked copy of a promotion; raises PromotionError.
+
+    Parsing through ``Promotion`` turns ISO date strings into datetimes and
+    rejects malformed fields (e.g. slabs), so nothing stored can break
+    compilation. Duplicate targets are dropped so a pooled rule counts a
+    line once.
+    """
+    try:
+        promo = Promotion(**promo).dict()
+    except ValidationError as e:
+        raise PromotionError("; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+        ))
+    if promo["kind"] not in KINDS:
+        raise PromotionError(f"kind must be one of: {', '.join(KINDS)}")
+    if promo["scope"] not in SCOPES:
+        raise PromotionError(f"scope must be one of: {', '.join(SCOPES)}")
+    if promo["scope"] != "all" and not promo["targets"]:
+        raise PromotionError("targets are required for this scope")
+    if promo["kind"] == "buy_x_get_y" and not (promo["buy_qty"] and promo["free_qty"]):
+        raise PromotionError("buy_qty and free_qty are required")
+    if promo["kind"] == "slab" and not promo["slabs"]:
+        raise PromotionError("slabs are required")
+    if promo["kind"] == "percent_off" and not (promo["percent"] and 0 < promo["percent"] <= 100):
+        raise PromotionError("percent between 0 and 100 is required")
+    if promo["kind"] == "flat_off" and not (promo["amount"] and promo["amount"] > 0):
+        raise PromotionError("amount is required")
+    if promo["starts_at"] and promo["ends_at"] and promo["ends_at"] <= promo["starts_at"]:
+        raise PromotionError("ends_at must be after starts_at")
+    promo["targets"] = list(dict.fromkeys(promo["targets"]))
+    return promo
+
+
+class CompiledRule:
+    """A promotion reduced to what evaluation needs"""
+
+    __slots__ = (
+        "id", "name", "kind", "scope", "buy_qty", "free_qty", "percent", "amount",
+        "slabs", "basis", "pooled", "min_qty", "starts_at", "ends_at", "priority"
+    )
+
+    def __init__(self, promo: dict):
+        self.id = promo["id"]
+        self.name = promo["name"]
+        self.kind = promo["kind"]
+        self.scope = promo.get("scope", "product")
+        self.buy_qty = promo.get("buy_qty") or 0
+        self.free_qty = promo.get("free_qty") or 0
+        self.percent = promo.get("percent") or 0.0
+        self.amount = promo.get("amount") or 0.0
+        # Highest threshold first so the first reached slab is the best one
+        self.slabs = sorted(((s["min"], s["percent"]) for s in promo.get("slabs") or []), reverse=True)
+        self.basis = promo.get("basis", "quantity")
+        self.pooled = promo.get("pooled", False)
+        self.min_qty = promo.get("min_qty") or 0
+        self.starts_at = promo.get("starts_at")
+        self.ends_at = promo.get("ends_at")
+        self.priority = promo.get("priority", 0)
+
+    def live(self, now: datetime) -> bool:
+        return (self.starts_at is None or self.starts_at <= now) and (self.ends_at is None or now < self.ends_at)
+
+    def discount(self, quantity: int, unit_price: float, measure: float) -> float:
+        """Discount for one line; ``measure`` is its own or the pooled quantity/value"""
+        if quantity < self.min_qty:
+            return 0.0
+        if self.kind == "buy_x_get_y":
+            bundle = self.buy_qty + self.free_qty
+            if not self.buy_qty or not self.free_qty:
+                return 0.0
+            return (quantity // bundle) * self.free_qty * unit_price
+        if self.kind == "percent_off":
+            return quantity * unit_price * self.percent / 100
+        if self.kind == "flat_off":
+            return quantity * min(self.amount, unit_price)
+        if self.kind == "slab":
+            for threshold, percent in self.slabs:
+                if measure >= threshold:
+                    return quantity * unit_price * percent / 100
+        return 0.0
+
+
+class PromotionTables:
+    """Rules indexed by what they apply to, so a line only meets its own rules"""
+
+    def __init__(self, promotions: List[dict]):
+        self.by_product: Dict[str, List[CompiledRule]] = {}
+        self.by_brand: Dict[str, List[CompiledRule]] = {}
+        self.by_category: Dict[str, List[CompiledRule]] = {}
+        self.global_rules: List[CompiledRule] = []
+        self.count = 0
+        for promo in promotions:
+            if not promo.get("is_active", True) or promo.get("kind") not in KINDS:
+                continue
+            try:
+                rule = CompiledRule(promo)
+            except (KeyError, TypeError, ValueError) as e:
+                # Documents written before validation could be malformed; skip, don't fail the load
+                logger.warning(f"Skipping malformed promotion {promo.get('id')}: {e!r}")
+                continue
+            self.count += 1
+            if rule.scope == "all":
+                self.global_rules.append(rule)
+                continue
+            table = {"product": self.by_product, "brand": self.by_brand, "category": self.by_category}.get(rule.scope)
+            if table is None:
+                continue
+            for target in dict.fromkeys(promo.get("targets") or []):
+                table.setdefault(target, []).append(rule)
+
+    def candidates(self, line: dict) -> List[CompiledRule]:
+        rules = list(self.by_product.get(line["product_id"], ()))
+        if line.get("brand_id"):
+            rules.extend(self.by_brand.get(line["brand_id"], ()))
+        if line.get("category_id"):
+            rules.extend(self.by_category.get(line["category_id"], ()))
+        rules.extend(self.global_rules)
+        return rules
+
+
+class PromotionEngine:
+    """Compiles promotions from the ``promotions`` collection and applies them.
+
+    Applying to a cart is one pass to pool quantities/values for pooled
+    rules and one pass to pick each line's best rule, touching only the
+    rules indexed under the line's SKU, brand and category.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.tables = PromotionTables([])
+        self.version = None
+        self._version_checked = 0.0
+        self.applications = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def load(self):
+        promotions = await self.db.promotions.find({"is_active": True}, {"_id": 0}).to_list(None)
+        self.tables = PromotionTables(promotions)
+        logger.info(f"Compiled {self.tables.count} promotions")
+
+    async def refresh(self):
+        """Recompile if another worker changed promotions"""
+        now = time.monotonic()
+        if self.db is None or now - self._version_checked < PROMOTIONS_VERSION_POLL:
+            return
+        self._version_checked = now
+        try:
+            meta = await self.db.catalog_meta.find_one({"_id": META_ID}, {"version": 1})
+            version = meta["version"] if meta else 0
+            if version != self.version:
+                await self.load()
+                self.version = version
+        except Exception as e:
+            logger.warning(f"Promotion refresh failed: {e}")
+
+    async def bump(self):
+        """Record a promotion change and recompile locally"""
+        meta = await self.db.catalog_meta.find_one_and_update(
+            {"_id": META_ID},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await self.load()
+        self.version = meta["version"]
+        self._version_checked = time.monotonic()
+
+    def apply(self, lines: List[dict]) -> float:
+        """Set the best promotion on each line; returns the total promotion discount.
+
+        Lines need product_id, quantity and price, and may carry brand_id,
+        category_id and an existing per-line ``discount`` (e.g. tier) that
+        promotions are computed after.
+        """
+        now = datetime.utcnow()
+        matches = []
+        pools: Dict[str, List[float]] = {}
+        for line in lines:
+            line.pop("promo_discount", None)
+            line.pop("promotion_id", None)
+            line.pop("promotion_name", None)
+            rules = [r for r in self.tables.candidates(line) if r.live(now)]
+            if not rules:
+                continue
+            unit = line["price"] - line.get("discount", 0.0) / line["quantity"]
+            matches.append((line, rules, unit))
+            for rule in rules:
+                if rule.pooled:
+                    pool = pools.setdefault(rule.id, [0, 0.0])
+                    pool[0] += line["quantity"]
+                    pool[1] += unit * line["quantity"]
+
+        total = 0.0
+        for line, rules, unit in matches:
+            best, best_rule = 0.0, None
+            for rule in rules:
+                if rule.pooled:
+                    measure = pools[rule.id][0 if rule.basis == "quantity" else 1]
+                else:
+                    measure = line["quantity"] if rule.basis == "quantity" else unit * line["quantity"]
+                amount = rule.discount(line["quantity"], unit, measure)
+                if amount > best or (amount == best and best_rule and rule.priority > best_rule.priority):
+                    best, best_rule = amount, rule
+            if best_rule and best > 0:
+                best = round(min(best, unit * line["quantity"]), 2)
+                line["promo_discount"] = best
+                line["promotion_id"] = best_rule.id
+                line["promotion_name"] = best_rule.name
+                total += best
+        if total:
+            self.applications += 1
+        return round(total, 2)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.tables.count,
+            "indexed_products": len(self.tables.by_product),
+            "indexed_brands": len(self.tables.by_brand),
+            "indexed_categories": len(self.tables.by_category),
+            "applications": self.applications
+        }
+
+
+# Global promotion engine instance
+promotion_engine = PromotionEngine()
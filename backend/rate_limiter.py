@@ -0,0 +1,173 @@
+# Sliding-window rate limiting for OTP and AI endpoints
+import os
+import math
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps counters per worker, "mongo" shares them across workers
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+# Reverse proxies in front of the app that append to X-Forwarded-For. 0 ignores
+# the header; set it (nginx: 1) only when the app is reachable solely via the proxy
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+
+
+class InMemoryBackend:
+    """Exact sliding-window log: keeps at most ``limit`` timestamps per key"""
+
+    # Prune idle keys once the table grows past this many entries
+    MAX_KEYS = 50000
+
+    def __init__(self):
+        self._hits: Dict[str, deque] = {}
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, int]:
+        now = time.monotonic()
+        hits = self._hits.get(key)
+        if hits is None:
+            if len(self._hits) >= self.MAX_KEYS:
+                self._prune(now, window)
+            hits = self._hits[key] = deque(maxlen=limit)
+
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+
+        if len(hits) >= limit:
+            return False, max(1, math.ceil(hits[0] + window - now))
+
+        hits.append(now)
+        return True, 0
+
+    def _prune(self, now: float, window: int):
+        self._hits = {
+            key: hits for key, hits in self._hits.items()
+            if hits and hits[-1] > now - window
+        }
+
+
+class MongoBackend:
+    """Sliding-window counter over fixed buckets stored in ``rate_limits``.
+
+    The count for the previous bucket is weighted by how much of it still
+    overlaps the window, which approximates a true sliding window with two
+    small documents per key. The current bucket is incremented and read
+    back in one ``find_one_and_update``, so concurrent workers cannot all
+    pass on the same stale count. Buckets expire through a TTL index.
+    """
+
+    def __init__(self, database):
+        self.collection = database.rate_limits
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, int]:
+        now = time.time()
+        bucket = int(now // window)
+        elapsed = now - bucket * window
+        current_id = f"{key}:{bucket}"
+        previous_id = f"{key}:{bucket - 1}"
+
+        current = await self.collection.find_one_and_update(
+            {"_id": current_id},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "expires_at": datetime.utcfromtimestamp((bucket + 2) * window)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await self.collection.find_one({"_id": previous_id}, {"count": 1})
+
+        weighted = (previous["count"] if previous else 0) * (window - elapsed) / window
+        if weighted + current["count"] > limit:
+            # Rejected hits do not count towards the window
+            await self.collection.update_one({"_id": current_id}, {"$inc": {"count": -1}})
+            return False, max(1, math.ceil(window - elapsed))
+        return True, 0
+
+
+class RateLimiter:
+    """A named limit of ``limit`` hits per ``window`` seconds per key"""
+
+    def __init__(self, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.allowed = 0
+        self.rejected = 0
+
+    async def check(self, key: str):
+        """Record a hit for ``key`` and raise 429 if the limit is exceeded"""
+        if not RATE_LIMIT_ENABLED or not key:
+            return
+
+        try:
+            allowed, retry_after = await _backend.hit(f"{self.name}:{key}", self.limit, self.window)
+        except Exception as e:
+            # Fail open: a limiter outage must not lock everyone out
+            logger.error(f"Rate limiter '{self.name}' error: {str(e)}")
+            return
+
+        if allowed:
+            self.allowed += 1
+            return
+
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "window_seconds": self.window,
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+
+def client_ip(request: Request) -> str:
+    """Client address as seen by the outermost trusted proxy.
+
+    Proxies append to X-Forwarded-For, so entries to the left of the
+    trusted hops are whatever the client sent and cannot be believed.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.client.host if request.client else ""
+
+
+def limit_by_ip(limiter: RateLimiter) -> Callable:
+    """FastAPI dependency enforcing ``limiter`` per client IP"""
+    async def dependency(request: Request):
+        await limiter.check(client_ip(request))
+    return dependency
+
+
+_backend = InMemoryBackend()
+
+
+async def set_db(database):
+    """Switch to the shared Mongo backend when RATE_LIMIT_BACKEND=mongo"""
+    global _backend
+    if RATE_LIMIT_BACKEND == "mongo":
+        backend = MongoBackend(database)
+        await backend.ensure_indexes()
+        _backend = backend
+        logger.info("Rate limiter using MongoDB backend")
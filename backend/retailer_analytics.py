@@ -0,0 +1,253 @@
+# Columnar retailer analytics computed with NumPy / pandas
+import os
+import asyncio
+import logging
+from datetime import datetime
+from itertools import chain
+from operator import itemgetter
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Orders fetched per round trip while building the columns
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', '2000'))
+TOP_N = 5
+
+VOID_STATUSES = ("cancelled", "returned")
+
+
+def _lines(expression: dict) -> dict:
+    """Per-order array of ``expression`` evaluated for each line item as ``$$item``"""
+    return {"$map": {"input": {"$ifNull": ["$items", []]}, "as": "item", "in": expression}}
+
+
+def _line_field(field: str, default) -> dict:
+    return _lines({"$ifNull": [f"$$item.{field}", default]})
+
+
+def order_pipeline(user_id: str) -> List[dict]:
+    """A retailer's orders, each projected to flat columns.
+
+    Defaults are filled and line fields are gathered into per-order arrays
+    in the database, so a batch turns into NumPy arrays by concatenating
+    lists instead of walking every line item in Python.
+    """
+    product_id = _lines(
+        {"$cond": [{"$eq": [{"$ifNull": ["$$item.product_id", ""]}, ""]}, "unknown", "$$item.product_id"]}
+    )
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$project": {
+            "_id": 0,
+            "created_at": 1,
+            "total": {"$ifNull": ["$total_amount", 0]},
+            "void": {"$in": ["$order_status", list(VOID_STATUSES)]},
+            "product_id": product_id,
+            "product_name": _line_field("product_name", "Unknown"),
+            "quantity": _line_field("quantity", 0),
+            "value": _line_field("total", 0)
+        }}
+    ]
+
+
+class OrderColumns:
+    """One retailer's orders and lines as parallel arrays.
+
+    Line arrays carry ``order_index`` into the order arrays, so per-order
+    and per-product figures are reductions rather than nested loops.
+    """
+
+    def __init__(self):
+        self.created_at = np.empty(0, dtype="datetime64[ms]")
+        self.total = np.empty(0, dtype=np.float64)
+        self.void = np.empty(0, dtype=bool)
+        self.order_index = np.empty(0, dtype=np.int64)
+        self.product_id = np.empty(0, dtype=object)
+        self.product_name = np.empty(0, dtype=object)
+        self.quantity = np.empty(0, dtype=np.float64)
+        self.value = np.empty(0, dtype=np.float64)
+
+    @classmethod
+    def from_batches(cls, batches: List[dict]) -> "OrderColumns":
+        columns = cls()
+        if batches:
+            for field in batches[0]:
+                setattr(columns, field, np.concatenate([batch[field] for batch in batches]))
+        return columns
+
+    @property
+    def orders(self) -> int:
+        return len(self.total)
+
+
+def _batch_columns(orders: List[dict], offset: int) -> dict:
+    """Column arrays for one batch of documents from order_pipeline()"""
+    n = len(orders)
+
+    def lines(field: str, dtype) -> np.ndarray:
+        return np.array(list(chain.from_iterable(map(itemgetter(field), orders))), dtype=dtype)
+
+    counts = np.fromiter(map(len, map(itemgetter("product_id"), orders)), dtype=np.int64, count=n)
+    return {
+        "created_at": pd.DatetimeIndex(list(map(itemgetter("created_at"), orders))).to_numpy("datetime64[ms]"),
+        "total": np.fromiter(map(itemgetter("total"), orders), dtype=np.float64, count=n),
+        "void": np.fromiter(map(itemgetter("void"), orders), dtype=bool, count=n),
+        "order_index": np.repeat(np.arange(offset, offset + n, dtype=np.int64), counts),
+        "product_id": lines("product_id", object),
+        "product_name": lines("product_name", object),
+        "quantity": lines("quantity", np.float64),
+        "value": lines("value", np.float64),
+    }
+
+
+def _growth(current: float, previous: float):
+    return round((current - previous) / previous * 100, 2) if previous else None
+
+
+def summarize(columns: OrderColumns, now: pd.Timestamp) -> dict:
+    """Totals, top products, period-over-period growth and moving averages"""
+    total_orders = columns.orders
+    total_revenue = float(columns.total.sum())
+    result = {
+        "total_orders": total_orders,
+        "total_revenue": round(total_revenue, 2),
+        "avg_order_value": round(total_revenue / total_orders, 2) if total_orders else 0,
+        "top_products": [],
+        "insights": {}
+    }
+    if not total_orders:
+        return result
+
+    # Per-product sums via integer codes and bincount; top-N via argpartition
+    codes, uniques = pd.factorize(columns.product_id)
+    revenue = np.bincount(codes, weights=columns.value, minlength=len(uniques))
+    quantity = np.bincount(codes, weights=columns.quantity, minlength=len(uniques))
+    # Orders containing each product: distinct (order, product) pairs
+    pairs = pd.unique(columns.order_index * max(len(uniques), 1) + codes)
+    order_counts = np.bincount(pairs % max(len(uniques), 1), minlength=len(uniques))
+    # Latest name per product (later lines overwrite earlier ones)
+    names = np.empty(len(uniques), dtype=object)
+    names[codes] = columns.product_name
+
+    def top(metric: np.ndarray) -> List[dict]:
+        n = min(TOP_N, len(metric))
+        if not n:
+            return []
+        picked = np.argpartition(-metric, n - 1)[:n]
+        picked = picked[np.argsort(-metric[picked], kind="stable")]
+        return [{
+            "product_id": uniques[i],
+            "name": names[i],
+            "quantity": int(quantity[i]),
+            "revenue": round(float(revenue[i]), 2),
+            "orders": int(order_counts[i])
+        } for i in picked]
+
+    result["top_products"] = top(revenue)
+
+    # Time series on non-voided orders
+    live = ~columns.void
+    orders = pd.DataFrame({"total": columns.total[live]}, index=pd.DatetimeIndex(columns.created_at[live]))
+    daily = orders["total"].resample("D").agg(["sum", "count"])
+    monthly = orders["total"].resample("MS").agg(["sum", "count"])
+    monthly["growth_pct"] = monthly["sum"].pct_change().replace([np.inf, -np.inf], np.nan).mul(100).round(2)
+
+    recent = daily.loc[daily.index >= now.normalize() - pd.Timedelta(days=89)]
+    moving = pd.DataFrame({
+        "revenue": recent["sum"],
+        "ma_7": recent["sum"].rolling(7, min_periods=1).mean().round(2),
+        "ma_30": recent["sum"].rolling(30, min_periods=1).mean().round(2)
+    })
+
+    def window(days: int, back: int) -> pd.Series:
+        end = now - pd.Timedelta(days=days * back)
+        mask = (orders.index > end - pd.Timedelta(days=days)) & (orders.index <= end)
+        return orders["total"][mask]
+
+    last_30, prior_30 = window(30, 0), window(30, 1)
+    voided = int(columns.void.sum())
+    result["insights"] = {
+        "period_over_period": {
+            "revenue_last_30d": round(float(last_30.sum()), 2),
+            "revenue_prior_30d": round(float(prior_30.sum()), 2),
+            "revenue_growth_pct": _growth(float(last_30.sum()), float(prior_30.sum())),
+            "orders_last_30d": int(last_30.size),
+            "orders_prior_30d": int(prior_30.size),
+            "orders_growth_pct": _growth(last_30.size, prior_30.size)
+        },
+        "monthly": [
+            {
+                "month": month,
+                "revenue": round(revenue, 2),
+                "orders": int(count),
+                "growth_pct": None if np.isnan(growth) else growth
+            }
+            for month, revenue, count, growth in zip(
+                monthly.index.strftime("%Y-%m"), *(monthly[c].tolist() for c in ("sum", "count", "growth_pct"))
+            )
+        ],
+        "daily_revenue_90d": [
+            {"date": day, "revenue": round(revenue, 2), "ma_7": ma_7, "ma_30": ma_30}
+            for day, revenue, ma_7, ma_30 in zip(
+                moving.index.strftime("%Y-%m-%d"), *(moving[c].tolist() for c in ("revenue", "ma_7", "ma_30"))
+            )
+        ],
+        "top_products_by_quantity": top(quantity),
+        "distinct_products": len(uniques),
+        "line_items": int(len(codes)),
+        "avg_items_per_order": round(len(codes) / total_orders, 2),
+        "cancelled_or_returned_orders": voided,
+        "void_rate_pct": round(voided / total_orders * 100, 2),
+        "first_order_at": pd.Timestamp(columns.created_at.min()).isoformat(),
+        "last_order_at": pd.Timestamp(columns.created_at.max()).isoformat()
+    }
+    return result
+
+
+class RetailerAnalytics:
+    """Builds a retailer's order columns batch by batch and summarises them.
+
+    The database projects each order into per-order columns, batches are
+    turned into arrays by concatenation, and every aggregate after that is a
+    vectorized NumPy / pandas operation, so there is no cap on history.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.runs = 0
+        self.rows = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def columns(self, user_id: str) -> OrderColumns:
+        batches, batch, offset = [], [], 0
+        cursor = self.db.orders.aggregate(order_pipeline(user_id), batchSize=ANALYTICS_BATCH_SIZE)
+        async for order in cursor:
+            batch.append(order)
+            if len(batch) >= ANALYTICS_BATCH_SIZE:
+                batches.append(_batch_columns(batch, offset))
+                offset += len(batch)
+                batch = []
+        if batch:
+            batches.append(_batch_columns(batch, offset))
+        return OrderColumns.from_batches(batches)
+
+    async def summary(self, user_id: str) -> dict:
+        columns = await self.columns(user_id)
+        self.runs += 1
+        self.rows += len(columns.order_index)
+        # Vectorized, but still CPU-bound: keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, summarize, columns, pd.Timestamp(datetime.utcnow())
+        )
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "line_items_processed": self.rows}
+
+
+# Global retailer analytics instance
+retailer_analytics = RetailerAnalytics()
@@ -0,0 +1,237 @@
+# Pre-aggregated sales rollups bucketed by hour/day and product/category/retailer/pincode
+import os
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Orders folded into one bulk write during a backfill
+ROLLUP_BACKFILL_BATCH = int(os.getenv('ROLLUP_BACKFILL_BATCH', '500'))
+
+GRAINS = ("hour", "day")
+DIMENSIONS = ("all", "product", "category", "retailer", "pincode")
+# Order statuses whose sales are taken back out of the rollups
+VOID_STATUSES = ("cancelled", "returned")
+
+# Order fields the rollups are computed from
+ORDER_FIELDS = {
+    "_id": 0, "id": 1, "user_id": 1, "user_role": 1, "created_at": 1, "total_amount": 1,
+    "order_status": 1, "refund_status": 1, "delivery_address.pincode": 1,
+    "items.product_id": 1, "items.category_id": 1, "items.quantity": 1, "items.total": 1, "items.discount": 1
+}
+
+
+def bucket_start(at: datetime, grain: str) -> datetime:
+    if grain == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_id(grain: str, bucket: datetime, dim: str, key: str) -> str:
+    return f"{grain}|{bucket.isoformat()}|{dim}|{key}"
+
+
+class SalesRollups:
+    """Sales counters in ``sales_rollups``, one document per (grain, bucket, dimension, key).
+
+    Order-level dimensions (all, retailer, pincode) count orders and sum
+    ``total_amount``; item-level ones (product, category) count orders
+    containing the key, quantity, and line value net of discounts. Sales
+    stay in the bucket of the order's ``created_at``, so a cancellation
+    or refund adjusts the bucket the sale was recorded in.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.writes = 0
+        self.backfilled = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    def _contributions(self, order: dict, sign: int = 1) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """(dimension, key) -> counter increments for one order"""
+        order_counts = {"orders": sign, "revenue": sign * order.get("total_amount", 0)}
+        keys = {("all", "all"): dict(order_counts)}
+        if order.get("user_role") == "retailer":
+            keys[("retailer", order["user_id"])] = dict(order_counts)
+        pincode = (order.get("delivery_address") or {}).get("pincode")
+        if pincode:
+            keys[("pincode", str(pincode))] = dict(order_counts)
+
+        for item in order.get("items", []):
+            value = sign * (item.get("total", 0) - item.get("discount", 0))
+            quantity = sign * item.get("quantity", 0)
+            targets = [("product", item["product_id"])]
+            if item.get("category_id"):
+                targets.append(("category", item["category_id"]))
+            for target in targets:
+                counts = keys.get(target)
+                if counts is None:
+                    # An order counts once per product / category however many lines it has
+                    counts = keys[target] = {"orders": sign, "quantity": 0, "revenue": 0.0}
+                counts["quantity"] += quantity
+                counts["revenue"] += value
+        return keys
+
+    def _updates(self, created_at: datetime, keys: Dict[Tuple[str, str], Dict[str, float]]) -> List[UpdateOne]:
+        updates = []
+        for grain in GRAINS:
+            bucket = bucket_start(created_at, grain)
+            for (dim, key), counts in keys.items():
+                updates.append(UpdateOne(
+                    {"_id": rollup_id(grain, bucket, dim, key)},
+                    {
+                        "$inc": counts,
+                        "$setOnInsert": {"grain": grain, "bucket": bucket, "dim": dim, "key": key}
+                    },
+                    upsert=True
+                ))
+        return updates
+
+    async def _write(self, updates: List[UpdateOne]):
+        if not updates or self.db is None:
+            return
+        try:
+            await self.db.sales_rollups.bulk_write(updates, ordered=False)
+            self.writes += 1
+        except Exception as e:
+            # Rollups are rebuilt by the backfill job; never fail the order path
+            logger.warning(f"Sales rollup update failed: {e}")
+
+    async def order_placed(self, order: dict):
+        await self._write(self._updates(order["created_at"], self._contributions(order)))
+
+    async def status_changed(self, order: dict, new_status: str):
+        """Take a voided order's sales out of its buckets, or put a reinstated one back"""
+        was_void = order.get("order_status") in VOID_STATUSES
+        is_void = new_status in VOID_STATUSES
+        if was_void == is_void:
+            return
+        sign = -1 if is_void else 1
+        keys = self._contributions(order, sign)
+        for counts in keys.values():
+            counts["cancelled"] = -sign
+        await self._write(self._updates(order["created_at"], keys))
+
+    async def refunded(self, order: dict, amount: float):
+        """Record an approved refund against the order-level dimensions"""
+        keys = {
+            target: {"refunds": 1, "refunded_amount": amount}
+            for target in self._contributions(order) if target[0] in ("all", "retailer", "pincode")
+        }
+        await self._write(self._updates(order["created_at"], keys))
+
+    async def backfill(self, start: datetime, end: datetime) -> int:
+        """Rebuild the buckets for orders created in [start, end) from their current state.
+
+        The range is widened/narrowed to whole days so no day bucket is left
+        holding only part of its orders.
+        """
+        start, end = bucket_start(start, "day"), bucket_start(end, "day")
+        await self.db.sales_rollups.delete_many({"bucket": {"$gte": start, "$lt": end}})
+
+        orders = 0
+        batch: List[dict] = []
+        cursor = self.db.orders.find(
+            {"created_at": {"$gte": start, "$lt": end}}, ORDER_FIELDS
+        ).sort("created_at", 1).batch_size(ROLLUP_BACKFILL_BATCH)
+        async for order in cursor:
+            batch.append(order)
+            if len(batch) >= ROLLUP_BACKFILL_BATCH:
+                orders += await self._backfill_batch(batch)
+                batch = []
+        if batch:
+            orders += await self._backfill_batch(batch)
+        self.backfilled += orders
+        logger.info(f"Backfilled sales rollups for {orders} orders")
+        return orders
+
+    async def _backfill_batch(self, orders: List[dict]) -> int:
+        await self._fill_categories(orders)
+        refunds: Dict[str, float] = {}
+        refunded_ids = [o["id"] for o in orders if o.get("refund_status") == "approved"]
+        if refunded_ids:
+            async for refund in self.db.refunds.find(
+                {"order_id": {"$in": refunded_ids}, "status": "approved"},
+                {"_id": 0, "order_id": 1, "refund_amount": 1}
+            ):
+                refunds[refund["order_id"]] = refunds.get(refund["order_id"], 0) + refund["refund_amount"]
+
+        # Merge the batch's increments per rollup document before writing
+        merged: Dict[Tuple[str, datetime, str, str], Dict[str, float]] = {}
+        for order in orders:
+            if order.get("order_status") in VOID_STATUSES:
+                keys = {target: {"cancelled": 1} for target in self._contributions(order)}
+            else:
+                keys = self._contributions(order)
+                if order["id"] in refunds:
+                    for target, counts in keys.items():
+                        if target[0] in ("all", "retailer", "pincode"):
+                            counts["refunds"] = 1
+                            counts["refunded_amount"] = refunds[order["id"]]
+            for grain in GRAINS:
+                bucket = bucket_start(order["created_at"], grain)
+                for (dim, key), counts in keys.items():
+                    total = merged.setdefault((grain, bucket, dim, key), {})
+                    for field, value in counts.items():
+                        total[field] = total.get(field, 0) + value
+
+        await self.db.sales_rollups.bulk_write([
+            UpdateOne(
+                {"_id": rollup_id(grain, bucket, dim, key)},
+                {"$inc": counts, "$setOnInsert": {"grain": grain, "bucket": bucket, "dim": dim, "key": key}},
+                upsert=True
+            )
+            for (grain, bucket, dim, key), counts in merged.items()
+        ], ordered=False)
+        return len(orders)
+
+    async def _fill_categories(self, orders: List[dict]):
+        """Orders placed before lines carried category_id take it from the product"""
+        missing = {
+            item["product_id"] for order in orders for item in order.get("items", []) if not item.get("category_id")
+        }
+        if not missing:
+            return
+        categories = {}
+        async for product in self.db.products.find({"id": {"$in": list(missing)}}, {"_id": 0, "id": 1, "category_id": 1}):
+            categories[product["id"]] = product.get("category_id")
+        for order in orders:
+            for item in order.get("items", []):
+                if not item.get("category_id"):
+                    item["category_id"] = categories.get(item["product_id"])
+
+    async def query(
+        self,
+        grain: str,
+        dim: str,
+        start: datetime,
+        end: datetime,
+        keys: Optional[Iterable[str]] = None
+    ) -> dict:
+        """Time series and per-key totals for [start, end) from rollup documents"""
+        query = {"grain": grain, "dim": dim, "bucket": {"$gte": bucket_start(start, grain), "$lt": end}}
+        if keys:
+            query["key"] = {"$in": list(keys)}
+        series = []
+        totals: Dict[str, Dict[str, float]] = {}
+        async for row in self.db.sales_rollups.find(
+            query, {"_id": 0, "grain": 0, "dim": 0}
+        ).sort([("bucket", 1), ("key", 1)]):
+            series.append(row)
+            total = totals.setdefault(row["key"], {})
+            for field, value in row.items():
+                if field not in ("bucket", "key"):
+                    total[field] = total.get(field, 0) + value
+        return {"grain": grain, "dim": dim, "start": start, "end": end, "series": series, "totals": totals}
+
+    def stats(self) -> dict:
+        return {"writes": self.writes, "backfilled_orders": self.backfilled}
+
+
+# Global sales rollups instance
+sales_rollups = SalesRollups()
@@ -0,0 +1,240 @@
+# In-memory inverted index for catalog search
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from fuzzy_matcher import FuzzyMatcher
+
+logger = logging.getLogger(__name__)
+
+# Periodic full rebuild so workers pick up catalog edits made elsewhere
+SEARCH_INDEX_REFRESH = int(os.getenv('SEARCH_INDEX_REFRESH', '300'))  # seconds
+
+# Field weights: a hit in the name counts for more than one in the description
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "brand": 2.0,
+    "tags": 1.5,
+    "description": 1.0
+}
+
+MIN_PREFIX = 2
+MAX_PREFIX = 12
+PREFIX_MATCH_WEIGHT = 0.6  # a prefix completion scores below an exact token
+MAX_EXPANSIONS = 50
+
+STOPWORDS = {"a", "an", "and", "the", "of", "for", "with", "in", "ka", "ki", "ke"}
+
+# Fields needed to index a product; used as a Mongo projection
+INDEX_FIELDS = {"_id": 0, "id": 1, "name": 1, "brand": 1, "tags": 1, "description": 1, "category_id": 1, "is_active": 1}
+
+_TOKEN_RE = re.compile(r"[a-z0-9\u0900-\u097f]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase word tokens, without stopwords"""
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class ProductSearchIndex:
+    """Tokenized inverted index over active products with prefix expansion.
+
+    Postings map token -> {product_id: weighted term frequency}. A separate
+    prefix table maps every 2..12 character prefix to the tokens that start
+    with it, so partially typed words resolve without scanning the vocabulary.
+    Terms that match nothing fall back to typo/phonetic correction through
+    the attached FuzzyMatcher.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._prefixes: Dict[str, Set[str]] = {}
+        self._docs: Dict[str, dict] = {}  # product_id -> {"category_id", "tokens"}
+        self.fuzzy = FuzzyMatcher()
+        self.ready = False
+        self.built_at: Optional[float] = None
+        self.queries = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    # ---------- maintenance ----------
+
+    def build(self, products: List[dict]):
+        """Replace the index contents with ``products``"""
+        self._postings = {}
+        self._prefixes = {}
+        self._docs = {}
+        self.fuzzy.clear()
+        for product in products:
+            self.upsert(product)
+        self.ready = True
+        self.built_at = time.time()
+
+    def upsert(self, product: dict):
+        """Index or re-index a product; inactive products are removed"""
+        product_id = product.get("id")
+        if not product_id:
+            return
+        self.remove(product_id)
+        if not product.get("is_active", True):
+            return
+
+        weights: Dict[str, float] = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            value = product.get(field)
+            if isinstance(value, list):
+                value = " ".join(str(v) for v in value)
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0.0) + field_weight
+
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                for i in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+                    self._prefixes.setdefault(token[:i], set()).add(token)
+                self.fuzzy.add_word(token)
+            postings[product_id] = weight
+
+        self._docs[product_id] = {
+            "category_id": product.get("category_id"),
+            "tokens": set(weights)
+        }
+
+    def remove(self, product_id: str):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        for token in doc["tokens"]:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                for i in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+                    tokens = self._prefixes.get(token[:i])
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._prefixes[token[:i]]
+
+    # ---------- querying ----------
+
+    def expand(self, term: str) -> Dict[str, float]:
+        """Index tokens matching ``term`` with their match weight"""
+        matches: Dict[str, float] = {}
+        if term in self._postings:
+            matches[term] = 1.0
+        if len(term) >= MIN_PREFIX:
+            candidates = self._prefixes.get(term[:MAX_PREFIX], ())
+            if len(candidates) > MAX_EXPANSIONS:
+                # Prefer the most common completions for very short prefixes
+                candidates = sorted(candidates, key=lambda t: -len(self._postings[t]))[:MAX_EXPANSIONS]
+            for token in candidates:
+                if token != term and token.startswith(term):
+                    matches[token] = PREFIX_MATCH_WEIGHT
+        return matches
+
+    def _idf(self, token: str) -> float:
+        n = len(self._docs)
+        df = len(self._postings.get(token, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, category_id: Optional[str] = None) -> List[str]:
+        """Ranked product ids for ``query``.
+
+        Products matching every query term rank first; if none do, products
+        matching any term are returned so a stray word does not empty results.
+        """
+        self.queries += 1
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores: Dict[str, float] = {}
+        matched_terms: Dict[str, int] = {}
+        for term in terms:
+            matches = self.expand(term)
+            if not matches:
+                matches = self.fuzzy.lookup(term, known=self._postings)
+            term_scores: Dict[str, float] = {}
+            for token, match_weight in matches.items():
+                idf = self._idf(token)
+                for product_id, weight in self._postings.get(token, {}).items():
+                    score = weight * idf * match_weight
+                    if score > term_scores.get(product_id, 0.0):
+                        term_scores[product_id] = score
+            for product_id, score in term_scores.items():
+                scores[product_id] = scores.get(product_id, 0.0) + score
+                matched_terms[product_id] = matched_terms.get(product_id, 0) + 1
+
+        if category_id:
+            scores = {pid: s for pid, s in scores.items() if self._docs[pid]["category_id"] == category_id}
+
+        full_matches = [pid for pid in scores if matched_terms[pid] == len(terms)]
+        ranked = full_matches or list(scores)
+        ranked.sort(key=lambda pid: (-scores[pid], pid))
+        return ranked
+
+    def did_you_mean(self, query: str) -> Optional[str]:
+        """Query with unknown terms replaced by their closest indexed token"""
+        terms = tokenize(query)
+        corrected = []
+        changed = False
+        for term in terms:
+            if self.expand(term):
+                corrected.append(term)
+                continue
+            match = self.fuzzy.best_match(term, known=self._postings)
+            corrected.append(match or term)
+            changed = changed or match is not None
+        return " ".join(corrected) if changed else None
+
+    def vocabulary(self) -> List[str]:
+        return list(self._postings)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "products": len(self._docs),
+            "tokens": len(self._postings),
+            "prefixes": len(self._prefixes),
+            "queries": self.queries,
+            "built_at": self.built_at,
+            "fuzzy": self.fuzzy.stats()
+        }
+
+    # ---------- database integration ----------
+
+    async def rebuild(self, db):
+        started = time.perf_counter()
+        products = await db.products.find({"is_active": True}, INDEX_FIELDS).to_list(None)
+        self.build(products)
+        logger.info(f"Search index built: {len(products)} products in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    async def _refresh_loop(self, db):
+        while True:
+            await asyncio.sleep(SEARCH_INDEX_REFRESH)
+            try:
+                await self.rebuild(db)
+            except Exception as e:
+                logger.warning(f"Search index refresh failed: {e}")
+
+    async def start(self, db):
+        await self.rebuild(db)
+        self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+# Global search index instance
+search_index = ProductSearchIndex()
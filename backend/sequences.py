@@ -0,0 +1,74 @@
+# Human-friendly document numbers from block-allocated (hi/lo) sequences
+import os
+import asyncio
+from typing import Dict, List
+
+from pymongo import ReturnDocument
+
+# Numbers reserved per round trip to the counters collection
+SEQUENCE_BLOCK = int(os.getenv('SEQUENCE_BLOCK', '50'))
+# Sequences start above the old random six-digit range so they never collide with it
+SEQUENCE_START = 1000000
+
+# Sequence name -> number prefix
+PREFIXES = {
+    "order": "ORD",
+    "ticket": "TKT",
+}
+
+
+class SequenceService:
+    """Allocates increasing numbers per sequence, a block at a time.
+
+    Each worker reserves SEQUENCE_BLOCK numbers with one ``$inc`` on the
+    ``counters`` collection and hands them out from memory. Numbers are
+    unique across workers and increase within a worker; a restart skips
+    the rest of its block.
+    """
+
+    def __init__(self, block: int = SEQUENCE_BLOCK):
+        self.db = None
+        self.block = block
+        self._ranges: Dict[str, List[int]] = {}  # name -> [next, last]
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.allocations = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def _allocate(self, name: str) -> List[int]:
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"value": self.block}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.allocations += 1
+        last = SEQUENCE_START + counter["value"]
+        return [last - self.block + 1, last]
+
+    async def next(self, name: str) -> int:
+        current = self._ranges.get(name)
+        if current is None or current[0] > current[1]:
+            lock = self._locks.setdefault(name, asyncio.Lock())
+            async with lock:
+                current = self._ranges.get(name)
+                if current is None or current[0] > current[1]:
+                    current = self._ranges[name] = await self._allocate(name)
+        value = current[0]
+        current[0] += 1
+        return value
+
+    async def next_number(self, name: str) -> str:
+        """Formatted number, e.g. ORD1000001"""
+        return f"{PREFIXES[name]}{await self.next(name)}"
+
+    def stats(self) -> dict:
+        return {
+            "allocations": self.allocations,
+            "remaining": {name: r[1] - r[0] + 1 for name, r in self._ranges.items()}
+        }
+
+
+# Global sequence service instance
+sequences = SequenceService()
@@ -1,20 +1,25 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks, Query, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import io
+import csv
+import json
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
 import random
 import string
-import hashlib
-import razorpay
+import secrets
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 # Import new utility modules
 from email_service import send_otp_email, send_order_notification, send_admin_notification
@@ -23,6 +28,28 @@ from sms_service import sms_service
 from ai_service import ai_service
 from kyc_routes import kyc_router, set_db as set_kyc_db
 from websocket_handler import delivery_tracker
+from session_cache import session_cache
+from token_service import token_service, TokenError, REFRESH
+from rate_limiter import RateLimiter, limit_by_ip, client_ip, set_db as set_rate_limit_db
+from search_engine import search_index, INDEX_FIELDS
+from autocomplete import autocomplete
+from pagination import paginate, encode_offset_cursor, decode_offset_cursor, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from catalog_cache import catalog_cache
+from projections import build_projection, VIEW_ROLES
+from product_loader import ProductLoader
+from price_stamps import price_stamps, STAMP_UPDATE
+from inventory import inventory, StockShortage
+from stock_holds import stock_holds
+from sharded_inventory import sharded_inventory, DEFAULT_SHARDS, MAX_SHARDS
+from sequences import sequences
+from payment_gateway import payment_gateway, GatewayUnavailable
+from pricing import pricing_engine, PricingError
+from promotions import promotion_engine, Promotion, PromotionError, validate_promotion
+from credit_accounts import credit_accounts, InsufficientCredit, REVERSAL
+from dashboard_counters import dashboard_counters, LOW_STOCK_FIELDS
+from sales_rollups import sales_rollups, ORDER_FIELDS as ROLLUP_ORDER_FIELDS, GRAINS, DIMENSIONS
+from retailer_analytics import retailer_analytics
+from cart_routes import router as cart_router, set_db as set_cart_db
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -32,13 +59,9 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client.get_database(os.environ.get('DB_NAME', 'soveh_db'))
 
-# Razorpay client (configured from environment)
-RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID', 'rzp_test_dummy')
-RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET', 'test_secret_dummy')
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 app = FastAPI(title="SOVEH API", version="1.0.0")
 api_router = APIRouter(prefix="/api")
@@ -99,6 +122,14 @@ class LoginResponse(BaseModel):
     success: bool
     token: str
     user: User
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 # Retailer Models
 class RetailerStatus:
@@ -144,7 +175,7 @@ class Product(BaseModel):
     max_order_qty: Optional[int] = None
     unit_size: Optional[str] = None
     expiry_date: Optional[datetime] = None
-    gst_percent: float = 0.0
+    gst_percent: Optional[float] = None  # None: HSN or default rate at pricing
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -174,10 +205,19 @@ class OrderStatus:
 
 class OrderItem(BaseModel):
     product_id: str
+    variant_id: Optional[str] = None
     product_name: str
     quantity: int
     price: float
     total: float
+    category_id: Optional[str] = None
+    mrp: Optional[float] = None
+    discount: float = 0.0
+    hsn_code: Optional[str] = None
+    gst_rate: Optional[float] = None
+    gst_amount: Optional[float] = None
+    promotion_id: Optional[str] = None
+    promo_discount: float = 0.0
 
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -187,9 +227,11 @@ class Order(BaseModel):
     items: List[OrderItem]
     subtotal: float
     gst_amount: float
+    gst_breakup: List[Dict[str, Any]] = []  # GST per (HSN code, rate)
     delivery_charges: float
     discount: float = 0.0
     total_amount: float
+    pricing_tier: Optional[str] = None
     payment_mode: str  # cod, online, credit
     payment_status: str = "pending"
     order_status: str = OrderStatus.PLACED
@@ -223,9 +265,11 @@ class Payment(BaseModel):
 class CreditLedger(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     retailer_id: str
-    transaction_type: str  # credit_purchase, payment, adjustment
+    transaction_type: str  # credit_purchase, payment, adjustment, reversal
     amount: float
-    balance: float
+    delta: Optional[float] = None  # signed change to available credit
+    balance: float  # available credit after this entry
+    seq: Optional[int] = None  # position in the retailer's ledger
     order_id: Optional[str] = None
     description: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -267,23 +311,74 @@ class AppConfig(BaseModel):
 def generate_otp():
     return ''.join(random.choices(string.digits, k=6))
 
-def generate_token(user_id: str, role: str):
-    token_data = f"{user_id}:{role}:{datetime.utcnow().isoformat()}"
-    return hashlib.sha256(token_data.encode()).hexdigest()
+def generate_token():
+    # Random rather than derived from the user, so it can be issued in the
+    # same write that creates or updates the user document
+    return secrets.token_hex(32)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
-    # Simple token validation (in production, use JWT)
-    user = await db.users.find_one({"token": token})
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return User(**user)
+    # Signed tokens are verified in-process without touching the database
+    if token_service.enabled and token_service.is_signed(token):
+        try:
+            claims = token_service.verify(token)
+        except TokenError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        return User(
+            id=claims["sub"],
+            phone=claims["phone"],
+            role=claims["role"],
+            name=claims.get("name"),
+            email=claims.get("email")
+        )
+    
+    # Repeat requests are served from the in-process session cache
+    user = session_cache.get(token)
+    if user is None:
+        # Simple token validation (in production, use JWT)
+        user_doc = await db.users.find_one({"token": token})
+        if not user_doc:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        user = User(**user_doc)
+        session_cache.set(token, user)
+    if user.is_blocked:
+        raise HTTPException(status_code=403, detail="Account is blocked")
+    return user
+
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[User]:
+    """The caller for endpoints that also serve anonymous requests"""
+    if credentials is None:
+        return None
+    return await get_current_user(credentials)
+
+# ==================== RATE LIMITS ====================
+
+otp_phone_limiter = RateLimiter("otp_phone", limit=5, window=900)  # 5 OTPs per phone per 15 min
+otp_ip_limiter = RateLimiter("otp_ip", limit=20, window=600)
+# Guards against OTP guessing. Per phone and IP so one client cannot lock a phone
+# out, plus a looser per-phone cap so rotating IPs cannot guess without bound
+otp_verify_limiter = RateLimiter("otp_verify", limit=10, window=900)
+otp_verify_phone_limiter = RateLimiter("otp_verify_phone", limit=30, window=900)
+ai_user_limiter = RateLimiter("ai_user", limit=30, window=60)
+ai_ip_limiter = RateLimiter("ai_ip", limit=30, window=60)
+
+rate_limiters = [
+    otp_phone_limiter, otp_ip_limiter, otp_verify_limiter, otp_verify_phone_limiter, ai_user_limiter, ai_ip_limiter
+]
+
+async def get_ai_user(current_user: User = Depends(get_current_user)):
+    """Authenticated user, limited to a fair share of paid LLM calls"""
+    await ai_user_limiter.check(current_user.id)
+    return current_user
 
 # ==================== AUTH ENDPOINTS ====================
 
-@api_router.post("/auth/send-otp", response_model=OTPResponse)
+@api_router.post("/auth/send-otp", response_model=OTPResponse, dependencies=[Depends(limit_by_ip(otp_ip_limiter))])
 async def send_otp(request: OTPRequest):
     """Send OTP to phone number via SMS"""
+    await otp_phone_limiter.check(request.phone)
     try:
         otp = generate_otp()
         session_id = str(uuid.uuid4())
@@ -312,49 +407,75 @@ async def send_otp(request: OTPRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/auth/verify-otp", response_model=LoginResponse)
-async def verify_otp(request: OTPVerify):
+async def verify_otp(request: OTPVerify, http_request: Request):
     """Verify OTP and login/register user"""
+    await otp_verify_limiter.check(f"{request.phone}:{client_ip(http_request)}")
+    await otp_verify_phone_limiter.check(request.phone)
     try:
-        # Find OTP session
-        otp_session = await db.otp_sessions.find_one({
-            "phone": request.phone,
-            "otp": request.otp,
-            "expires_at": {"$gt": datetime.utcnow()}
-        })
+        now = datetime.utcnow()
+        
+        # Consume the OTP atomically so it cannot be replayed
+        otp_session = await db.otp_sessions.find_one_and_delete(
+            {
+                "phone": request.phone,
+                "otp": request.otp,
+                "expires_at": {"$gt": now}
+            },
+            projection={"_id": 1}
+        )
         
         if not otp_session:
             raise HTTPException(status_code=400, detail="Invalid or expired OTP")
         
-        # Check if user exists
-        user = await db.users.find_one({"phone": request.phone})
+        # Create the user on first login and stamp last_login in one update.
+        # Opaque tokens don't depend on the user record, so they ride along too.
+        new_user = User(phone=request.phone, role=request.role).dict()
+        for field in ("phone", "last_login"):
+            new_user.pop(field)
         
-        if not user:
-            # Create new user
-            new_user = User(
-                phone=request.phone,
-                role=request.role,
-                last_login=datetime.utcnow()
+        user_update = {"$set": {"last_login": now}, "$setOnInsert": new_user}
+        if not token_service.enabled:
+            token = generate_token()
+            user_update["$set"]["token"] = token
+        
+        try:
+            user = await db.users.find_one_and_update(
+                {"phone": request.phone},
+                user_update,
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
-            await db.users.insert_one(new_user.dict())
-            user = new_user.dict()
-        else:
-            # Update last login
-            await db.users.update_one(
+        except DuplicateKeyError:
+            # A concurrent first login for this phone inserted the user first
+            user_update.pop("$setOnInsert")
+            user = await db.users.find_one_and_update(
                 {"phone": request.phone},
-                {"$set": {"last_login": datetime.utcnow()}}
+                user_update,
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
             )
         
-        # Generate token
-        token = generate_token(user["id"], user["role"])
-        await db.users.update_one({"id": user["id"]}, {"$set": {"token": token}})
+        if user["id"] == new_user["id"]:
+            # This request inserted the user
+            await dashboard_counters.inc(total_users=1)
         
-        # Delete used OTP
-        await db.otp_sessions.delete_one({"session_id": otp_session["session_id"]})
+        if user.get("is_blocked"):
+            raise HTTPException(status_code=403, detail="Account is blocked")
+        
+        # Generate token
+        if token_service.enabled:
+            # Signed tokens are not stored, so other devices stay logged in
+            tokens = token_service.issue_pair(user)
+        else:
+            # The previous token is no longer valid
+            session_cache.invalidate_user(user["id"])
+            tokens = {"token": token}
         
         return LoginResponse(
             success=True,
-            token=token,
-            user=User(**user)
+            user=User(**user),
+            **tokens
         )
     except HTTPException:
         raise
@@ -362,8 +483,58 @@ async def verify_otp(request: OTPVerify):
         logging.error(f"Error verifying OTP: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/auth/refresh")
+async def refresh_token(request: TokenRefresh):
+    """Exchange a refresh token for a new token pair (signed token mode)"""
+    if not token_service.enabled:
+        raise HTTPException(status_code=400, detail="Token refresh is not enabled")
+    
+    try:
+        claims = token_service.verify(request.refresh_token, REFRESH)
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    
+    # Refresh is the one place signed tokens re-check the user record
+    user = await db.users.find_one({"id": claims["sub"]}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if user.get("is_blocked"):
+        raise HTTPException(status_code=403, detail="Account is blocked")
+    
+    # Rotate: the presented refresh token cannot be used again, even by a concurrent request
+    if not await token_service.claim(claims):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    tokens = token_service.issue_pair(user)
+    return {"success": True, **tokens}
+
+@api_router.post("/auth/logout")
+async def logout(
+    request: Optional[LogoutRequest] = None,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user)
+):
+    """Invalidate the presented token (and refresh token, if given)"""
+    token = credentials.credentials
+    if token_service.enabled and token_service.is_signed(token):
+        await token_service.revoke(token_service.verify(token))
+        if request and request.refresh_token:
+            try:
+                await token_service.revoke(token_service.verify(request.refresh_token, REFRESH))
+            except TokenError:
+                pass
+    else:
+        await db.users.update_one({"id": current_user.id, "token": token}, {"$unset": {"token": ""}})
+        session_cache.invalidate(token)
+    
+    return {"success": True, "message": "Logged out"}
+
 @api_router.get("/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
+    if token_service.enabled:
+        # Token claims only carry identity fields; return the full record
+        user = await db.users.find_one({"id": current_user.id})
+        if user:
+            return User(**user)
     return current_user
 
 # ==================== RETAILER ENDPOINTS ====================
@@ -373,6 +544,7 @@ async def onboard_retailer(retailer: RetailerOnboarding, current_user: User = De
     try:
         retailer_dict = retailer.dict()
         await db.retailers.insert_one(retailer_dict)
+        await dashboard_counters.retailer_status_changed(None, retailer_dict["status"])
         return {"success": True, "message": "Retailer onboarding submitted for approval"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -412,10 +584,16 @@ async def approve_retailer(approval: RetailerApproval, current_user: User = Depe
     if approval.credit_limit:
         update_data["credit_limit"] = approval.credit_limit
     
-    await db.retailers.update_one(
+    previous = await db.retailers.find_one_and_update(
         {"user_id": approval.retailer_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"_id": 0, "status": 1}
     )
+    if previous:
+        await dashboard_counters.retailer_status_changed(previous.get("status"), approval.status)
+    pricing_engine.invalidate_tier(approval.retailer_id)
+    if approval.credit_limit:
+        await credit_accounts.set_limit(approval.retailer_id, approval.credit_limit)
     
     return {"success": True, "message": "Retailer status updated"}
 
@@ -427,40 +605,104 @@ async def create_product(product: Product, current_user: User = Depends(get_curr
         raise HTTPException(status_code=403, detail="Not authorized")
     
     product_dict = product.dict()
+    # Stamped so other workers' stamp polls pick the new product up
+    product_dict.update(pricing_version=1, pricing_updated_at=datetime.utcnow())
     await db.products.insert_one(product_dict)
+    await dashboard_counters.inc(total_products=1)
+    await dashboard_counters.stock_changed(None, product_dict)
     # Remove MongoDB _id field for JSON serialization
     if "_id" in product_dict:
         del product_dict["_id"]
+    search_index.upsert(product_dict)
+    autocomplete.upsert_product(product_dict)
+    await catalog_cache.bump()
     return {"success": True, "product": product_dict}
 
 @api_router.get("/products")
-async def get_products(category_id: Optional[str] = None, search: Optional[str] = None, skip: int = 0, limit: int = 50):
+async def get_products(
+    request: Request,
+    category_id: Optional[str] = None,
+    search: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    role = current_user.role if current_user else None
+    projection = build_projection("products", view, fields, role=role)
+    
+    # Serve a pre-serialized snapshot while the catalog version is unchanged;
+    # admins see fields others do not, so their snapshots are kept apart
+    version = await catalog_cache.current_version()
+    key = catalog_cache.key(request, "admin" if role in VIEW_ROLES["admin"] else "")
+    snapshot = catalog_cache.get(key, version)
+    if snapshot is None:
+        products, headers = await query_products(category_id, search, skip, limit, cursor, projection)
+        snapshot = catalog_cache.put(key, version, products, headers)
+    return catalog_cache.respond(request, snapshot)
+
+async def query_products(
+    category_id: Optional[str],
+    search: Optional[str],
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    projection: dict
+):
+    """One page of active products and the response headers that go with it"""
     query = {"is_active": True}
     
     if category_id:
         query["category_id"] = category_id
     
+    if search and search_index.ready:
+        # Rank in memory, then fetch only the requested page by id
+        # Ranked results page by rank offset, carried in the cursor
+        ranked_ids = search_index.search(search, category_id=category_id)
+        start = decode_offset_cursor(cursor) if cursor else skip
+        page_ids = ranked_ids[start:start + limit]
+        products = await db.products.find({"id": {"$in": page_ids}, "is_active": True}, projection).to_list(limit)
+        rank = {product_id: i for i, product_id in enumerate(page_ids)}
+        products.sort(key=lambda p: rank[p["id"]])
+        more = start + limit < len(ranked_ids)
+        return products, ({NEXT_CURSOR_HEADER: encode_offset_cursor(start + limit)} if more else {})
+    
     if search:
+        # Fallback until the search index has been built
         query["$or"] = [
             {"name": {"$regex": search, "$options": "i"}},
             {"description": {"$regex": search, "$options": "i"}}
         ]
     
-    products = await db.products.find(query).skip(skip).limit(limit).to_list(limit)
-    # Remove MongoDB _id field for JSON serialization
-    for product in products:
-        if "_id" in product:
-            del product["_id"]
-    return products
+    products, next_cursor = await paginate(
+        db.products, query, sort_field="id", direction=1, limit=limit, cursor=cursor,
+        projection=projection, skip=skip
+    )
+    return products, ({NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {})
+
+@api_router.get("/products/suggest")
+async def suggest_products(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=25),
+    types: Optional[str] = None
+):
+    """Type-ahead completions for product, brand and category names"""
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    return {"query": q, "suggestions": autocomplete.suggest(q, limit, kinds)}
 
 @api_router.get("/products/{product_id}")
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
+async def get_product(
+    product_id: str,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    projection = build_projection("products", view, fields, role=current_user.role if current_user else None)
+    product = await db.products.find_one({"id": product_id}, projection)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    # Remove MongoDB _id field for JSON serialization
-    if "_id" in product:
-        del product["_id"]
     return product
 
 @api_router.put("/products/{product_id}")
@@ -472,16 +714,42 @@ async def update_product(product_id: str, product_data: dict, current_user: User
     # Remove fields that shouldn't be updated
     product_data.pop('id', None)
     product_data.pop('_id', None)
+    product_data.pop('pricing_version', None)
+    product_data.pop('pricing_updated_at', None)
+    product_data.pop('sharded_inventory', None)
+    product_data.pop('inventory_shards', None)
     product_data['updated_at'] = datetime.utcnow()
     
-    result = await db.products.update_one(
+    # Stock of sharded products lives in the counter shards
+    if "stock_quantity" in product_data:
+        sharded = await db.products.find_one(
+            {"id": product_id, "$or": [{"sharded_inventory": True}, {"inventory_migrating": True}]},
+            {"_id": 0, "inventory_shards": 1, "inventory_migrating": 1}
+        )
+        if sharded and sharded.get("inventory_migrating"):
+            raise HTTPException(status_code=409, detail="Inventory is being migrated; please retry")
+        if sharded and not await sharded_inventory.set_total(
+            product_id, sharded["inventory_shards"], int(product_data.pop("stock_quantity"))
+        ):
+            raise HTTPException(status_code=409, detail="Stock changed during the update; please retry")
+    
+    # Read the searchable and stock fields in the same round trip to re-index
+    before = await db.products.find_one_and_update(
         {"id": product_id},
-        {"$set": product_data}
+        {"$set": product_data, **STAMP_UPDATE},
+        projection={**INDEX_FIELDS, **LOW_STOCK_FIELDS},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    updated = {**before, **product_data}
+    await dashboard_counters.stock_changed(before, updated)
+    search_index.upsert(updated)
+    autocomplete.upsert_product(updated)
+    pricing_engine.forget(product_id)
+    await catalog_cache.bump()
     return {"success": True, "message": "Product updated"}
 
 @api_router.delete("/products/{product_id}")
@@ -490,11 +758,18 @@ async def delete_product(product_id: str, current_user: User = Depends(get_curre
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = await db.products.delete_one({"id": product_id})
+    removed = await db.products.find_one_and_delete({"id": product_id}, projection=LOW_STOCK_FIELDS)
     
-    if result.deleted_count == 0:
+    if removed is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    await dashboard_counters.inc(total_products=-1)
+    await dashboard_counters.stock_changed(removed, None)
+    search_index.remove(product_id)
+    autocomplete.remove_product(product_id)
+    price_stamps.forget(product_id)
+    pricing_engine.forget(product_id)
+    await catalog_cache.bump()
     return {"success": True, "message": "Product deleted"}
 
 # ==================== CATEGORY ENDPOINTS ====================
@@ -509,45 +784,92 @@ async def create_category(category: Category, current_user: User = Depends(get_c
     # Remove MongoDB _id field for JSON serialization
     if "_id" in category_dict:
         del category_dict["_id"]
+    autocomplete.upsert_category(category_dict)
+    await catalog_cache.bump()
     return {"success": True, "category": category_dict}
 
 @api_router.get("/categories")
-async def get_categories():
-    categories = await db.categories.find({"is_active": True}).to_list(100)
-    # Remove MongoDB _id field for JSON serialization
-    for category in categories:
-        if "_id" in category:
-            del category["_id"]
-    return categories
+async def get_categories(request: Request):
+    version = await catalog_cache.current_version()
+    key = catalog_cache.key(request)
+    snapshot = catalog_cache.get(key, version)
+    if snapshot is None:
+        categories = await db.categories.find({"is_active": True}, {"_id": 0}).to_list(100)
+        snapshot = catalog_cache.put(key, version, categories)
+    return catalog_cache.respond(request, snapshot)
 
 # ==================== ORDER ENDPOINTS ====================
 
+async def create_gateway_order(order: dict) -> dict:
+    """Create the Razorpay order for an online payment and record it on the order.
+
+    If the gateway is down or slow the order is kept with a deferred
+    payment, which the client completes later via /orders/{id}/payment.
+    """
+    try:
+        gateway_order = await payment_gateway.create_order(order["total_amount"], order["order_number"])
+        fields = {"razorpay_order_id": gateway_order["id"], "payment_deferred": False}
+    except GatewayUnavailable as e:
+        logging.warning(f"Deferring payment for order {order['order_number']}: {e}")
+        fields = {"razorpay_order_id": None, "payment_deferred": True}
+    await db.orders.update_one({"id": order["id"]}, {"$set": fields})
+    return fields
+
 @api_router.post("/orders")
 async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
+    # Prices come from the server's price tables; client prices and totals are ignored
+    entries = await pricing_engine.entries(item.product_id for item in order_data.items)
+    try:
+        quote = await pricing_engine.quote(
+            [(item.product_id, item.quantity, item.variant_id) for item in order_data.items],
+            current_user.id, current_user.role, entries
+        )
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Reserve stock for every line at once; nothing is decremented on a shortage.
+    # Stock held by other shoppers' carts stays on the shelf.
+    stock_lines = [(item.product_id, item.quantity) for item in order_data.items]
+    held = {pid: stock_holds.held_by_others(current_user.id, pid) for pid in entries}
+    sharded = {pid: e.sharded_shards for pid, e in entries.items() if e.sharded_shards}
+    try:
+        await inventory.reserve(stock_lines, held, sharded)
+    except StockShortage as e:
+        raise HTTPException(status_code=409, detail={"message": "Insufficient stock", "shortfalls": e.shortfalls})
+    
+    order_saved = False
+    credit_entry = None
     try:
-        # Calculate totals
-        subtotal = sum(item.total for item in order_data.items)
-        gst_amount = subtotal * 0.05  # 5% GST
-        delivery_charges = 0 if subtotal > 500 else 50
-        total_amount = subtotal + gst_amount + delivery_charges
-        
         # Create order
         order = Order(
             user_id=current_user.id,
             user_role=current_user.role,
-            items=order_data.items,
-            subtotal=subtotal,
-            gst_amount=gst_amount,
-            delivery_charges=delivery_charges,
-            total_amount=total_amount,
+            items=[OrderItem(**line) for line in quote["items"]],
+            subtotal=quote["subtotal"],
+            gst_amount=quote["gst_amount"],
+            gst_breakup=quote["gst_breakup"],
+            delivery_charges=quote["delivery_charges"],
+            discount=quote["discount"],
+            total_amount=quote["total_amount"],
+            pricing_tier=quote["tier"],
             payment_mode=order_data.payment_mode,
             delivery_address=order_data.delivery_address,
             delivery_slot=order_data.delivery_slot,
-            delivery_otp=generate_otp()[:4]  # 4-digit OTP
+            delivery_otp=generate_otp()[:4],  # 4-digit OTP
+            order_number=await sequences.next_number("order")
         )
         
+        # Credit orders debit the retailer's account atomically before the order exists
+        if order_data.payment_mode == "credit":
+            credit_entry = await credit_accounts.authorize(
+                current_user.id, order.total_amount, order.id, f"Order {order.order_number}"
+            )
+        
         order_dict = order.dict()
         await db.orders.insert_one(order_dict)
+        order_saved = True
+        await dashboard_counters.inc(total_orders=1)
+        await sales_rollups.order_placed(order_dict)
         
         # Remove MongoDB _id field for JSON serialization
         if "_id" in order_dict:
@@ -555,32 +877,59 @@ async def create_order(order_data: OrderCreate, current_user: User = Depends(get
         
         # Handle payment
         if order_data.payment_mode == "online":
-            # Create Razorpay order
-            try:
-                razorpay_order = razorpay_client.order.create({
-                    "amount": int(total_amount * 100),  # paise
-                    "currency": "INR",
-                    "receipt": order.order_number
-                })
-                order_dict["razorpay_order_id"] = razorpay_order["id"]
-            except:
-                # If Razorpay fails (test mode), continue
-                order_dict["razorpay_order_id"] = f"order_test_{order.id[:12]}"
+            order_dict.update(await create_gateway_order(order_dict))
         
-        # Update stock
-        for item in order_data.items:
-            await db.products.update_one(
-                {"id": item.product_id},
-                {"$inc": {"stock_quantity": -item.quantity}}
-            )
+        autocomplete.record_order([item.dict() for item in order_data.items])
+        # The order now owns this stock; drop the shopper's cart holds on it
+        await stock_holds.release_owner(current_user.id, entries)
         
         return {"success": True, "order": order_dict}
+    except InsufficientCredit as e:
+        await inventory.release(stock_lines, sharded)
+        raise HTTPException(
+            status_code=402,
+            detail={"message": "Insufficient credit", "available_credit": e.available, "required": e.requested}
+        )
     except Exception as e:
         logging.error(f"Error creating order: {str(e)}")
+        if not order_saved:
+            await inventory.release(stock_lines, sharded)
+            if credit_entry:
+                await credit_accounts.credit(
+                    current_user.id, credit_entry["amount"], f"Reversal of {credit_entry['description']}",
+                    credit_entry["order_id"], REVERSAL
+                )
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/orders/{order_id}/payment")
+async def retry_order_payment(order_id: str, current_user: User = Depends(get_current_user)):
+    """Create the gateway order for an order whose online payment was deferred"""
+    order = await db.orders.find_one(
+        {"id": order_id, "user_id": current_user.id},
+        {"_id": 0, "id": 1, "order_number": 1, "total_amount": 1, "payment_mode": 1, "razorpay_order_id": 1}
+    )
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order.get("payment_mode") != "online":
+        raise HTTPException(status_code=400, detail="Order is not an online payment")
+    if order.get("razorpay_order_id"):
+        return {"success": True, "razorpay_order_id": order["razorpay_order_id"], "payment_deferred": False}
+    
+    fields = await create_gateway_order(order)
+    if fields["payment_deferred"]:
+        raise HTTPException(status_code=503, detail="Payment gateway unavailable, please retry shortly")
+    return {"success": True, **fields}
+
 @api_router.get("/orders")
-async def get_orders(current_user: User = Depends(get_current_user), status: Optional[str] = None):
+async def get_orders(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
     query = {}
     
     if current_user.role in [UserRole.RETAILER, UserRole.CUSTOMER, UserRole.DELIVERY_AGENT]:
@@ -589,16 +938,22 @@ async def get_orders(current_user: User = Depends(get_current_user), status: Opt
     if status:
         query["order_status"] = status
     
-    orders = await db.orders.find(query).sort("created_at", -1).to_list(100)
-    # Remove MongoDB _id field for JSON serialization
-    for order in orders:
-        if "_id" in order:
-            del order["_id"]
+    # Cursors need the sort key, so it is always projected
+    projection = build_projection("orders", view, fields, required=("id", "created_at"), role=current_user.role)
+    orders, next_cursor = await paginate(db.orders, query, limit=limit, cursor=cursor, projection=projection)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return orders
 
 @api_router.get("/orders/{order_id}")
-async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id})
+async def get_order(
+    order_id: str,
+    current_user: User = Depends(get_current_user),
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    projection = build_projection("orders", view, fields, required=("id", "user_id"), role=current_user.role)
+    order = await db.orders.find_one({"id": order_id}, projection)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -606,17 +961,17 @@ async def get_order(order_id: str, current_user: User = Depends(get_current_user
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN] and order["user_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Remove MongoDB _id field for JSON serialization
-    if "_id" in order:
-        del order["_id"]
     return order
 
 @api_router.patch("/orders/{order_id}/status")
 async def update_order_status(order_id: str, status: str, current_user: User = Depends(get_current_user)):
-    await db.orders.update_one(
+    previous = await db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": {"order_status": status, "updated_at": datetime.utcnow()}}
+        {"$set": {"order_status": status, "updated_at": datetime.utcnow()}},
+        projection=ROLLUP_ORDER_FIELDS
     )
+    if previous:
+        await sales_rollups.status_changed(previous, status)
     return {"success": True, "message": "Order status updated"}
 
 # ==================== CREDIT ENDPOINTS ====================
@@ -634,23 +989,82 @@ async def get_credit_balance(current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.RETAILER:
         raise HTTPException(status_code=403, detail="Only for retailers")
     
-    retailer = await db.retailers.find_one({"user_id": current_user.id})
-    if not retailer:
+    # Running balance is kept on the retailer's credit account
+    balance = await credit_accounts.balance(current_user.id)
+    if balance is None:
         raise HTTPException(status_code=404, detail="Retailer not found")
+    return balance
+
+STATEMENT_CSV_FIELDS = ["created_at", "seq", "transaction_type", "amount", "balance", "order_id", "description", "id"]
+
+def naive_utc(at: datetime) -> datetime:
+    """Stored timestamps are naive UTC; convert offset-aware query values to match"""
+    return at.astimezone(timezone.utc).replace(tzinfo=None) if at.tzinfo else at
+
+def statement_range(start: datetime, end: Optional[datetime]) -> tuple:
+    start = naive_utc(start)
+    end = naive_utc(end) if end else datetime.utcnow()
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    return start, end
+
+@api_router.get("/credit/statement")
+async def get_credit_statement(
+    start: datetime,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Opening/closing balance with monthly debits and credits for [start, end)"""
+    if current_user.role != UserRole.RETAILER:
+        raise HTTPException(status_code=403, detail="Only for retailers")
+    start, end = statement_range(start, end)
+    return await credit_accounts.statement(current_user.id, start, end)
+
+@api_router.get("/credit/statement/entries")
+async def stream_credit_statement(
+    start: datetime,
+    end: Optional[datetime] = None,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Every ledger entry in [start, end), streamed as NDJSON or CSV"""
+    if current_user.role != UserRole.RETAILER:
+        raise HTTPException(status_code=403, detail="Only for retailers")
+    start, end = statement_range(start, end)
+    entries = credit_accounts.entries(current_user.id, start, end)
     
-    # Get latest ledger entry for balance
-    latest_entry = await db.credit_ledgers.find_one(
-        {"retailer_id": current_user.id},
-        sort=[("created_at", -1)]
-    )
+    async def ndjson_rows():
+        async for entry in entries:
+            entry["created_at"] = entry["created_at"].isoformat()
+            yield json.dumps(entry) + "\n"
     
-    balance = latest_entry["balance"] if latest_entry else 0
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=STATEMENT_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        async for entry in entries:
+            entry["created_at"] = entry["created_at"].isoformat()
+            writer.writerow(entry)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
     
-    return {
-        "credit_limit": retailer["credit_limit"],
-        "used_credit": retailer["credit_limit"] - balance,
-        "available_credit": balance
-    }
+    filename = f"statement_{start:%Y%m%d}_{end:%Y%m%d}.{format}"
+    if format == "csv":
+        return StreamingResponse(
+            csv_rows(), media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
+
+@api_router.post("/admin/credit/{retailer_id}/rollups/rebuild")
+async def rebuild_credit_rollups(retailer_id: str, current_user: User = Depends(get_current_user)):
+    """Recompute a retailer's monthly statement rollups from the ledger"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    months = await credit_accounts.rebuild_rollups(retailer_id)
+    return {"success": True, "months": months}
 
 # ==================== ADMIN ENDPOINTS ====================
 
@@ -659,29 +1073,17 @@ async def get_admin_dashboard(current_user: User = Depends(get_current_user)):
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    total_orders = await db.orders.count_documents({})
-    total_users = await db.users.count_documents({})
-    total_products = await db.products.count_documents({})
-    pending_retailers = await db.retailers.count_documents({"status": RetailerStatus.PENDING})
-    
-    # Calculate total revenue
-    pipeline = [
-        {"$match": {"payment_status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
-    ]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
-    return {
-        "total_orders": total_orders,
-        "total_users": total_users,
-        "total_products": total_products,
-        "pending_retailers": pending_retailers,
-        "total_revenue": total_revenue
-    }
+    # Counters are maintained on the write paths and reconciled in the background
+    return await dashboard_counters.read()
 
 @api_router.get("/admin/users")
-async def get_all_users(current_user: User = Depends(get_current_user), role: Optional[str] = None):
+async def get_all_users(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    role: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
@@ -689,30 +1091,178 @@ async def get_all_users(current_user: User = Depends(get_current_user), role: Op
     if role:
         query["role"] = role
     
-    users = await db.users.find(query).to_list(1000)
-    # Remove MongoDB _id field for JSON serialization
-    for user in users:
-        if "_id" in user:
-            del user["_id"]
+    users, next_cursor = await paginate(db.users, query, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return users
 
+@api_router.patch("/admin/users/{user_id}/block")
+async def set_user_blocked(user_id: str, blocked: bool = True, current_user: User = Depends(get_current_user)):
+    """Block or unblock a user (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    result = await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"is_blocked": blocked, "updated_at": datetime.utcnow()}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Cached sessions and issued tokens must not outlive the block
+    session_cache.invalidate_user(user_id)
+    if blocked:
+        await token_service.revoke_user(user_id)
+    
+    return {"success": True, "message": "User blocked" if blocked else "User unblocked"}
+
+@api_router.post("/admin/products/{product_id}/inventory-shards")
+async def enable_inventory_shards(
+    product_id: str,
+    shards: int = Query(DEFAULT_SHARDS, ge=1, le=MAX_SHARDS),
+    current_user: User = Depends(get_current_user)
+):
+    """Split a hot product's stock across counter shards (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if not await db.products.find_one({"id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    moved = await sharded_inventory.enable(product_id, shards)
+    pricing_engine.forget(product_id)
+    return {"success": True, "shards": shards, "stock_quantity": moved}
+
+@api_router.delete("/admin/products/{product_id}/inventory-shards")
+async def disable_inventory_shards(product_id: str, current_user: User = Depends(get_current_user)):
+    """Fold a product's counter shards back into its stock (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    total = await sharded_inventory.disable(product_id)
+    pricing_engine.forget(product_id)
+    return {"success": True, "stock_quantity": total}
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: User = Depends(get_current_user)):
+    """In-process cache and performance counters (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return {
+        "session_cache": session_cache.stats(),
+        "tokens": token_service.stats(),
+        "rate_limits": {limiter.name: limiter.stats() for limiter in rate_limiters},
+        "search_index": search_index.stats(),
+        "autocomplete": autocomplete.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "price_stamps": price_stamps.stats(),
+        "inventory": inventory.stats(),
+        "stock_holds": stock_holds.stats(),
+        "sharded_inventory": sharded_inventory.stats(),
+        "sequences": sequences.stats(),
+        "payment_gateway": payment_gateway.stats(),
+        "pricing": pricing_engine.stats(),
+        "promotions": promotion_engine.stats(),
+        "credit_accounts": credit_accounts.stats(),
+        "dashboard_counters": dashboard_counters.stats(),
+        "sales_rollups": sales_rollups.stats(),
+        "retailer_analytics": retailer_analytics.stats()
+    }
+
+# ==================== PROMOTION ENDPOINTS ====================
+
+def checked_promotion(promo: dict) -> dict:
+    try:
+        return validate_promotion(promo)
+    except PromotionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/admin/promotions")
+async def create_promotion(promotion: Promotion, current_user: User = Depends(get_current_user)):
+    """Create a scheme or offer (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    promo_dict = checked_promotion(promotion.dict())
+    await db.promotions.insert_one(promo_dict)
+    promo_dict.pop("_id", None)
+    await promotion_engine.bump()
+    return {"success": True, "promotion": promo_dict}
+
+@api_router.get("/admin/promotions")
+async def list_promotions(
+    response: Response,
+    active: Optional[bool] = None,
+    limit: int = Query(100, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """List promotions (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    query = {} if active is None else {"is_active": active}
+    promotions, next_cursor = await paginate(db.promotions, query, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return promotions
+
+@api_router.patch("/admin/promotions/{promotion_id}")
+async def update_promotion(promotion_id: str, updates: dict, current_user: User = Depends(get_current_user)):
+    """Update or deactivate a promotion (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    updates.pop("id", None)
+    updates.pop("_id", None)
+    existing = await db.promotions.find_one({"id": promotion_id}, {"_id": 0})
+    if existing is None:
+        raise HTTPException(status_code=404, detail="Promotion not found")
+    # Validate the merged document so dates are parsed and bad fields never reach the rules
+    updated = checked_promotion({**existing, **updates})
+    
+    await db.promotions.update_one({"id": promotion_id}, {"$set": {k: v for k, v in updated.items() if k != "id"}})
+    await promotion_engine.bump()
+    return {"success": True, "promotion": updated}
+
+@api_router.delete("/admin/promotions/{promotion_id}")
+async def delete_promotion(promotion_id: str, current_user: User = Depends(get_current_user)):
+    """Delete a promotion (admin only)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    result = await db.promotions.delete_one({"id": promotion_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Promotion not found")
+    await promotion_engine.bump()
+    return {"success": True, "message": "Promotion deleted"}
+
 # ==================== SUPPORT ENDPOINTS ====================
 
 @api_router.post("/support/tickets")
 async def create_ticket(ticket: SupportTicket, current_user: User = Depends(get_current_user)):
     ticket_dict = ticket.dict()
     ticket_dict["user_id"] = current_user.id
+    ticket_dict["ticket_number"] = await sequences.next_number("ticket")
     await db.support_tickets.insert_one(ticket_dict)
     return {"success": True, "ticket": ticket_dict}
 
 @api_router.get("/support/tickets")
-async def get_tickets(current_user: User = Depends(get_current_user)):
+async def get_tickets(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     query = {"user_id": current_user.id}
     
     if current_user.role in [UserRole.ADMIN, UserRole.SUPER_ADMIN, UserRole.SUPPORT_EXECUTIVE]:
         query = {}  # Admins see all tickets
     
-    tickets = await db.support_tickets.find(query).sort("created_at", -1).to_list(100)
+    tickets, next_cursor = await paginate(db.support_tickets, query, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return tickets
 
 # ==================== UTILITY ENDPOINTS ====================
@@ -737,7 +1287,7 @@ class AIChatRequest(BaseModel):
     message: str
 
 @api_router.post("/ai/recommendations")
-async def get_ai_recommendations(request: AIRecommendationRequest, current_user: User = Depends(get_current_user)):
+async def get_ai_recommendations(request: AIRecommendationRequest, current_user: User = Depends(get_ai_user)):
     """Get AI-powered product recommendations"""
     try:
         # Get user's purchase history
@@ -755,9 +1305,24 @@ async def get_ai_recommendations(request: AIRecommendationRequest, current_user:
         
         # Ensure we return a properly structured response
         if isinstance(result, dict):
+            recommendations = result.get("recommendations", [])
+            # Resolve suggested names to catalog products with one batched fetch
+            matches = {}
+            for rec in recommendations:
+                if isinstance(rec, dict) and rec.get("product_name"):
+                    hits = search_index.search(rec["product_name"])
+                    if hits:
+                        matches[id(rec)] = hits[0]
+            if matches:
+                loader = ProductLoader(db, build_projection("products", "card"))
+                products = await loader.load_many(matches.values())
+                for rec in recommendations:
+                    product = products.get(matches.get(id(rec)))
+                    if product:
+                        rec["product"] = product
             return {
                 "success": True, 
-                "recommendations": result.get("recommendations", []),
+                "recommendations": recommendations,
                 "summary": result.get("summary", "")
             }
         else:
@@ -775,11 +1340,26 @@ async def get_ai_recommendations(request: AIRecommendationRequest, current_user:
             "summary": "Unable to load recommendations"
         }
 
-@api_router.post("/ai/search")
+@api_router.post("/ai/search", dependencies=[Depends(limit_by_ip(ai_ip_limiter))])
 async def ai_smart_search(request: AISearchRequest):
     """AI-powered smart search"""
     try:
-        products = await db.products.find({"is_active": True}).to_list(100)
+        # Typo-tolerant local search answers most queries without an LLM call
+        if search_index.ready:
+            matched_ids = search_index.search(request.query)[:20]
+            if matched_ids:
+                # Same shape as ai_service.smart_search, so clients cannot tell which path answered
+                did_you_mean = search_index.did_you_mean(request.query)
+                return {"success": True, "result": {
+                    "query": request.query,
+                    "ai_response": json.dumps({
+                        "matched_products": matched_ids,
+                        "intent": did_you_mean or request.query,
+                        "suggestions": [did_you_mean] if did_you_mean else []
+                    })
+                }}
+        
+        products = await db.products.find({"is_active": True}, build_projection("products")).to_list(100)
         for p in products:
             if "_id" in p:
                 del p["_id"]
@@ -790,7 +1370,7 @@ async def ai_smart_search(request: AISearchRequest):
         return {"success": False, "error": str(e)}
 
 @api_router.post("/ai/chat")
-async def ai_chatbot(request: AIChatRequest, current_user: User = Depends(get_current_user)):
+async def ai_chatbot(request: AIChatRequest, current_user: User = Depends(get_ai_user)):
     """AI chatbot for customer support"""
     try:
         # Get user context
@@ -875,6 +1455,7 @@ async def update_profile(profile_data: ProfileUpdate, current_user: User = Depen
             {"id": current_user.id},
             {"$set": update_dict}
         )
+        session_cache.invalidate_user(current_user.id)
         
         # Get updated user
         updated_user = await db.users.find_one({"id": current_user.id})
@@ -1136,16 +1717,20 @@ async def request_refund(refund_data: RefundRequest, current_user: User = Depend
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/refunds")
-async def get_refunds(current_user: User = Depends(get_current_user)):
+async def get_refunds(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     """Get user's refund requests"""
     query = {"user_id": current_user.id}
     if current_user.role in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         query = {}  # Admins see all
     
-    refunds = await db.refunds.find(query).sort("created_at", -1).to_list(50)
-    for r in refunds:
-        if "_id" in r:
-            del r["_id"]
+    refunds, next_cursor = await paginate(db.refunds, query, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return refunds
 
 @api_router.patch("/refunds/{refund_id}/status")
@@ -1154,19 +1739,21 @@ async def update_refund_status(refund_id: str, status: str, current_user: User =
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.refunds.update_one(
+    refund = await db.refunds.find_one_and_update(
         {"id": refund_id},
-        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "order_id": 1, "refund_amount": 1, "status": 1}
     )
     
-    # If approved, update order
-    if status == "approved":
-        refund = await db.refunds.find_one({"id": refund_id})
-        if refund:
-            await db.orders.update_one(
-                {"id": refund["order_id"]},
-                {"$set": {"refund_status": "approved", "updated_at": datetime.utcnow()}}
-            )
+    # If newly approved, update order
+    if status == "approved" and refund and refund.get("status") != "approved":
+        order = await db.orders.find_one_and_update(
+            {"id": refund["order_id"]},
+            {"$set": {"refund_status": "approved", "updated_at": datetime.utcnow()}},
+            projection=ROLLUP_ORDER_FIELDS
+        )
+        if order:
+            await sales_rollups.refunded(order, refund["refund_amount"])
     
     return {"success": True, "message": "Refund status updated"}
 
@@ -1176,38 +1763,46 @@ async def update_refund_status(refund_id: str, status: str, current_user: User =
 async def get_retailer_analytics(current_user: User = Depends(get_current_user)):
     """Get analytics for retailer dashboard"""
     try:
-        # Get orders for this user
-        orders = await db.orders.find({"user_id": current_user.id}).to_list(1000)
-        
-        total_orders = len(orders)
-        total_revenue = sum(o.get("total_amount", 0) for o in orders)
-        avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
-        
-        # Group by product
-        product_sales = {}
-        for order in orders:
-            for item in order.get("items", []):
-                name = item.get("product_name", "Unknown")
-                if name not in product_sales:
-                    product_sales[name] = {"quantity": 0, "revenue": 0}
-                product_sales[name]["quantity"] += item.get("quantity", 0)
-                product_sales[name]["revenue"] += item.get("total", 0)
-        
-        top_products = sorted(
-            [{"name": k, **v} for k, v in product_sales.items()],
-            key=lambda x: x["revenue"],
-            reverse=True
-        )[:5]
-        
-        return {
-            "total_orders": total_orders,
-            "total_revenue": total_revenue,
-            "avg_order_value": avg_order_value,
-            "top_products": top_products
-        }
+        # Whole order history, reduced with vectorized column operations
+        return await retailer_analytics.summary(current_user.id)
     except Exception as e:
+        logging.error(f"Retailer analytics failed: {str(e)}")
         return {"total_orders": 0, "total_revenue": 0, "avg_order_value": 0, "top_products": []}
 
+@api_router.get("/analytics/sales")
+async def get_sales_rollups(
+    grain: str = "day",
+    dim: str = "all",
+    days: int = Query(30, ge=1, le=366),
+    keys: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Sales series per hour/day for one dimension, answered from pre-aggregated rollups"""
+    if grain not in GRAINS or dim not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"grain must be one of {GRAINS}, dim one of {DIMENSIONS}")
+    key_list = keys.split(",") if keys else None
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        # Retailers see only their own totals
+        if current_user.role != UserRole.RETAILER or dim != "retailer":
+            raise HTTPException(status_code=403, detail="Not authorized")
+        key_list = [current_user.id]
+    
+    end = datetime.utcnow()
+    return await sales_rollups.query(grain, dim, end - timedelta(days=days), end, key_list)
+
+@api_router.post("/admin/analytics/rollups/backfill")
+async def backfill_sales_rollups(
+    background_tasks: BackgroundTasks,
+    days: int = Query(90, ge=1, le=3660),
+    current_user: User = Depends(get_current_user)
+):
+    """Rebuild sales rollups for the last ``days`` whole days from the orders collection"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    end = datetime.utcnow()
+    background_tasks.add_task(sales_rollups.backfill, end - timedelta(days=days), end)
+    return {"success": True, "message": f"Backfill of the last {days} days started"}
+
 # Include KYC router
 api_router.include_router(kyc_router)
 
@@ -1228,6 +1823,7 @@ async def websocket_tracking(websocket: WebSocket, order_id: str):
 
 # Include router
 app.include_router(api_router)
+app.include_router(cart_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1235,6 +1831,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 logging.basicConfig(
@@ -1249,6 +1846,24 @@ async def startup_db_client():
     try:
         # Set db for KYC routes
         set_kyc_db(db)
+        set_cart_db(db, get_current_user)
+        catalog_cache.set_db(db)
+        price_stamps.set_db(db)
+        inventory.set_db(db)
+        stock_holds.set_db(db)
+        sharded_inventory.set_db(db)
+        sequences.set_db(db)
+        pricing_engine.set_db(db)
+        promotion_engine.set_db(db)
+        credit_accounts.set_db(db)
+        dashboard_counters.set_db(db)
+        sales_rollups.set_db(db)
+        retailer_analytics.set_db(db)
+        
+        # Load token revocations shared by all workers
+        token_service.set_db(db)
+        await token_service.start()
+        await set_rate_limit_db(db)
         
         await db.users.create_index("phone", unique=True)
         await db.users.create_index("token")
@@ -1256,18 +1871,64 @@ async def startup_db_client():
         await db.products.create_index("category_id")
         await db.products.create_index("is_active")
         await db.products.create_index([("name", 1), ("description", 1)])
+        # Incremental price stamp polling
+        await db.products.create_index("pricing_updated_at")
         await db.categories.create_index("is_active")
         await db.orders.create_index("user_id")
         await db.orders.create_index("order_status")
         await db.orders.create_index("created_at")
+        # Keyset pagination: equality filters first, then (sort key, id)
+        await db.products.create_index([("is_active", 1), ("id", 1)])
+        await db.products.create_index([("is_active", 1), ("category_id", 1), ("id", 1)])
+        await db.orders.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.orders.create_index([("order_status", 1), ("created_at", -1), ("id", -1)])
+        await db.orders.create_index([("created_at", -1), ("id", -1)])
+        await db.users.create_index([("created_at", -1), ("id", -1)])
+        await db.users.create_index([("role", 1), ("created_at", -1), ("id", -1)])
+        await db.support_tickets.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.support_tickets.create_index([("created_at", -1), ("id", -1)])
+        await db.refunds.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.refunds.create_index([("created_at", -1), ("id", -1)])
         await db.carts.create_index("user_id", unique=True)
         await db.otp_sessions.create_index("expires_at", expireAfterSeconds=0)
+        await db.otp_sessions.create_index([("phone", 1), ("otp", 1), ("expires_at", 1)])
         await db.retailers.create_index("user_id", unique=True)
         await db.credit_ledgers.create_index("retailer_id")
+        await db.credit_ledgers.create_index([("retailer_id", 1), ("created_at", -1)])
+        await db.credit_ledgers.create_index([("retailer_id", 1), ("seq", 1)])
+        await db.credit_checkpoints.create_index([("retailer_id", 1), ("seq", -1)], unique=True)
+        await db.credit_rollups.create_index([("retailer_id", 1), ("month", 1)])
+        await db.sales_rollups.create_index([("grain", 1), ("dim", 1), ("bucket", 1), ("key", 1)])
+        await db.sales_rollups.create_index([("grain", 1), ("dim", 1), ("key", 1), ("bucket", 1)])
+        await db.sales_rollups.create_index("bucket")
+        await db.promotions.create_index("is_active")
+        await db.promotions.create_index([("created_at", -1), ("id", -1)])
         logger.info("MongoDB indexes created successfully")
+        
+        # Sequence numbers are unique; older random numbers may already collide
+        for collection, field in ((db.orders, "order_number"), (db.support_tickets, "ticket_number")):
+            try:
+                await collection.create_index(field, unique=True)
+            except Exception as e:
+                logger.warning(f"Unique index on {field} not created: {e}")
+        
+        # Build the in-memory product search index
+        await search_index.start(db)
+        await autocomplete.start(db)
+        await stock_holds.start()
+        await sharded_inventory.start()
+        await dashboard_counters.start()
+        await promotion_engine.refresh()
     except Exception as e:
         logger.warning(f"Index creation warning: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    token_service.stop()
+    search_index.stop()
+    autocomplete.stop()
+    stock_holds.stop()
+    sharded_inventory.stop()
+    dashboard_counters.stop()
+    payment_gateway.close()
     client.close()
@@ -0,0 +1,114 @@
+# Authenticated session cache for the get_current_user hot path
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Any
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '60'))  # seconds
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '10000'))
+
+
+def hash_token(token: str) -> str:
+    """Hash a bearer token so raw tokens are never kept in memory as keys"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionCache:
+    """Bounded TTL + LRU cache of validated users keyed by token hash.
+
+    Entries expire after ``ttl`` seconds so changes made by another worker
+    (profile edits, blocking) are picked up within that window. Changes made
+    by this worker are applied immediately through ``invalidate_user``.
+    """
+
+    def __init__(self, ttl: int = SESSION_CACHE_TTL, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # token_hash -> (expires_at, user)
+        self._by_user: Dict[str, Set[str]] = {}  # user_id -> token hashes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Any]:
+        """Return the cached user for a token, or None on miss/expiry"""
+        key = hash_token(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def set(self, token: str, user: Any):
+        """Cache a validated user for a token"""
+        key = hash_token(token)
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, user)
+        self._by_user.setdefault(user.id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, token: str):
+        """Drop a single token from the cache"""
+        key = hash_token(token)
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: str):
+        """Drop every cached session belonging to a user"""
+        for key in list(self._by_user.get(user_id, ())):
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1].id
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+
+# Global session cache instance
+session_cache = SessionCache()
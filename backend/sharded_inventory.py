@@ -0,0 +1,302 @@
+# Sharded stock counters for hot SKUs
+import os
+import random
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from pymongo import UpdateOne, ReturnDocument
+
+from dashboard_counters import dashboard_counters, is_low_stock, LOW_STOCK_FIELDS
+from price_stamps import STAMP_UPDATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = int(os.getenv('INVENTORY_SHARDS', '8'))
+MAX_SHARDS = 64
+# How often shard totals are folded into products.stock_quantity (seconds)
+INVENTORY_SHARD_SYNC = float(os.getenv('INVENTORY_SHARD_SYNC', '10'))
+
+
+def shard_id(product_id: str, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+
+def split(total: int, shards: int) -> List[int]:
+    """Spread ``total`` as evenly as possible over ``shards`` counters"""
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+class ShardedInventory:
+    """Stock for flagged products split across N counter documents.
+
+    A decrement picks a random shard and applies a guarded ``$inc`` to it,
+    so concurrent checkouts of one SKU spread their writes over N documents
+    instead of queueing on the product. Quantities larger than any one
+    shard holds are gathered from several shards. ``products.stock_quantity`` is kept
+    as a periodically folded total for display; the shards are the source
+    of truth while ``sharded_inventory`` is set.
+    """
+
+    def __init__(self):
+        self.db = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self.decrements = 0
+        self.retries = 0
+        self.split_takes = 0
+        self.fallbacks = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    async def enable(self, product_id: str, shards: int = DEFAULT_SHARDS) -> int:
+        """Move a product's stock into shards; returns the stock moved.
+
+        The product is marked ``inventory_migrating`` (and its stock zeroed)
+        in the same write that reads its stock, so no reservation runs
+        against it until the shards are filled and the flag is flipped.
+        Stock returned to the product meanwhile is moved over at the end.
+        """
+        shards = max(1, min(shards, MAX_SHARDS))
+        before = await self.db.products.find_one_and_update(
+            {"id": product_id, "sharded_inventory": {"$ne": True}, "inventory_migrating": {"$ne": True}},
+            {"$set": {"inventory_migrating": True, "stock_quantity": 0}, **STAMP_UPDATE},
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return 0
+        total = before.get("stock_quantity", 0)
+        await dashboard_counters.stock_changed(before, {**before, "stock_quantity": 0})
+        await self.db.inventory_shards.bulk_write([
+            UpdateOne(
+                {"_id": shard_id(product_id, i)},
+                {"$set": {"product_id": product_id, "shard": i, "quantity": quantity, "migrating": False}},
+                upsert=True
+            )
+            for i, quantity in enumerate(split(total, shards))
+        ], ordered=False)
+        late = await self.db.products.find_one_and_update(
+            {"id": product_id, "inventory_migrating": True},
+            {
+                "$set": {"sharded_inventory": True, "inventory_shards": shards, "stock_quantity": total},
+                "$unset": {"inventory_migrating": ""},
+                "$inc": STAMP_UPDATE["$inc"],
+                "$currentDate": STAMP_UPDATE["$currentDate"]
+            },
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        returned = late.get("stock_quantity", 0) if late else 0
+        if late:
+            await dashboard_counters.stock_changed(late, {**late, "stock_quantity": total})
+        if returned:
+            await self.restock(product_id, shards, returned)
+        return total + returned
+
+    async def disable(self, product_id: str) -> int:
+        """Fold shards back into products.stock_quantity; returns the total.
+
+        Shards are closed to decrements before they are removed, so a
+        reservation cannot take from half-folded stock; stock given back to
+        a removed shard lands on the product and is kept by the final ``$inc``.
+        """
+        product = await self.db.products.find_one_and_update(
+            {"id": product_id, "sharded_inventory": True, "inventory_migrating": {"$ne": True}},
+            {"$set": {"inventory_migrating": True, "stock_quantity": 0}, **STAMP_UPDATE},
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if product is None:
+            return 0
+        await dashboard_counters.stock_changed(product, {**product, "stock_quantity": 0})
+        await self.db.inventory_shards.update_many({"product_id": product_id}, {"$set": {"migrating": True}})
+        total = 0
+        shards = await self.db.inventory_shards.find({"product_id": product_id}, {"_id": 1}).to_list(None)
+        for shard in shards:
+            # Delete one at a time so stock given back during the fold is not lost
+            removed = await self.db.inventory_shards.find_one_and_delete({"_id": shard["_id"]})
+            if removed:
+                total += removed.get("quantity", 0)
+        before = await self.db.products.find_one_and_update(
+            {"id": product_id},
+            {
+                "$set": {"sharded_inventory": False},
+                "$unset": {"inventory_shards": "", "inventory_migrating": ""},
+                "$inc": {"stock_quantity": total, **STAMP_UPDATE["$inc"]},
+                "$currentDate": STAMP_UPDATE["$currentDate"]
+            },
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return total
+        await dashboard_counters.stock_moved(before, total)
+        return before.get("stock_quantity", 0) + total
+
+    async def _take(self, sid: str, quantity: int) -> bool:
+        result = await self.db.inventory_shards.update_one(
+            {"_id": sid, "quantity": {"$gte": quantity}, "migrating": {"$ne": True}},
+            {"$inc": {"quantity": -quantity}}
+        )
+        return result.modified_count == 1
+
+    async def decrement(
+        self, product_id: str, quantity: int, shards: int, held: int = 0
+    ) -> Optional[List[Tuple[str, int]]]:
+        """Take ``quantity``; returns the (shard id, quantity) parts taken, or None if short.
+
+        One random shard is tried for the whole quantity first. Otherwise
+        the quantity is gathered from several shards with guarded ``$inc``s.
+        If the shards cannot cover it, or what is left afterwards would not
+        cover the ``held`` stock of other carts, every part taken is given
+        back.
+        """
+        sid = shard_id(product_id, random.randrange(shards))
+        if await self._take(sid, quantity):
+            parts = [(sid, quantity)]
+        else:
+            self.retries += 1
+            parts = await self._take_split(product_id, quantity)
+            if parts is None:
+                return None
+        if held and await self.total(product_id) < held:
+            await self.give_back(parts)
+            return None
+        self.decrements += 1
+        return parts
+
+    async def _take_split(self, product_id: str, quantity: int) -> Optional[List[Tuple[str, int]]]:
+        parts: List[Tuple[str, int]] = []
+        remaining = quantity
+        # A second pass re-reads shards that changed under the first
+        for _ in range(2):
+            docs = await self.db.inventory_shards.find(
+                {"product_id": product_id, "quantity": {"$gt": 0}}, {"_id": 1, "quantity": 1}
+            ).to_list(MAX_SHARDS)
+            if sum(d["quantity"] for d in docs) < remaining:
+                break
+            random.shuffle(docs)
+            for doc in docs:
+                take = min(doc["quantity"], remaining)
+                if await self._take(doc["_id"], take):
+                    parts.append((doc["_id"], take))
+                    remaining -= take
+                    if not remaining:
+                        self.split_takes += 1
+                        return parts
+                else:
+                    self.retries += 1
+        await self.give_back(parts)
+        return None
+
+    async def increment(self, sid: str, quantity: int):
+        """Add stock to a shard, or to its product if the shard was folded away"""
+        result = await self.db.inventory_shards.update_one({"_id": sid}, {"$inc": {"quantity": quantity}})
+        if result.matched_count:
+            return
+        self.fallbacks += 1
+        before = await self.db.products.find_one_and_update(
+            {"id": sid.rsplit(":", 1)[0]},
+            {
+                "$inc": {"stock_quantity": quantity, **STAMP_UPDATE["$inc"]},
+                "$currentDate": STAMP_UPDATE["$currentDate"]
+            },
+            projection=LOW_STOCK_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        await dashboard_counters.stock_moved(before, quantity)
+
+    async def give_back(self, parts: List[Tuple[str, int]]):
+        """Return the parts of a decrement to the shards they came from"""
+        for sid, quantity in parts:
+            await self.increment(sid, quantity)
+
+    async def restock(self, product_id: str, shards: int, quantity: int):
+        """Add stock to a random shard"""
+        await self.increment(shard_id(product_id, random.randrange(shards)), quantity)
+
+    async def total(self, product_id: str) -> int:
+        """Current stock: the sum of all shards (merge on read)"""
+        rows = await self.db.inventory_shards.aggregate([
+            {"$match": {"product_id": product_id}},
+            {"$group": {"_id": None, "total": {"$sum": "$quantity"}}}
+        ]).to_list(1)
+        return rows[0]["total"] if rows else 0
+
+    async def set_total(self, product_id: str, shards: int, total: int) -> bool:
+        """Adjust stock to an absolute level, e.g. after a stock count.
+
+        Returns False if stock was taken concurrently so the level could not
+        be reached.
+        """
+        delta = total - await self.total(product_id)
+        if delta >= 0:
+            await self.restock(product_id, shards, delta)
+            return True
+        return await self.decrement(product_id, -delta, shards) is not None
+
+    async def sync(self):
+        """Fold shard totals into products.stock_quantity for catalog reads"""
+        rows = await self.db.inventory_shards.aggregate([
+            {"$group": {"_id": "$product_id", "total": {"$sum": "$quantity"}}}
+        ]).to_list(None)
+        if not rows:
+            return
+        totals = {row["_id"]: row["total"] for row in rows}
+        stale = await self.db.products.find(
+            {"id": {"$in": list(totals)}, "sharded_inventory": True, "inventory_migrating": {"$ne": True}},
+            {**LOW_STOCK_FIELDS, "id": 1}
+        ).to_list(None)
+        stale = [p for p in stale if p.get("stock_quantity") != totals[p["id"]]]
+        if not stale:
+            return
+        result = await self.db.products.bulk_write([
+            UpdateOne(
+                {
+                    "id": p["id"], "sharded_inventory": True, "inventory_migrating": {"$ne": True},
+                    "stock_quantity": p.get("stock_quantity")
+                },
+                {"$set": {"stock_quantity": totals[p["id"]]}, **STAMP_UPDATE}
+            )
+            for p in stale
+        ], ordered=False)
+        # Products written concurrently are left for the next sync; reconciliation covers any slip
+        if result.modified_count == len(stale):
+            delta = sum(
+                int(is_low_stock({**p, "stock_quantity": totals[p["id"]]})) - int(is_low_stock(p)) for p in stale
+            )
+            if delta:
+                await dashboard_counters.inc(low_stock_products=delta)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(INVENTORY_SHARD_SYNC)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Inventory shard sync failed: {e}")
+
+    async def start(self):
+        if self.db is None:
+            return
+        await self.db.inventory_shards.create_index("product_id")
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    def stats(self) -> dict:
+        return {
+            "decrements": self.decrements,
+            "retries": self.retries,
+            "split_takes": self.split_takes,
+            "fallbacks": self.fallbacks
+        }
+
+
+# Global sharded inventory instance
+sharded_inventory = ShardedInventory()
@@ -0,0 +1,239 @@
+# Time-bounded stock holds with an in-memory aggregate and background expiry
+import os
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# How long a cart line holds its stock without being touched (seconds)
+HOLD_TTL = int(os.getenv('STOCK_HOLD_TTL', '900'))
+# How often workers pick up holds written by other workers (seconds)
+HOLD_SYNC_INTERVAL = float(os.getenv('STOCK_HOLD_SYNC_INTERVAL', '5'))
+# Each sync re-reads this far behind the newest hold seen, covering clock
+# skew between workers and writes still in flight (seconds)
+HOLD_SYNC_OVERLAP = float(os.getenv('STOCK_HOLD_SYNC_OVERLAP', '10'))
+# How often expired holds are deleted, and how many per batch
+HOLD_SWEEP_INTERVAL = float(os.getenv('STOCK_HOLD_SWEEP_INTERVAL', '30'))
+HOLD_SWEEP_BATCH = int(os.getenv('STOCK_HOLD_SWEEP_BATCH', '500'))
+
+HOLD_FIELDS = {"_id": 1, "product_id": 1, "quantity": 1, "expires_at": 1, "updated_at": 1}
+
+
+def hold_id(owner_id: str, product_id: str) -> str:
+    return f"{owner_id}|{product_id}"
+
+
+class HoldAggregate:
+    """Held quantity per product, expiring holds lazily on read"""
+
+    def __init__(self):
+        self.holds: Dict[str, Tuple[str, int, datetime]] = {}  # id -> (product_id, qty, expires_at)
+        self.by_product: Dict[str, int] = {}
+        self.by_owner: Dict[str, set] = {}
+        self._expiry: List[Tuple[datetime, str]] = []
+
+    def _adjust(self, product_id: str, delta: int):
+        self.by_product[product_id] = self.by_product.get(product_id, 0) + delta
+        if self.by_product[product_id] <= 0:
+            del self.by_product[product_id]
+
+    def set(self, hid: str, product_id: str, quantity: int, expires_at: datetime):
+        self.remove(hid)
+        if quantity <= 0 or expires_at <= datetime.utcnow():
+            return
+        self.holds[hid] = (product_id, quantity, expires_at)
+        self.by_owner.setdefault(hid.split("|", 1)[0], set()).add(hid)
+        self._adjust(product_id, quantity)
+        heapq.heappush(self._expiry, (expires_at, hid))
+
+    def remove(self, hid: str):
+        hold = self.holds.pop(hid, None)
+        if hold:
+            self._adjust(hold[0], -hold[1])
+            owner_id = hid.split("|", 1)[0]
+            owned = self.by_owner.get(owner_id)
+            if owned is not None:
+                owned.discard(hid)
+                if not owned:
+                    del self.by_owner[owner_id]
+
+    def expire(self):
+        now = datetime.utcnow()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, hid = heapq.heappop(self._expiry)
+            hold = self.holds.get(hid)
+            # Holds extended since this heap entry was pushed are left alone
+            if hold and hold[2] == expires_at:
+                self.remove(hid)
+
+    def owned(self, owner_id: str) -> List[str]:
+        return list(self.by_owner.get(owner_id, ()))
+
+    def quantity(self, hid: str) -> int:
+        hold = self.holds.get(hid)
+        return hold[1] if hold and hold[2] > datetime.utcnow() else 0
+
+
+class StockHolds:
+    """Soft reservations of stock by carts, stored in ``stock_holds``.
+
+    Holds are per (owner, product), the same unit checkout reserves stock
+    in: the quantity is the total of the owner's cart lines for the
+    product across its variants. Available stock is on-hand minus everyone
+    else's active holds, answered from memory. Releasing a hold zeroes it
+    rather than deleting it, so other workers pick every change up from
+    ``updated_at``; a sweeper deletes expired and zeroed holds in batches.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.aggregate = HoldAggregate()
+        self._sync_task: Optional[asyncio.Task] = None
+        self._synced_to: Optional[datetime] = None
+        self.synced = 0
+        self.swept = 0
+
+    def set_db(self, database):
+        self.db = database
+
+    def held(self, product_id: str) -> int:
+        self.aggregate.expire()
+        return self.aggregate.by_product.get(product_id, 0)
+
+    def held_by_others(self, owner_id: str, product_id: str) -> int:
+        return max(self.held(product_id) - self.aggregate.quantity(hold_id(owner_id, product_id)), 0)
+
+    def own_hold(self, owner_id: str, product_id: str) -> int:
+        return self.aggregate.quantity(hold_id(owner_id, product_id))
+
+    def available(self, owner_id: str, product_id: str, on_hand: int) -> int:
+        """Stock the owner can still put in their cart, counting their own hold"""
+        return max(on_hand - self.held_by_others(owner_id, product_id), 0)
+
+    async def set_holds(self, owner_id: str, lines: Iterable[Tuple[str, int]], ttl: int = HOLD_TTL):
+        """Set the held quantity for (product_id, quantity) lines in one bulk write"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        writes = []
+        for product_id, quantity in lines:
+            hid = hold_id(owner_id, product_id)
+            writes.append(UpdateOne(
+                {"_id": hid},
+                {"$set": {
+                    "owner_id": owner_id, "product_id": product_id, "quantity": max(quantity, 0),
+                    "expires_at": expires_at if quantity > 0 else now, "updated_at": now
+                }},
+                upsert=True
+            ))
+            self.aggregate.set(hid, product_id, quantity, expires_at)
+        if writes and self.db is not None:
+            await self.db.stock_holds.bulk_write(writes, ordered=False)
+
+    async def release_owner(self, owner_id: str, product_ids: Optional[Iterable[str]] = None):
+        """Drop an owner's holds, optionally only for some products"""
+        query = {"owner_id": owner_id, "quantity": {"$gt": 0}}
+        ids = None if product_ids is None else set(product_ids)
+        if ids is not None:
+            query["product_id"] = {"$in": list(ids)}
+        for hid in self.aggregate.owned(owner_id):
+            if ids is None or self.aggregate.holds[hid][0] in ids:
+                self.aggregate.remove(hid)
+        if self.db is not None:
+            now = datetime.utcnow()
+            await self.db.stock_holds.update_many(
+                query, {"$set": {"quantity": 0, "expires_at": now, "updated_at": now}}
+            )
+
+    def _apply(self, hold: dict):
+        self.aggregate.set(hold["_id"], hold["product_id"], hold["quantity"], hold["expires_at"])
+        if self._synced_to is None or hold["updated_at"] > self._synced_to:
+            self._synced_to = hold["updated_at"]
+
+    async def load(self):
+        """Rebuild the aggregate from all active holds"""
+        if self.db is None:
+            return
+        self.aggregate = HoldAggregate()
+        self._synced_to = datetime.utcnow()
+        async for hold in self.db.stock_holds.find({"expires_at": {"$gt": self._synced_to}}, HOLD_FIELDS):
+            self._apply(hold)
+
+    async def sync(self):
+        """Apply holds changed since the last sync, including releases"""
+        if self.db is None:
+            return
+        if self._synced_to is None:
+            await self.load()
+            return
+        since = self._synced_to - timedelta(seconds=HOLD_SYNC_OVERLAP)
+        async for hold in self.db.stock_holds.find({"updated_at": {"$gt": since}}, HOLD_FIELDS):
+            self._apply(hold)
+            self.synced += 1
+
+    async def sweep(self) -> int:
+        """Delete expired holds in batches; returns how many were removed"""
+        if self.db is None:
+            return 0
+        removed = 0
+        while True:
+            now = datetime.utcnow()
+            batch = await self.db.stock_holds.find(
+                {"expires_at": {"$lte": now}}, {"_id": 1}
+            ).limit(HOLD_SWEEP_BATCH).to_list(HOLD_SWEEP_BATCH)
+            if not batch:
+                break
+            ids = [hold["_id"] for hold in batch]
+            # Re-check expiry so holds extended meanwhile survive
+            result = await self.db.stock_holds.delete_many({"_id": {"$in": ids}, "expires_at": {"$lte": now}})
+            removed += result.deleted_count
+            if len(batch) < HOLD_SWEEP_BATCH:
+                break
+        self.swept += removed
+        return removed
+
+    async def _sync_loop(self):
+        since_sweep = 0.0
+        while True:
+            await asyncio.sleep(HOLD_SYNC_INTERVAL)
+            since_sweep += HOLD_SYNC_INTERVAL
+            try:
+                if since_sweep >= HOLD_SWEEP_INTERVAL:
+                    since_sweep = 0.0
+                    removed = await self.sweep()
+                    if removed:
+                        logger.info(f"Released {removed} expired stock holds")
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Stock hold sync failed: {e}")
+
+    async def start(self):
+        if self.db is None:
+            return
+        await self.db.stock_holds.create_index("expires_at")
+        await self.db.stock_holds.create_index("updated_at")
+        await self.db.stock_holds.create_index([("owner_id", 1), ("product_id", 1)])
+        await self.load()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    def stats(self) -> dict:
+        self.aggregate.expire()
+        return {
+            "active_holds": len(self.aggregate.holds),
+            "held_products": len(self.aggregate.by_product),
+            "synced_changes": self.synced,
+            "swept": self.swept
+        }
+
+
+# Global stock hold instance
+stock_holds = StockHolds()
@@ -0,0 +1,68 @@
+"""
+Local fake Razorpay gateway for payment tests.
+
+Serves the subset of the Orders API the backend uses. Point the backend
+at it with RAZORPAY_BASE_URL=http://127.0.0.1:9010 and tune its behaviour
+with FAKE_GATEWAY_DELAY (seconds) and FAKE_GATEWAY_FAILURE_RATE (0..1),
+or at runtime via POST /__control.
+
+    python tests/fake_gateway.py
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Request
+
+app = FastAPI(title="Fake Razorpay")
+
+settings = {
+    "delay": float(os.getenv('FAKE_GATEWAY_DELAY', '0')),
+    "failure_rate": float(os.getenv('FAKE_GATEWAY_FAILURE_RATE', '0')),
+}
+orders = {}
+
+
+@app.post("/__control")
+async def control(request: Request):
+    """Change delay / failure_rate while tests run"""
+    settings.update(await request.json())
+    return settings
+
+
+@app.post("/v1/orders")
+async def create_order(request: Request):
+    if settings["delay"]:
+        await asyncio.sleep(settings["delay"])
+    if random.random() < settings["failure_rate"]:
+        raise HTTPException(status_code=500, detail={"error": {"code": "SERVER_ERROR"}})
+
+    data = await request.json()
+    order = {
+        "id": f"order_{uuid.uuid4().hex[:14]}",
+        "entity": "order",
+        "amount": data["amount"],
+        "amount_paid": 0,
+        "amount_due": data["amount"],
+        "currency": data.get("currency", "INR"),
+        "receipt": data.get("receipt"),
+        "status": "created",
+        "attempts": 0,
+        "created_at": int(time.time())
+    }
+    orders[order["id"]] = order
+    return order
+
+
+@app.get("/v1/orders/{order_id}")
+async def get_order(order_id: str):
+    if order_id not in orders:
+        raise HTTPException(status_code=404, detail={"error": {"code": "BAD_REQUEST_ERROR"}})
+    return orders[order_id]
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv('FAKE_GATEWAY_PORT', '9010')))
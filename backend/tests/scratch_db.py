@@ -0,0 +1,37 @@
+"""
+Scratch MongoDB database for module tests.
+
+Each test gets a fresh database on MONGO_URL (default a local mongod),
+dropped afterwards. Tests are skipped when MongoDB is not reachable.
+"""
+import os
+import uuid
+import asyncio
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+
+def connect() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+
+
+def run_with_db(test):
+    """Run ``await test(db)`` on a scratch database in its own event loop"""
+    async def scenario():
+        client = connect()
+        try:
+            await client.admin.command("ping")
+        except Exception:
+            client.close()
+            pytest.skip(f"MongoDB not reachable at {MONGO_URL}")
+        name = f"test_{uuid.uuid4().hex[:12]}"
+        try:
+            return await test(client[name])
+        finally:
+            await client.drop_database(name)
+            client.close()
+
+    return asyncio.run(scenario())
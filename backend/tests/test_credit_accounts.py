@@ -0,0 +1,89 @@
+"""
+Credit account tests against a scratch MongoDB database
+Testing: authorization within the limit, decline, reversal, undo when the
+ledger row cannot be written, limit changes
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from scratch_db import run_with_db  # noqa: E402
+from credit_accounts import CreditAccounts, InsufficientCredit, REVERSAL  # noqa: E402
+
+RETAILER = "retailer-1"
+
+
+async def make_accounts(db, credit_limit: float = 1000.0) -> CreditAccounts:
+    await db.retailers.insert_one({"user_id": RETAILER, "credit_limit": credit_limit})
+    accounts = CreditAccounts()
+    accounts.set_db(db)
+    return accounts
+
+
+async def ledger(db) -> list:
+    return await db.credit_ledgers.find({"retailer_id": RETAILER}, {"_id": 0}).sort("seq", 1).to_list(None)
+
+
+class TestCreditAccounts:
+    """Running-balance credit accounts"""
+
+    def test_authorize_and_reverse(self):
+        """A debit within the limit is authorized and its reversal restores credit"""
+        async def check(db):
+            accounts = await make_accounts(db)
+            entry = await accounts.authorize(RETAILER, 600, "order-1", "Order ORD1")
+            assert entry["balance"] == 400 and entry["seq"] == 1
+
+            with pytest.raises(InsufficientCredit) as e:
+                await accounts.authorize(RETAILER, 500, "order-2", "Order ORD2")
+            assert e.value.available == 400
+
+            await accounts.credit(RETAILER, 600, "Reversal of Order ORD1", "order-1", REVERSAL)
+            assert await accounts.balance(RETAILER) == {
+                "credit_limit": 1000.0, "used_credit": 0.0, "available_credit": 1000.0
+            }
+            rows = await ledger(db)
+            assert [(r["seq"], r["delta"], r["balance"]) for r in rows] == [(1, -600, 400), (2, 600, 1000)]
+            assert accounts.stats() == {"authorizations": 1, "declines": 1}
+
+        run_with_db(check)
+        print("✓ Authorization, decline and reversal")
+
+    def test_failed_ledger_write_is_undone(self):
+        """If the ledger row cannot be written, balance and seq are put back"""
+        async def check(db):
+            accounts = await make_accounts(db)
+            await accounts.authorize(RETAILER, 100, "order-1", "Order ORD1")
+            # A row already holding the next seq makes the ledger insert fail
+            await db.credit_ledgers.create_index([("retailer_id", 1), ("seq", 1)], unique=True)
+            await db.credit_ledgers.insert_one({"retailer_id": RETAILER, "seq": 2})
+
+            with pytest.raises(Exception):
+                await accounts.authorize(RETAILER, 200, "order-2", "Order ORD2")
+            account = await db.credit_accounts.find_one({"_id": RETAILER})
+            assert (account["available"], account["used"], account["seq"]) == (900, 100, 1)
+
+            with pytest.raises(Exception):
+                await accounts.set_limit(RETAILER, 2000)
+            account = await db.credit_accounts.find_one({"_id": RETAILER})
+            assert (account["credit_limit"], account["available"], account["seq"]) == (1000, 900, 1)
+
+        run_with_db(check)
+        print("✓ Movement undone when its ledger row fails")
+
+    def test_set_limit_shifts_available(self):
+        """Raising the limit adds the difference to available credit as an adjustment"""
+        async def check(db):
+            accounts = await make_accounts(db)
+            await accounts.authorize(RETAILER, 300, "order-1", "Order ORD1")
+            await accounts.set_limit(RETAILER, 1500)
+            assert (await accounts.balance(RETAILER))["available_credit"] == 1200
+            rows = await ledger(db)
+            assert rows[-1]["transaction_type"] == "adjustment" and rows[-1]["delta"] == 500
+
+        run_with_db(check)
+        print("✓ Limit change recorded")
@@ -0,0 +1,196 @@
+"""
+Inventory reservation tests against a scratch MongoDB database
+Testing: all-or-nothing reservation, rollback of applied lines, release,
+sharded stock, low-stock dashboard counter
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from scratch_db import run_with_db  # noqa: E402
+from inventory import Inventory, StockShortage  # noqa: E402
+from sharded_inventory import sharded_inventory  # noqa: E402
+from dashboard_counters import dashboard_counters, COUNTERS_ID, LOW_STOCK_THRESHOLD  # noqa: E402
+
+
+async def make_inventory(db, **stock) -> Inventory:
+    await db.products.insert_many([
+        {"id": pid, "name": pid.title(), "stock_quantity": qty, "is_active": True} for pid, qty in stock.items()
+    ])
+    inventory = Inventory()
+    inventory.set_db(db)
+    return inventory
+
+
+async def stock_of(db, product_id: str) -> int:
+    return (await db.products.find_one({"id": product_id}))["stock_quantity"]
+
+
+class TestInventoryReservation:
+    """Guarded all-or-nothing stock reservation"""
+
+    def test_reserve_decrements_every_line(self):
+        """Repeated lines are merged and every product is decremented"""
+        async def check(db):
+            inventory = await make_inventory(db, rice=10, dal=5)
+            await inventory.reserve([("rice", 3), ("dal", 2), ("rice", 1)])
+            assert await stock_of(db, "rice") == 6
+            assert await stock_of(db, "dal") == 3
+
+        run_with_db(check)
+        print("✓ Reservation decremented every line")
+
+    def test_shortage_rolls_back_applied_lines(self):
+        """A short line leaves stock untouched and reports only that line"""
+        async def check(db):
+            inventory = await make_inventory(db, rice=100, dal=1, oil=10)
+            # Many earlier reservations must not affect which lines are rolled back
+            for _ in range(40):
+                await inventory.reserve([("rice", 1)])
+
+            with pytest.raises(StockShortage) as e:
+                await inventory.reserve([("rice", 5), ("dal", 3), ("oil", 2)])
+            assert await stock_of(db, "rice") == 60
+            assert await stock_of(db, "dal") == 1
+            assert await stock_of(db, "oil") == 10
+            assert e.value.shortfalls == [{
+                "product_id": "dal", "product_name": "Dal", "requested": 3, "available": 1, "shortfall": 2
+            }]
+            assert inventory.stats()["rollbacks"] == 1
+
+        run_with_db(check)
+        print("✓ Applied lines restored after a shortage")
+
+    def test_held_stock_stays_on_shelf(self):
+        """Stock held by other carts is not reservable"""
+        async def check(db):
+            inventory = await make_inventory(db, rice=10)
+            with pytest.raises(StockShortage) as e:
+                await inventory.reserve([("rice", 8)], held={"rice": 4})
+            assert e.value.shortfalls[0]["available"] == 6
+            assert await stock_of(db, "rice") == 10
+            await inventory.reserve([("rice", 6)], held={"rice": 4})
+            assert await stock_of(db, "rice") == 4
+
+        run_with_db(check)
+        print("✓ Held stock respected")
+
+    def test_release_returns_stock(self):
+        """Releasing a reservation puts its quantities back"""
+        async def check(db):
+            inventory = await make_inventory(db, rice=10, dal=5)
+            lines = [("rice", 4), ("dal", 5)]
+            await inventory.reserve(lines)
+            await inventory.release(lines)
+            assert await stock_of(db, "rice") == 10
+            assert await stock_of(db, "dal") == 5
+
+        run_with_db(check)
+        print("✓ Released stock returned")
+
+    def test_low_stock_counter_follows_reservations(self):
+        """Crossing LOW_STOCK_THRESHOLD either way adjusts low_stock_products"""
+        async def low_stock(db) -> int:
+            doc = await db.dashboard_counters.find_one({"_id": COUNTERS_ID})
+            return (doc or {}).get("low_stock_products", 0)
+
+        async def check(db):
+            inventory = await make_inventory(db, rice=LOW_STOCK_THRESHOLD + 5, dal=LOW_STOCK_THRESHOLD + 50)
+            dashboard_counters.set_db(db)
+            try:
+                await inventory.reserve([("rice", 3), ("dal", 3)])
+                assert await low_stock(db) == 0
+                await inventory.reserve([("rice", 2)])
+                assert await low_stock(db) == 1
+                await inventory.release([("rice", 5)])
+                assert await low_stock(db) == 0
+                with pytest.raises(StockShortage):
+                    await inventory.reserve([("rice", 10), ("dal", 100)])
+                assert await low_stock(db) == 0
+            finally:
+                dashboard_counters.set_db(None)
+
+        run_with_db(check)
+        print("✓ Low-stock counter kept in step with stock")
+
+
+class TestShardedInventory:
+    """Reservations of products whose stock is split over counter shards"""
+
+    async def make_sharded(self, db, stock: int, shards: int = 8) -> Inventory:
+        inventory = await make_inventory(db, rice=stock)
+        sharded_inventory.set_db(db)
+        await sharded_inventory.enable("rice", shards)
+        return inventory
+
+    def test_decrement_spans_shards(self):
+        """A quantity above total/N is gathered from several shards"""
+        async def check(db):
+            inventory = await self.make_sharded(db, 80)
+            await inventory.reserve([("rice", 20)], sharded={"rice": 8})
+            assert await sharded_inventory.total("rice") == 60
+            await inventory.reserve([("rice", 60)], sharded={"rice": 8})
+            assert await sharded_inventory.total("rice") == 0
+
+        run_with_db(check)
+        print("✓ Sharded decrement gathered from several shards")
+
+    def test_sharded_shortage_reports_and_restores(self):
+        """A short sharded line restores every shard and reports the real shortfall"""
+        async def check(db):
+            inventory = await self.make_sharded(db, 80)
+            with pytest.raises(StockShortage) as e:
+                await inventory.reserve([("rice", 70)], held={"rice": 20}, sharded={"rice": 8})
+            assert e.value.shortfalls == [{
+                "product_id": "rice", "product_name": "Rice", "requested": 70, "available": 60, "shortfall": 10
+            }]
+            assert await sharded_inventory.total("rice") == 80
+
+        run_with_db(check)
+        print("✓ Sharded shortage restored and reported")
+
+    def test_set_total_below_any_shard(self):
+        """Lowering stock by more than one shard holds still succeeds"""
+        async def check(db):
+            await self.make_sharded(db, 80)
+            assert await sharded_inventory.set_total("rice", 8, 25)
+            assert await sharded_inventory.total("rice") == 25
+
+        run_with_db(check)
+        print("✓ Sharded stock set to an absolute level")
+
+    def test_give_back_after_fold_lands_on_product(self):
+        """Stock given back to a shard removed by disable() is kept on the product"""
+        async def check(db):
+            inventory = await self.make_sharded(db, 80)
+            parts = await sharded_inventory.decrement("rice", 10, 8)
+            assert await sharded_inventory.disable("rice") == 70
+            await sharded_inventory.give_back(parts)
+            assert await stock_of(db, "rice") == 80
+            await inventory.reserve([("rice", 80)])
+            assert await stock_of(db, "rice") == 0
+
+        run_with_db(check)
+        print("✓ Late give-back kept after disabling shards")
+
+    def test_no_reservation_while_migrating(self):
+        """Neither plain nor shard reservations run against half-migrated stock"""
+        async def check(db):
+            inventory = await self.make_sharded(db, 80)
+            await db.products.update_one({"id": "rice"}, {"$set": {"inventory_migrating": True}})
+            await db.inventory_shards.update_many({"product_id": "rice"}, {"$set": {"migrating": True}})
+            with pytest.raises(StockShortage):
+                await inventory.reserve([("rice", 5)], sharded={"rice": 8})
+            await db.products.update_one(
+                {"id": "rice"}, {"$set": {"sharded_inventory": False, "stock_quantity": 80}}
+            )
+            with pytest.raises(StockShortage):
+                await inventory.reserve([("rice", 5)])
+            assert await sharded_inventory.total("rice") == 80
+
+        run_with_db(check)
+        print("✓ Reservations refused during migration")
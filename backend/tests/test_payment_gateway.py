@@ -0,0 +1,120 @@
+"""
+Payment gateway adapter tests against the local fake gateway
+Testing: order creation, timeouts, circuit breaker, event loop not blocked
+"""
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+import razorpay
+import requests
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_gateway import app as fake_app  # noqa: E402
+from payment_gateway import PaymentGateway, GatewayUnavailable, OPEN  # noqa: E402
+
+FAKE_PORT = 9011
+FAKE_URL = f"http://127.0.0.1:{FAKE_PORT}"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fake_gateway():
+    server = uvicorn.Server(uvicorn.Config(fake_app, host="127.0.0.1", port=FAKE_PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    for _ in range(50):
+        if server.started:
+            break
+        time.sleep(0.1)
+    yield
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+def configure(**settings):
+    requests.post(f"{FAKE_URL}/__control", json={"delay": 0, "failure_rate": 0, **settings})
+
+
+def make_gateway(read_timeout: float = 1.0) -> PaymentGateway:
+    client = razorpay.Client(auth=("rzp_test_key", "secret"), base_url=FAKE_URL)
+    gateway = PaymentGateway(client)
+    gateway.timeout = (0.5, read_timeout)
+    gateway.breaker.threshold = 2
+    gateway.breaker.reset_after = 0.5
+    return gateway
+
+
+class TestPaymentGateway:
+    """Razorpay adapter behaviour"""
+
+    def test_create_order(self):
+        """Gateway order is created with the amount in paise"""
+        configure()
+        gateway = make_gateway()
+        order = asyncio.run(gateway.create_order(123.45, "ORD1000001"))
+        assert order["id"].startswith("order_")
+        assert order["amount"] == 12345
+        assert order["receipt"] == "ORD1000001"
+        assert gateway.stats()["calls"] == 1
+        print(f"✓ Gateway order created: {order['id']}")
+
+    def test_slow_gateway_does_not_block_loop(self):
+        """Other coroutines keep running while a gateway call is in flight"""
+        configure(delay=0.5)
+        gateway = make_gateway()
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.05)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            await gateway.create_order(10, "ORD1000002")
+            task.cancel()
+            return ticks
+
+        ticks = asyncio.run(scenario())
+        assert ticks >= 5
+        print(f"✓ Event loop ticked {ticks} times during a slow gateway call")
+
+    def test_timeout_opens_circuit(self):
+        """Timeouts count as failures and open the circuit, then calls fail fast"""
+        configure(delay=1.5)
+        gateway = make_gateway(read_timeout=0.3)
+        for _ in range(2):
+            with pytest.raises(GatewayUnavailable):
+                asyncio.run(gateway.create_order(10, "ORD1000003"))
+        assert gateway.breaker.state == OPEN
+
+        started = time.perf_counter()
+        with pytest.raises(GatewayUnavailable):
+            asyncio.run(gateway.create_order(10, "ORD1000004"))
+        assert time.perf_counter() - started < 0.1
+        assert gateway.stats()["short_circuited"] == 1
+        print(f"✓ Circuit opened after timeouts: {gateway.stats()}")
+
+    def test_circuit_recovers(self):
+        """After the reset window a successful trial call closes the circuit"""
+        configure(failure_rate=1)
+        gateway = make_gateway()
+        for _ in range(2):
+            with pytest.raises(GatewayUnavailable):
+                asyncio.run(gateway.create_order(10, "ORD1000005"))
+        assert gateway.breaker.state == OPEN
+
+        configure()
+        time.sleep(0.6)
+        order = asyncio.run(gateway.create_order(10, "ORD1000006"))
+        assert order["status"] == "created"
+        assert gateway.breaker.state == "closed"
+        print("✓ Circuit closed after successful trial call")
@@ -0,0 +1,67 @@
+"""
+Server-side pricing tests
+Testing: GST rates for products created through the API, explicit 0% rates,
+HSN lookups
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pricing import DEFAULT_GST_RATE, PriceEntry, PricingEngine, hsn_gst_rate  # noqa: E402
+
+
+def api_product(**overrides) -> dict:
+    """A product as POST /products stores it when the client sends no GST fields"""
+    product = {
+        "id": "atta-5kg",
+        "name": "Atta 5kg",
+        "description": None,
+        "category_id": "staples",
+        "brand_id": None,
+        "images": [],
+        "mrp": 300.0,
+        "retailer_price": 250.0,
+        "customer_price": 280.0,
+        "margin_percent": 0.0,
+        "stock_quantity": 40,
+        "min_order_qty": 1,
+        "max_order_qty": None,
+        "unit_size": "5kg",
+        "expiry_date": None,
+        "gst_percent": None,
+        "is_active": True,
+        "pricing_version": 1
+    }
+    product.update(overrides)
+    return product
+
+
+def quote(product: dict, quantity: int = 2) -> dict:
+    engine = PricingEngine()
+    entries = {product["id"]: PriceEntry(product)}
+    return engine.finalize(engine.price_lines(entries, [(product["id"], quantity, None)], None))
+
+
+class TestGstRate:
+    """GST rate resolution for priced lines"""
+
+    def test_api_product_is_taxed(self):
+        """A product created without GST fields is taxed at the default rate, not 0%"""
+        priced = quote(api_product())
+        assert DEFAULT_GST_RATE > 0
+        assert priced["items"][0]["gst_rate"] == DEFAULT_GST_RATE
+        assert priced["gst_amount"] == round(560.0 * DEFAULT_GST_RATE / 100, 2)
+        print("✓ API-created product taxed at the default rate")
+
+    def test_hsn_code_sets_rate(self):
+        """Without an explicit rate the HSN table decides"""
+        assert PriceEntry(api_product(hsn_code="1905 90")).gst_rate == hsn_gst_rate("190590") == 18.0
+        print("✓ HSN rate used when no rate is set")
+
+    def test_explicit_zero_rate_kept(self):
+        """An explicit 0% (e.g. fresh produce) is a rate, not a missing one"""
+        priced = quote(api_product(gst_percent=0.0, hsn_code="1905"))
+        assert priced["gst_amount"] == 0.0
+        assert PriceEntry(api_product(gst_rate=12.0, gst_percent=None)).gst_rate == 12.0
+        print("✓ Explicit 0% rate kept")
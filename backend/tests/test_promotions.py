@@ -0,0 +1,89 @@
+"""
+Promotion validation and engine tests
+Testing: merged PATCH validation with string dates, required fields,
+target de-duplication, loading stored promotions
+"""
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from scratch_db import run_with_db  # noqa: E402
+from promotions import PromotionEngine, PromotionError, PromotionTables, validate_promotion  # noqa: E402
+
+
+def line(product_id: str = "rice", quantity: int = 10, price: float = 100.0, **extra) -> dict:
+    return {"product_id": product_id, "quantity": quantity, "price": price, **extra}
+
+
+def apply(promotions, lines) -> float:
+    engine = PromotionEngine()
+    engine.tables = PromotionTables(promotions)
+    return engine.apply(lines)
+
+
+class TestPromotionValidation:
+    """validate_promotion on new and merged (PATCH) documents"""
+
+    def test_patch_with_string_dates(self):
+        """ISO date strings in a PATCH become datetimes and the rule stays usable"""
+        existing = validate_promotion({"name": "Rice 10% off", "kind": "percent_off", "targets": ["rice"], "percent": 10})
+        starts = (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0)
+        ends = starts + timedelta(days=7)
+        updated = validate_promotion({**existing, "starts_at": starts.isoformat(), "ends_at": ends.isoformat()})
+        assert updated["starts_at"] == starts
+        assert updated["ends_at"] == ends
+        assert updated["id"] == existing["id"]
+        assert apply([updated], [line()]) == 100.0
+        print("✓ String dates parsed on PATCH")
+
+    def test_malformed_slabs_rejected(self):
+        """Slabs that would break compilation are rejected"""
+        with pytest.raises(PromotionError):
+            validate_promotion({"name": "Bulk", "kind": "slab", "targets": ["rice"], "slabs": [{"min": "ten"}]})
+        print("✓ Malformed slabs rejected")
+
+    def test_percent_and_amount_required(self):
+        """percent_off needs percent and flat_off needs amount"""
+        with pytest.raises(PromotionError):
+            validate_promotion({"name": "Off", "kind": "percent_off", "targets": ["rice"]})
+        with pytest.raises(PromotionError):
+            validate_promotion({"name": "Off", "kind": "flat_off", "targets": ["rice"]})
+        assert validate_promotion({"name": "Off", "kind": "flat_off", "targets": ["rice"], "amount": 5})["amount"] == 5
+        print("✓ percent / amount required")
+
+    def test_duplicate_targets_counted_once(self):
+        """A target listed twice does not double a pooled measure"""
+        promo = validate_promotion({
+            "name": "Brand slab", "kind": "slab", "scope": "brand", "targets": ["acme", "acme"],
+            "pooled": True, "slabs": [{"min": 20, "percent": 10}]
+        })
+        assert promo["targets"] == ["acme"]
+        # 10 + 5 units pooled is below the 20-unit slab
+        assert apply([promo], [line(brand_id="acme"), line("dal", 5, brand_id="acme")]) == 0.0
+        print("✓ Duplicate targets dropped")
+
+
+class TestPromotionEngine:
+    """Compiling stored promotions"""
+
+    def test_load_skips_malformed_documents(self):
+        """A malformed stored promotion is skipped instead of failing the load"""
+        async def check(db):
+            good = validate_promotion({"name": "Rice 10% off", "kind": "percent_off", "targets": ["rice"], "percent": 10})
+            await db.promotions.insert_many([
+                good,
+                {"id": "bad", "name": "Bad slab", "kind": "slab", "targets": ["rice"], "slabs": [{"min": 5}], "is_active": True}
+            ])
+            engine = PromotionEngine()
+            engine.set_db(db)
+            await engine.load()
+            assert engine.tables.count == 1
+            assert engine.apply([line()]) == 100.0
+
+        run_with_db(check)
+        print("✓ Malformed stored promotion skipped")
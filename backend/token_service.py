@@ -0,0 +1,233 @@
+# Signed access/refresh tokens with an in-memory revocation set
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+# Token configuration
+JWT_SECRET = os.getenv('JWT_SECRET', '')
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+ACCESS_TOKEN_TTL = int(os.getenv('ACCESS_TOKEN_TTL', '3600'))  # 1 hour
+REFRESH_TOKEN_TTL = int(os.getenv('REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))  # 30 days
+REVOCATION_SYNC_INTERVAL = int(os.getenv('REVOCATION_SYNC_INTERVAL', '30'))  # seconds
+
+# "signed" issues JWTs verified in-process, "opaque" keeps the legacy
+# per-user token stored on the user document
+TOKEN_MODE = os.getenv('AUTH_TOKEN_MODE', 'signed' if JWT_SECRET else 'opaque').lower()
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+
+class TokenError(Exception):
+    """Raised when a token is malformed, expired or revoked"""
+
+
+class RevocationSet:
+    """Compact revocation state: revoked token ids plus per-user cut-off times.
+
+    Revoked ids are only kept until the token would have expired anyway, so
+    the set stays proportional to recent logouts rather than to history.
+    """
+
+    def __init__(self):
+        self._jtis: Dict[str, float] = {}  # jti -> token expiry (epoch seconds)
+        self._users: Dict[str, int] = {}  # user_id -> tokens issued at or before this second are revoked
+
+    def revoke_jti(self, jti: str, expires_at: float):
+        self._jtis[jti] = expires_at
+
+    def revoke_user(self, user_id: str, revoked_before: int):
+        self._users[user_id] = max(self._users.get(user_id, 0), revoked_before)
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self._jtis:
+            return True
+        revoked_before = self._users.get(claims.get("sub"))
+        return revoked_before is not None and claims.get("iat", 0) <= revoked_before
+
+    def prune(self, now: Optional[float] = None):
+        """Forget revocations for tokens that have expired on their own"""
+        now = now or time.time()
+        self._jtis = {jti: exp for jti, exp in self._jtis.items() if exp > now}
+        self._users = {
+            user_id: cutoff for user_id, cutoff in self._users.items()
+            if cutoff + REFRESH_TOKEN_TTL > now
+        }
+
+    def __len__(self):
+        return len(self._jtis) + len(self._users)
+
+
+class TokenService:
+    def __init__(self, secret: str = JWT_SECRET, mode: str = TOKEN_MODE):
+        self.secret = secret
+        self.mode = mode
+        self.revocations = RevocationSet()
+        self.db = None
+        self._last_sync: Optional[float] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        if self.mode == "signed" and not self.secret:
+            logger.warning("AUTH_TOKEN_MODE=signed but JWT_SECRET is not set; falling back to opaque tokens")
+            self.mode = "opaque"
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "signed"
+
+    @staticmethod
+    def is_signed(token: str) -> bool:
+        """JWTs have three dot-separated segments; legacy tokens are plain hex"""
+        return token.count(".") == 2
+
+    def _encode(self, user: dict, token_type: str, ttl: int) -> str:
+        now = int(time.time())
+        claims = {
+            "sub": user["id"],
+            "role": user["role"],
+            "phone": user["phone"],
+            "typ": token_type,
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + ttl
+        }
+        if token_type == ACCESS:
+            claims["name"] = user.get("name")
+            claims["email"] = user.get("email")
+        return jwt.encode(claims, self.secret, algorithm=JWT_ALGORITHM)
+
+    def issue_pair(self, user: dict) -> dict:
+        """Issue an access token and a refresh token for a user document"""
+        return {
+            "token": self._encode(user, ACCESS, ACCESS_TOKEN_TTL),
+            "refresh_token": self._encode(user, REFRESH, REFRESH_TOKEN_TTL),
+            "expires_in": ACCESS_TOKEN_TTL
+        }
+
+    def verify(self, token: str, token_type: str = ACCESS) -> dict:
+        """Verify signature, expiry, type and revocation without any I/O"""
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[JWT_ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            raise TokenError("Token expired")
+        except jwt.InvalidTokenError:
+            raise TokenError("Invalid token")
+
+        if claims.get("typ") != token_type:
+            raise TokenError("Invalid token type")
+        if self.revocations.is_revoked(claims):
+            raise TokenError("Token revoked")
+        return claims
+
+    async def revoke(self, claims: dict):
+        """Revoke a single token (logout)"""
+        self.revocations.revoke_jti(claims["jti"], claims["exp"])
+        await self._persist({"_id": f"jti:{claims['jti']}", "jti": claims["jti"], "expires_at": claims["exp"]})
+
+    async def claim(self, claims: dict) -> bool:
+        """Atomically use up a refresh token; False if it was already used or revoked.
+
+        The revocation entry is keyed by jti and upserted in one
+        find_one_and_update, so of two concurrent refreshes only the one
+        that inserts it wins.
+        """
+        if self.revocations.is_revoked(claims):
+            return False
+        self.revocations.revoke_jti(claims["jti"], claims["exp"])
+        if self.db is None:
+            return True
+        now = time.time()
+        previous = await self.db.token_revocations.find_one_and_update(
+            {"_id": f"jti:{claims['jti']}"},
+            {"$setOnInsert": {
+                "jti": claims["jti"],
+                "expires_at": claims["exp"],
+                "created_at": now,
+                "purge_at": datetime.utcfromtimestamp(claims["exp"])
+            }},
+            upsert=True
+        )
+        return previous is None
+
+    async def revoke_user(self, user_id: str):
+        """Revoke every token issued to a user so far (blocking)"""
+        # Whole seconds, like the iat claim it is compared with: a token
+        # issued in the same second as the revocation is revoked too
+        revoked_before = int(time.time())
+        self.revocations.revoke_user(user_id, revoked_before)
+        await self._persist({
+            "user_id": user_id,
+            "revoked_before": revoked_before,
+            "expires_at": revoked_before + REFRESH_TOKEN_TTL
+        })
+
+    # ---------- persistence so revocations hold across workers ----------
+
+    def set_db(self, database):
+        self.db = database
+
+    async def _persist(self, entry: dict):
+        if self.db is None:
+            return
+        try:
+            entry["created_at"] = time.time()
+            entry["purge_at"] = datetime.utcfromtimestamp(entry["expires_at"])
+            if "_id" in entry:
+                await self.db.token_revocations.update_one({"_id": entry.pop("_id")}, {"$setOnInsert": entry}, upsert=True)
+            else:
+                await self.db.token_revocations.insert_one(entry)
+        except Exception as e:
+            logger.error(f"Error persisting token revocation: {str(e)}")
+
+    async def sync_revocations(self):
+        """Load revocations written since the last sync (by any worker)"""
+        if self.db is None:
+            return
+        query = {"expires_at": {"$gt": time.time()}}
+        if self._last_sync is not None:
+            # Small overlap so entries written during the previous sync are not missed
+            query["created_at"] = {"$gte": self._last_sync - 1}
+        self._last_sync = time.time()
+
+        async for entry in self.db.token_revocations.find(query, {"_id": 0}):
+            if entry.get("jti"):
+                self.revocations.revoke_jti(entry["jti"], entry["expires_at"])
+            elif entry.get("user_id"):
+                self.revocations.revoke_user(entry["user_id"], int(entry["revoked_before"]))
+        self.revocations.prune()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+            try:
+                await self.sync_revocations()
+            except Exception as e:
+                logger.warning(f"Token revocation sync failed: {e}")
+
+    async def start(self):
+        """Create indexes, load current revocations and start periodic sync"""
+        if self.db is None or not self.enabled:
+            return
+        await self.db.token_revocations.create_index("created_at")
+        await self.db.token_revocations.create_index("purge_at", expireAfterSeconds=0)
+        await self.sync_revocations()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "revocations": len(self.revocations)}
+
+
+# Global token service instance
+token_service = TokenService()